@@ -0,0 +1,135 @@
+import hashlib
+import json
+from collections import namedtuple
+from identitykeys import PrivateIdentityKey
+from src import consts
+
+
+# Synthetic identity chains. Keys are derived from fixed seeds and entry hashes from the entries' position, so the
+# same scenario always produces the same chain.
+
+ChainEntry = namedtuple('ChainEntry', ['entry_hash', 'external_ids', 'content', 'height'])
+Chain = namedtuple('Chain', ['name', 'chain_id', 'entries'])
+
+ENTRIES_PER_BLOCK = 10
+
+
+class ChainBuilder:
+    """Builds up an identity chain, keeping track of its active keys so that valid key replacements can be signed"""
+
+    def __init__(self, name: str, key_count=3):
+        self.name = name
+        self.chain_id = hashlib.sha256(name.encode()).hexdigest()
+        self.entries = []
+        self.key_seq = 0
+        self.keys = [self._new_key() for _ in range(key_count)]
+        content = json.dumps({'version': 1, 'keys': [k.get_public_key().to_string() for k in self.keys]},
+                             separators=(',', ':')).encode()
+        self._add([consts.IDENTITY_CHAIN_TAG, name.encode(), b'benchmark'], content)
+
+    def replace_key(self, priority: int, signer_priority=None):
+        """Add a valid replacement of the key at the given priority, signed by the key at signer_priority"""
+        signer_priority = priority if signer_priority is None else signer_priority
+        old_key, signer = self.keys[priority], self.keys[signer_priority]
+        new_key = self._new_key()
+        self.keys[priority] = new_key
+        self._add_replacement(old_key, new_key, signer, signer)
+
+    def replace_key_invalid(self, priority: int):
+        """Add a replacement of the key at the given priority whose signature doesn't match the signer key, so that
+        it is only rejected once its signature has been verified"""
+        forger = self._new_key()
+        self._add_replacement(self.keys[priority], self._new_key(), forger, self.keys[priority])
+
+    def add_spam(self, size=64):
+        seq = str(len(self.entries)).encode()
+        self._add([b'spam', seq], hashlib.sha256(seq).digest() * (size // 32))
+
+    def build(self):
+        return Chain(self.name, self.chain_id, list(self.entries))
+
+    def _new_key(self):
+        self.key_seq += 1
+        seed = hashlib.sha256('{}/{}'.format(self.name, self.key_seq).encode()).digest()
+        return PrivateIdentityKey(seed_bytes=seed)
+
+    def _add_replacement(self, old_key, new_key, signing_key, claimed_signer):
+        old_pub = old_key.get_public_key().to_string()
+        new_pub = new_key.get_public_key().to_string()
+        message = self.chain_id.encode() + old_pub.encode() + new_pub.encode()
+        self._add([
+            consts.KEY_REPLACEMENT_TAG,
+            old_pub.encode(),
+            new_pub.encode(),
+            signing_key.sign(message),
+            claimed_signer.get_public_key().to_string().encode()
+        ], b'')
+
+    def _add(self, external_ids: list, content: bytes):
+        position = len(self.entries)
+        entry_hash = hashlib.sha256(self.chain_id.encode() + str(position).encode()).hexdigest()
+        height = 1000 + position // ENTRIES_PER_BLOCK
+        self.entries.append(ChainEntry(entry_hash, external_ids, content, height))
+
+
+def valid_chain(scale=1.0):
+    """A typical identity: a few dozen key replacements and a little spam"""
+    builder = ChainBuilder('valid')
+    for i in range(_count(50, scale)):
+        builder.replace_key(i % 3)
+        if i % 5 == 0:
+            builder.add_spam()
+    return builder.build()
+
+
+def spam_chain(scale=1.0):
+    """An identity whose chain is mostly spam, with only a handful of key replacements"""
+    builder = ChainBuilder('spam')
+    for i in range(_count(2000, scale)):
+        if i % 400 == 0:
+            builder.replace_key(2)
+        builder.add_spam()
+    return builder.build()
+
+
+def replacements_chain(scale=1.0):
+    """Thousands of valid key replacements, each depending on the previous one"""
+    builder = ChainBuilder('replacements')
+    for i in range(_count(2000, scale)):
+        builder.replace_key(i % 3)
+    return builder.build()
+
+
+def invalid_replacements_chain(scale=1.0):
+    """Thousands of key replacements whose signatures don't verify, among a few valid ones"""
+    builder = ChainBuilder('invalid_replacements')
+    for i in range(_count(2000, scale)):
+        if i % 500 == 0:
+            builder.replace_key(0)
+        builder.replace_key_invalid(i % 3)
+    return builder.build()
+
+
+def identity_chains(count: int, scale=1.0):
+    """A population of distinct identities, each with a few key replacements and a little spam (for load tests)"""
+    chains = []
+    for i in range(count):
+        builder = ChainBuilder('identity-{}'.format(i))
+        for j in range(_count(10, scale)):
+            builder.replace_key(j % 3)
+            if j % 5 == 0:
+                builder.add_spam()
+        chains.append(builder.build())
+    return chains
+
+
+def _count(count: int, scale: float):
+    return max(int(count * scale), 1)
+
+
+SCENARIOS = {
+    'valid': valid_chain,
+    'spam': spam_chain,
+    'replacements': replacements_chain,
+    'invalid_replacements': invalid_replacements_chain
+}
@@ -0,0 +1,294 @@
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from benchmarks.chains import identity_chains
+from benchmarks.run import _change, _git_commit
+from benchmarks.standins import StandIns
+from collections import Counter
+from http.client import HTTPConnection, HTTPException
+from src import consts
+from urllib.request import urlopen
+
+
+# Load-tests the driver the way it is deployed: gunicorn serving the app of docker/Dockerfile, pointed at local
+# stand-ins of the backends. A Zipf-distributed mix of existing, missing and testnet DIDs is replayed through the three
+# route shapes by closed-loop clients, for each worker configuration and concurrency level, and the throughput and
+# latency percentiles are written as JSON. Requires gunicorn (and aiohttp for the asyncio server). Run it from the
+# repository root:
+#   python -m benchmarks.load --workers 1 --workers 4 --concurrency 1 --concurrency 16 --output load.json
+
+SERVERS = {
+    'sync': ('did_factom_driver:app', 'sync'),
+    'async': ('did_factom_driver_async:app', 'aiohttp.GunicornWebWorker')
+}
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def request_mix(chains: list, count: int, missing_ratio=0.1, testnet_ratio=0.1, zipf_s=1.1, seed=0):
+    """Paths of count resolution requests. There is one DID per chain, which is missing (i.e. a chain that doesn't
+    exist) or on testnet at the given ratios, and otherwise on mainnet with or without the network in it. DIDs are
+    ranked at random, and the DID at rank k is requested with a probability proportional to 1 / k^zipf_s."""
+    rng = random.Random(seed)
+    dids = []
+    for chain in chains:
+        draw = rng.random()
+        if draw < missing_ratio:
+            chain_id = hashlib.sha256('missing/{}'.format(chain.chain_id).encode()).hexdigest()
+            dids.append(consts.DID_PREFIX + chain_id)
+        elif draw < missing_ratio + testnet_ratio:
+            dids.append(consts.DID_PREFIX + consts.NETWORK_TESTNET + chain.chain_id)
+        elif rng.random() < 0.5:
+            dids.append(consts.DID_PREFIX + consts.NETWORK_MAINNET + chain.chain_id)
+        else:
+            dids.append(consts.DID_PREFIX + chain.chain_id)
+    rng.shuffle(dids)
+    weights = list(itertools.accumulate(1 / (rank ** zipf_s) for rank in range(1, len(dids) + 1)))
+    return ['/1.0/identifiers/' + did for did in rng.choices(dids, cum_weights=weights, k=count)]
+
+
+class DriverServer:
+    """The driver under gunicorn, with the given number of worker processes and threads per worker, resolving with
+    the given connection type against the stand-ins"""
+
+    def __init__(self, stand_ins: StandIns, workers=1, threads=1, server='sync', connection='factomd', env=None):
+        self.stand_ins = stand_ins
+        self.workers = workers
+        self.threads = threads
+        self.server = server
+        self.connection = connection
+        self.env = env or {}
+        self.url = None
+        self._process = None
+
+    def start(self, timeout=30):
+        app, worker_class = SERVERS[self.server]
+        port = _free_port()
+        command = [sys.executable, '-m', 'gunicorn', '-b', '127.0.0.1:{}'.format(port), '--workers', str(self.workers),
+                   '--worker-class', worker_class, app]
+        if self.server == 'sync' and self.threads > 1:
+            command[-1:-1] = ['--threads', str(self.threads)]
+        self._process = subprocess.Popen(command, env=self._environ(), stdout=subprocess.DEVNULL,
+                                         stderr=subprocess.DEVNULL)
+        self.url = 'http://127.0.0.1:{}'.format(port)
+
+        give_up_at = time.monotonic() + timeout
+        while time.monotonic() < give_up_at:
+            if self._process.poll() is not None:
+                raise RuntimeError('gunicorn exited with {}'.format(self._process.returncode))
+            try:
+                urlopen(self.url + '/health', timeout=1).read()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError('The driver did not start within {}s'.format(timeout))
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+            self._process = None
+
+    def _environ(self):
+        prefix = 'uniresolver_driver_did_factom_'
+        environ = dict(os.environ)
+        environ.update({
+            prefix + 'factomConnection': self.connection,
+            prefix + 'rpcUrlMainnet': self.stand_ins.urls['factomd'],
+            prefix + 'rpcUrlTestnet': self.stand_ins.urls['factomd'],
+            prefix + 'tfaExplorerApiUrlMainnet': self.stand_ins.urls['tfa_explorer'],
+            prefix + 'tfaExplorerApiUrlTestnet': self.stand_ins.urls['tfa_explorer'],
+            prefix + 'harmonyApiUrl': self.stand_ins.urls['harmony']
+        })
+        environ.update(self.env)
+        return environ
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def run_level(base_url: str, paths: list, concurrency: int, duration: float):
+    """Send GET requests for the given paths (in order, cycling through them) from concurrency clients, each sending
+    its next request as soon as it gets a response, for duration seconds. Returns the throughput, the responses by
+    status code (or "error" when no response was received) and the latency percentiles."""
+    host, port = base_url.split('://', 1)[1].split(':')
+    sequence = itertools.count()
+    stop_at = time.perf_counter() + duration
+    samples = [[] for _ in range(concurrency)]
+
+    def client(results):
+        connection = HTTPConnection(host, int(port), timeout=60)
+        while time.perf_counter() < stop_at:
+            path = paths[next(sequence) % len(paths)]
+            start = time.perf_counter()
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                status = str(response.status)
+                if response.will_close:
+                    connection.close()  # gunicorn's sync workers don't keep connections alive
+            except (OSError, HTTPException):
+                status = 'error'
+                connection.close()
+            results.append((time.perf_counter() - start, status))
+        connection.close()
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(results,)) for results in samples]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    samples = [sample for results in samples for sample in results]
+    latencies = sorted(latency for latency, _ in samples)
+    return {
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'durationSeconds': elapsed,
+        'throughput': len(samples) / elapsed,
+        'statuses': dict(Counter(status for _, status in samples)),
+        'latencySeconds': dict([('p{:g}'.format(q), _percentile(latencies, q)) for q in PERCENTILES] +
+                               [('mean', sum(latencies) / len(latencies) if latencies else None),
+                                ('max', latencies[-1] if latencies else None)])
+    }
+
+
+def run_load(stand_ins: StandIns, paths: list, server='sync', workers=1, threads=1, concurrency_levels=(1,),
+             duration=10.0, warmup=2.0, connection='factomd', env=None, out=sys.stderr):
+    """Start the driver with the given worker configuration, warm it up, then run each concurrency level in turn
+    against the same (warm) server"""
+    results = []
+    with DriverServer(stand_ins, workers, threads, server, connection, env) as driver:
+        if warmup > 0:
+            run_level(driver.url, paths, max(concurrency_levels), warmup)
+        for concurrency in concurrency_levels:
+            stand_ins.reset_calls()
+            result = run_level(driver.url, paths, concurrency, duration)
+            result.update({'server': server, 'workers': workers, 'threads': threads,
+                           'upstreamCalls': sum(stand_ins.calls().values())})
+            results.append(result)
+            out.write('{:<6} {:>3} workers {:>3} threads {:>4} clients  {:>8.1f} req/s  p50 {:>8.2f}ms  '
+                      'p99 {:>8.2f}ms  {}\n'.format(server, workers, threads, concurrency, result['throughput'],
+                                                   _ms(result['latencySeconds']['p50']),
+                                                   _ms(result['latencySeconds']['p99']), result['statuses']))
+    return results
+
+
+def compare(results: list, baseline: list, out=sys.stderr):
+    """Print how the throughput and tail latency of each configuration changed relative to a baseline run"""
+    def key(r):
+        return r['server'], r['workers'], r['threads'], r['concurrency']
+
+    previous = {key(r): r for r in baseline}
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        out.write('{:<6} {:>3} workers {:>3} threads {:>4} clients  throughput {:>+7.1%}  p99 {:>+7.1%}\n'.format(
+            result['server'], result['workers'], result['threads'], result['concurrency'],
+            _change(old['throughput'], result['throughput']),
+            _change(old['latencySeconds']['p99'] or 0, result['latencySeconds']['p99'] or 0)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test the driver under gunicorn against local backend stand-ins')
+    parser.add_argument('--server', action='append', choices=sorted(SERVERS),
+                        help='App and worker class to serve: the Bottle app or the asyncio one (default: sync)')
+    parser.add_argument('--workers', action='append', type=int, help='gunicorn worker processes (default: 1)')
+    parser.add_argument('--threads', action='append', type=int,
+                        help='Threads per sync worker (default: 1, as in docker/Dockerfile)')
+    parser.add_argument('--concurrency', action='append', type=int,
+                        help='Concurrent clients (default: 1, 4, 16 and 64)')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds each concurrency level runs for')
+    parser.add_argument('--warmup', type=float, default=2,
+                        help='Seconds of load sent to each server before measuring (0 to measure from a cold start)')
+    parser.add_argument('--connection', default='factomd', choices=('factomd', 'tfa_explorer', 'harmony'),
+                        help='Connection type the driver resolves with')
+    parser.add_argument('--identities', type=int, default=200, help='Number of distinct DIDs requested')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplier for the number of entries per chain')
+    parser.add_argument('--missing-ratio', type=float, default=0.1, help='Share of the DIDs whose chain is missing')
+    parser.add_argument('--testnet-ratio', type=float, default=0.1, help='Share of the DIDs on testnet')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Exponent of the Zipf distribution of requests')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='Time (in seconds) taken by the stand-ins to answer each request')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the request mix')
+    parser.add_argument('--output', help='File to write the JSON results to (default: stdout)')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare against')
+    args = parser.parse_args(argv)
+
+    chains = identity_chains(args.identities, args.scale)
+    paths = request_mix(chains, 100000, args.missing_ratio, args.testnet_ratio, args.zipf, args.seed)
+    concurrency_levels = args.concurrency or [1, 4, 16, 64]
+    results = []
+    with StandIns(chains, latency=args.latency) as stand_ins:
+        for server in args.server or ['sync']:
+            for workers in args.workers or [1]:
+                for threads in (args.threads or [1]) if server == 'sync' else [1]:
+                    results.extend(run_load(stand_ins, paths, server, workers, threads, concurrency_levels,
+                                            args.duration, args.warmup, args.connection))
+
+    report = {
+        'environment': {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()
+        },
+        'parameters': {
+            'connection': args.connection, 'identities': args.identities, 'scale': args.scale,
+            'missingRatio': args.missing_ratio, 'testnetRatio': args.testnet_ratio, 'zipf': args.zipf,
+            'latency': args.latency, 'duration': args.duration, 'warmup': args.warmup, 'seed': args.seed
+        },
+        'results': results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f)['results'])
+
+
+def _percentile(values: list, q: float):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[max(int(math.ceil(q / 100 * len(values))) - 1, 0)]
+
+
+def _ms(seconds):
+    return (seconds or 0) * 1000
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+if __name__ == '__main__':
+    main()
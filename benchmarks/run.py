@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from benchmarks.chains import SCENARIOS
+from benchmarks.standins import StandIns
+from src import clients
+from src import consts
+from src import factomd_jsonrpc_connection
+from src import harmony_connect_connection
+from src import models
+from src import tfa_explorer_connection
+from src.chain_state import ChainStateStore
+from src.config import DriverConfig
+
+try:
+    from aiohttp import ClientSession
+    from src import async_factomd_connection
+    from src import async_harmony_connect_connection
+    from src import async_tfa_explorer_connection
+except ImportError:  # The asyncio server's dependencies are optional
+    ClientSession = None
+
+
+# Benchmarks get_identity for each connector against synthetic chains served by local stand-ins of the backends, and
+# writes the results as JSON so that they can be compared across commits. Run it from the repository root:
+#   python -m benchmarks.run --output results.json [--baseline previous.json]
+
+CONNECTORS = ('factomd', 'tfa_explorer', 'harmony', 'harmony_cached',
+              'async_factomd', 'async_tfa_explorer', 'async_harmony')
+
+# Identity methods whose CPU time is measured
+IDENTITY_METHODS = ('process_creation', 'process_key_replacement', 'process_key_replacements')
+
+_thread_time = getattr(time, 'thread_time', time.process_time)
+
+
+class IdentityTimer:
+    """Measures the CPU time spent in Identity's chain processing methods, while active"""
+
+    def __init__(self):
+        self.cpu_time = 0.0
+        self._local = threading.local()
+        self._originals = {}
+
+    def __enter__(self):
+        for name in IDENTITY_METHODS:
+            self._originals[name] = getattr(models.Identity, name)
+            setattr(models.Identity, name, self._wrap(self._originals[name]))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for name, original in self._originals.items():
+            setattr(models.Identity, name, original)
+
+    def _wrap(self, method):
+        timer = self
+
+        def wrapper(*args, **kwargs):
+            # Nested calls are part of the outermost call's time
+            depth = getattr(timer._local, 'depth', 0)
+            timer._local.depth = depth + 1
+            start = _thread_time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                timer._local.depth = depth
+                if depth == 0:
+                    timer.cpu_time += _thread_time() - start
+
+        return wrapper
+
+
+def get_driver_config(stand_ins: StandIns, connector: str):
+    driver_config = DriverConfig()
+    driver_config.rpc_url_mainnet = stand_ins.urls['factomd']
+    driver_config.tfa_explorer_mainnet = stand_ins.urls['tfa_explorer']
+    driver_config.harmony_url = stand_ins.urls['harmony']
+    driver_config.harmony_caching_enabled = connector == 'harmony_cached'
+    return driver_config
+
+
+def resolve(driver_config: DriverConfig, connector: str, chain, state_store: ChainStateStore):
+    """Resolve the chain's identity with the given connector, returning it along with the time taken"""
+    did = consts.DID_PREFIX + chain.chain_id
+    if connector.startswith('async_'):
+        return asyncio.run(_resolve_async(driver_config, connector, did, chain.chain_id, state_store))
+
+    start = time.perf_counter()
+    if connector == 'factomd':
+        identity = factomd_jsonrpc_connection.get_identity(driver_config, did, chain.chain_id,
+                                                           state_store=state_store)
+    elif connector == 'tfa_explorer':
+        identity = tfa_explorer_connection.get_identity(driver_config, did, chain.chain_id, state_store=state_store)
+    else:
+        identity = harmony_connect_connection.get_identity(driver_config, did, chain.chain_id,
+                                                           state_store=state_store)
+    return identity, time.perf_counter() - start
+
+
+async def _resolve_async(driver_config: DriverConfig, connector: str, did: str, chain_id: str,
+                         state_store: ChainStateStore):
+    async with ClientSession() as session:
+        start = time.perf_counter()
+        if connector == 'async_factomd':
+            identity = await async_factomd_connection.get_identity(session, driver_config, did, chain_id,
+                                                                   state_store=state_store)
+        elif connector == 'async_tfa_explorer':
+            identity = await async_tfa_explorer_connection.get_identity(session, driver_config, did, chain_id,
+                                                                        state_store=state_store)
+        else:
+            identity = await async_harmony_connect_connection.get_identity(session, driver_config, did, chain_id,
+                                                                           state_store=state_store)
+        return identity, time.perf_counter() - start
+
+
+def reset():
+    """Start from a cold worker: no pooled connections, and nothing memoized"""
+    clients.reset()
+    for function in (models.is_valid_key, models.get_public_key, models.get_public_key_hex, models.verify_signature):
+        function.cache_clear()
+
+
+def run_benchmark(stand_ins: StandIns, chain, connector: str, repeat=5):
+    driver_config = get_driver_config(stand_ins, connector)
+    latencies, upstream_calls, cpu_times = [], [], []
+    identity, state_store = None, None
+    for _ in range(repeat):
+        reset()
+        stand_ins.reset_calls()
+        state_store = ChainStateStore()
+        with IdentityTimer() as timer:
+            identity, latency = resolve(driver_config, connector, chain, state_store)
+        latencies.append(latency)
+        upstream_calls.append(sum(stand_ins.calls().values()))
+        cpu_times.append(timer.cpu_time)
+
+    # Resolving again from the stored chain state only reads what was added since (i.e. nothing)
+    stand_ins.reset_calls()
+    _, warm_latency = resolve(driver_config, connector, chain, state_store)
+    warm_calls = sum(stand_ins.calls().values())
+
+    reset()
+    tracemalloc.start()
+    try:
+        resolve(driver_config, connector, chain, ChainStateStore())
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'scenario': chain.name,
+        'connector': connector,
+        'entries': len(chain.entries),
+        'activeKeys': len(identity.active_keys),
+        'allKeys': len(identity.all_keys),
+        'latencySeconds': _summary(latencies),
+        'upstreamCalls': max(upstream_calls),
+        'identityCpuSeconds': _summary(cpu_times),
+        'peakMemoryBytes': peak_memory,
+        'warm': {'latencySeconds': warm_latency, 'upstreamCalls': warm_calls}
+    }
+
+
+def compare(results: list, baseline: list, out=sys.stderr):
+    """Print how each result changed relative to the same benchmark in a baseline run"""
+    previous = {(r['scenario'], r['connector']): r for r in baseline}
+    for result in results:
+        old = previous.get((result['scenario'], result['connector']))
+        if old is None:
+            continue
+        out.write('{:<22} {:<20} latency {:>+7.1%}  calls {:>+6d}  identity cpu {:>+7.1%}  memory {:>+7.1%}\n'.format(
+            result['scenario'], result['connector'],
+            _change(old['latencySeconds']['median'], result['latencySeconds']['median']),
+            result['upstreamCalls'] - old['upstreamCalls'],
+            _change(old['identityCpuSeconds']['median'], result['identityCpuSeconds']['median']),
+            _change(old['peakMemoryBytes'], result['peakMemoryBytes'])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark identity resolution against local backend stand-ins')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='Chain scenario to run (default: all)')
+    parser.add_argument('--connector', action='append', choices=CONNECTORS, help='Connector to run (default: all)')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplier for the number of entries per chain')
+    parser.add_argument('--repeat', type=int, default=5, help='Cold resolutions per benchmark')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='Time (in seconds) taken by the stand-ins to answer each request')
+    parser.add_argument('--output', help='File to write the JSON results to (default: stdout)')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare against')
+    args = parser.parse_args(argv)
+
+    connectors = args.connector or [c for c in CONNECTORS if ClientSession is not None or not c.startswith('async_')]
+    chains = [SCENARIOS[name](args.scale) for name in args.scenario or sorted(SCENARIOS)]
+    results = []
+    with StandIns(chains, latency=args.latency) as stand_ins:
+        for chain in chains:
+            for connector in connectors:
+                results.append(run_benchmark(stand_ins, chain, connector, repeat=args.repeat))
+
+    report = {
+        'environment': {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()
+        },
+        'parameters': {'scale': args.scale, 'repeat': args.repeat, 'latency': args.latency},
+        'results': results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f)['results'])
+
+
+def _summary(values: list):
+    return {'min': min(values), 'median': statistics.median(values), 'max': max(values)}
+
+
+def _change(old, new):
+    return (new - old) / old if old else 0.0
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+import base64
+import hashlib
+import json
+import multiprocessing
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from src import models
+from urllib.parse import parse_qs, urlparse
+from urllib.request import Request, urlopen
+
+
+# Local stand-ins for the factomd JSON-RPC API, the TFA Explorer API and the Harmony Connect API, serving synthetic
+# chains (see chains.py). They run in their own process, so that serving requests doesn't count towards the CPU time
+# and memory measured in the benchmark process.
+
+BACKENDS = ('factomd', 'tfa_explorer', 'harmony')
+TFA_EXPLORER_MAX_LIMIT = 100
+
+
+class StandIns:
+    """Serves the given chains from all three stand-ins, each answering requests after the given latency (in seconds)"""
+
+    def __init__(self, chains: list, latency=0.0):
+        self.chains = chains
+        self.latency = latency
+        self.urls = {}
+        self._process = None
+
+    def start(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, args=(self.chains, self.latency, child_conn),
+                                                daemon=True)
+        self._process.start()
+        ports = parent_conn.recv()
+        self.urls = {backend: 'http://127.0.0.1:{}'.format(port) for backend, port in ports.items()}
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def calls(self):
+        """Number of requests served by each stand-in since the last reset"""
+        return {backend: json.loads(urlopen(url + '/_calls').read().decode()) for backend, url in self.urls.items()}
+
+    def reset_calls(self):
+        for url in self.urls.values():
+            urlopen(Request(url + '/_calls', method='DELETE')).read()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # Clients closing their pooled connections
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Request handler dispatching to the stand-in's backend, and counting the requests it serves"""
+    protocol_version = 'HTTP/1.1'
+    # Responses are written in one go (rather than headers then body), so keep-alive connections don't stall
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    backend = None
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        if url.path == '/_calls':
+            with self.server.lock:
+                if method == 'DELETE':
+                    self.server.calls = 0
+                self._send(200, self.server.calls)
+            return
+
+        with self.server.lock:
+            self.server.calls += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = None
+        if method == 'POST':
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+        status, response = self.backend.handle(method, url.path, parse_qs(url.query), body)
+        self._send(status, response)
+
+    def _send(self, status, body):
+        data = json.dumps(body, separators=(',', ':')).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FactomdBackend:
+
+    def __init__(self, chains: list):
+        self.chain_heads = {}
+        self.entry_blocks = {}
+        self.entries = {}
+        for chain in chains:
+            prev_keymr = '0' * 64
+            blocks = []
+            for entry in chain.entries:
+                if not blocks or blocks[-1][0] != entry.height:
+                    blocks.append((entry.height, []))
+                blocks[-1][1].append({'entryhash': entry.entry_hash, 'timestamp': 0})
+                self.entries[entry.entry_hash] = {
+                    'chainid': chain.chain_id,
+                    'extids': [x.hex() for x in entry.external_ids],
+                    'content': entry.content.hex()
+                }
+            for height, entry_list in blocks:
+                keymr = hashlib.sha256('{}{}'.format(chain.chain_id, height).encode()).hexdigest()
+                self.entry_blocks[keymr] = {
+                    'header': {'chainid': chain.chain_id, 'dbheight': height, 'prevkeymr': prev_keymr},
+                    'entrylist': entry_list
+                }
+                prev_keymr = keymr
+            self.chain_heads[chain.chain_id] = prev_keymr
+
+    def handle(self, method, path, query, body):
+        if isinstance(body, list):
+            return 200, [self._call(call) for call in body]
+        response = self._call(body)
+        return 404 if 'error' in response else 200, response
+
+    def _call(self, call):
+        params = call.get('params', {})
+        if call['method'] == 'chain-head':
+            if params['chainid'] not in self.chain_heads:
+                return {'jsonrpc': '2.0', 'id': call['id'], 'error': {'code': -32009, 'message': 'Missing Chain Head'}}
+            result = {'chainhead': self.chain_heads[params['chainid']], 'chaininprocesslist': False}
+        elif call['method'] == 'entry-block':
+            result = self.entry_blocks[params['keymr']]
+        else:
+            result = self.entries[params['hash']]
+        return {'jsonrpc': '2.0', 'id': call['id'], 'result': result}
+
+
+class TfaExplorerBackend:
+
+    ENTRIES_PATH = re.compile(r'^/chain/entries/([0-9a-f]{64})$')
+
+    def __init__(self, chains: list):
+        self.chains = {}
+        for chain in chains:
+            self.chains[chain.chain_id] = [{
+                'entry_hash': entry.entry_hash,
+                'extid_count': len(entry.external_ids),
+                'extids': [base64.b64encode(x).decode() for x in entry.external_ids],
+                'content': base64.b64encode(entry.content).decode(),
+                'pending': False,
+                'block_height': entry.height
+            } for entry in chain.entries]
+
+    def handle(self, method, path, query, body):
+        match = self.ENTRIES_PATH.match(path)
+        if match is None:
+            return 404, {}
+        limit = min(int(query['limit'][0]), TFA_EXPLORER_MAX_LIMIT)
+        offset = int(query['offset'][0])
+        entries = self.chains.get(match.group(1), [])[offset:offset + limit]
+        return 200, {'result': entries or None}
+
+
+class HarmonyBackend:
+
+    FIRST_ENTRY_PATH = re.compile(r'^/chains/([0-9a-f]{64})/entries/first$')
+    ENTRIES_PATH = re.compile(r'^/chains/([0-9a-f]{64})/entries$')
+    ENTRY_PATH = re.compile(r'^/chains/([0-9a-f]{64})/entries/([0-9a-f]{64})$')
+    IDENTITY_PATH = re.compile(r'^/identities/([0-9a-f]{64})$')
+    KEYS_PATH = re.compile(r'^/identities/([0-9a-f]{64})/keys$')
+
+    def __init__(self, chains: list):
+        self.entries = {}
+        self.entry_hashes = {}
+        self.identities = {}
+        for chain in chains:
+            self.entry_hashes[chain.chain_id] = [entry.entry_hash for entry in chain.entries]
+            for entry in chain.entries:
+                self.entries[(chain.chain_id, entry.entry_hash)] = self._entry_json(chain.chain_id, entry)
+            self.identities[chain.chain_id] = self._identity(chain)
+
+    def handle(self, method, path, query, body):
+        match = self.FIRST_ENTRY_PATH.match(path)
+        if match is not None:
+            hashes = self.entry_hashes.get(match.group(1))
+            if not hashes:
+                return 404, {}
+            return 200, {'data': self.entries[(match.group(1), hashes[0])]}
+
+        match = self.ENTRIES_PATH.match(path)
+        if match is not None:
+            limit, offset = int(query['limit'][0]), int(query['offset'][0])
+            hashes = self.entry_hashes.get(match.group(1), [])
+            data = [{'entry_hash': h, 'chain': self._chain_link(match.group(1)), 'created_at': None, 'href': ''}
+                    for h in hashes[offset:offset + limit]]
+            return 200, {'data': data, 'offset': offset, 'limit': limit, 'count': len(hashes)}
+
+        match = self.ENTRY_PATH.match(path)
+        if match is not None:
+            return 200, {'data': self.entries[(match.group(1), match.group(2))]}
+
+        match = self.IDENTITY_PATH.match(path)
+        if match is not None and match.group(1) in self.identities:
+            return 200, {'data': self.identities[match.group(1)]['identity']}
+
+        match = self.KEYS_PATH.match(path)
+        if match is not None and match.group(1) in self.identities:
+            limit, offset = int(query['limit'][0]), int(query['offset'][0])
+            keys = self.identities[match.group(1)]['keys']
+            return 200, {'data': keys[offset:offset + limit], 'offset': offset, 'limit': limit, 'count': len(keys)}
+
+        return 404, {}
+
+    @staticmethod
+    def _chain_link(chain_id):
+        return {'chain_id': chain_id, 'href': '/v1/chains/{}'.format(chain_id)}
+
+    def _entry_json(self, chain_id, entry):
+        keymr = hashlib.sha256('{}{}'.format(chain_id, entry.height).encode()).hexdigest()
+        return {
+            'entry_hash': entry.entry_hash,
+            'chain': self._chain_link(chain_id),
+            'created_at': None,
+            'external_ids': [base64.b64encode(x).decode() for x in entry.external_ids],
+            'content': base64.b64encode(entry.content).decode(),
+            'stage': 'factom',
+            'dblock': {'keymr': keymr, 'height': entry.height, 'href': ''},
+            'eblock': {'keymr': keymr, 'href': ''}
+        }
+
+    @staticmethod
+    def _identity(chain):
+        """Harmony's cached state of the identity, for the identities API"""
+        first = chain.entries[0]
+        identity = models.Identity('did:factom:' + chain.chain_id, chain.chain_id)
+        identity.process_creation(first.entry_hash, first.external_ids, first.content, stage='factom',
+                                  height=first.height)
+        identity.process_key_replacements([(e.entry_hash, e.external_ids, e.height) for e in chain.entries[1:]])
+
+        def key_json(key):
+            return {'key': key.key, 'priority': key.priority, 'activated_height': key.activated_height,
+                    'retired_height': key.retired_height, 'entry_hash': key.entry_hash}
+
+        return {
+            'identity': {
+                'version': identity.version,
+                'chain_id': chain.chain_id,
+                'names': [base64.b64encode(name.encode()).decode() for name in identity.name],
+                'active_keys': [key_json(key) for key in identity.active_keys.values()],
+                'created_height': identity.created_height,
+                'stage': identity.stage
+            },
+            'keys': [key_json(key) for key in identity.all_keys.values()]
+        }
+
+
+def _serve(chains: list, latency: float, conn):
+    backends = {'factomd': FactomdBackend, 'tfa_explorer': TfaExplorerBackend, 'harmony': HarmonyBackend}
+    ports = {}
+    for name in BACKENDS:
+        handler = type('{}Handler'.format(name), (_Handler,), {'backend': backends[name](chains)})
+        server = _ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.lock = threading.Lock()
+        server.calls = 0
+        server.latency = latency
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        ports[name] = server.server_address[1]
+    conn.send(ports)
+    threading.Event().wait()
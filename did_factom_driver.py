@@ -1,16 +1,60 @@
 import bottle
 import json
-from bottle import error, get, hook, request, run
-from harmony_connect_client.rest import ApiException
+import threading
+import time
+from bottle import HTTPResponse, error, get, hook, post, request, response, run
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from src import backends
 from src import consts
-from src import factomd_jsonrpc_connection
-from src import harmony_connect_connection
-from src import tfa_explorer_connection
+from src import failover
+from src import metrics
+from src import responses
+from src import warm_start
 from src.config import DriverConfig
 from src.models import IdentityNotFoundException
+from src.resolver import Resolver, error_status
 
 
 driver_config = DriverConfig()
+resolver = Resolver(driver_config)
+resolver.register_metrics()
+# Only the connectors of the configured backends are imported up front (testnet fallbacks are imported on first use)
+backends.CONNECTORS.load(failover.get_backends(driver_config))
+
+
+def measure_requests(callback):
+    """Bottle plugin that measures requests to each route, by the name of its callback. Resolutions also get a
+    Server-Timing header with the time spent in each phase, and a sampled fraction of them is profiled."""
+    route_name = callback.__name__
+    timed_route = route_name.startswith('resolve')
+
+    def wrapper(*args, **kwargs):
+        profile = resolver.profiler.sample() if timed_route else None
+        start = time.perf_counter()
+        status = 500
+        try:
+            with metrics.request_timing(profile) as timing:
+                try:
+                    body = callback(*args, **kwargs) if profile is None else profile.run(callback, *args, **kwargs)
+                except HTTPResponse as e:
+                    status = e.status_code
+                    if timed_route:
+                        e.set_header('Server-Timing', timing.header())
+                    raise
+            status = body.status_code if isinstance(body, HTTPResponse) else response.status_code
+            if timed_route:
+                (body if isinstance(body, HTTPResponse) else response).set_header('Server-Timing', timing.header())
+            return body
+        finally:
+            if profile is not None:
+                profile.finish('{}-{}'.format(route_name, kwargs.get('chain_id', '')))
+            metrics.observe_request(route_name, status, time.perf_counter() - start)
+
+    return wrapper
+
+
+bottle.install(measure_requests)
 
 
 @hook('before_request')
@@ -24,69 +68,87 @@ def health_check():
     return {'data': 'Healthy!'}
 
 
+@get('/stats')
+def stats():
+    return {'data': resolver.stats()}
+
+
+@get('/metrics')
+def get_metrics():
+    response.content_type = metrics.CONTENT_TYPE
+    return metrics.REGISTRY.render()
+
+
 @get('/1.0/identifiers/did\:factom\:<chain_id:re:[0-9A-Fa-f]{64}>')
 def resolve(chain_id):
     did = '{}{}'.format(consts.DID_PREFIX, chain_id)
-    identity = None
-    try:
-        if driver_config.factom_connection == DriverConfig.FACTOMD:
-            identity = factomd_jsonrpc_connection.get_identity(driver_config, did, chain_id)
-        elif driver_config.factom_connection == DriverConfig.TFA_EXPLORER:
-            identity = tfa_explorer_connection.get_identity(driver_config, did, chain_id)
-        elif driver_config.factom_connection == DriverConfig.HARMONY:
-            identity = harmony_connect_connection.get_identity(driver_config, did, chain_id)
-        else:
-            bottle.abort(500)  # Invalid connection type. This should never be executed.
-    except IdentityNotFoundException:
-        bottle.abort(404)
-    except ApiException:
-        bottle.abort(500)  # Failed to make API call for some reason
-
-    return {'didDocument': identity.get_did_document(), 'methodMetadata': identity.get_method_metadata()}
+    return _resolve(did, chain_id)
 
 
 @get('/1.0/identifiers/did\:factom\:mainnet\:<chain_id:re:[0-9A-Fa-f]{64}>')
 def resolve_mainnet(chain_id):
     did = '{}{}{}'.format(consts.DID_PREFIX, consts.NETWORK_MAINNET, chain_id)
-    identity = None
-    try:
-        if driver_config.factom_connection == DriverConfig.FACTOMD:
-            identity = factomd_jsonrpc_connection.get_identity(driver_config, did, chain_id)
-        elif driver_config.factom_connection == DriverConfig.TFA_EXPLORER:
-            identity = tfa_explorer_connection.get_identity(driver_config, did, chain_id)
-        elif driver_config.factom_connection == DriverConfig.HARMONY:
-            identity = harmony_connect_connection.get_identity(driver_config, did, chain_id)
-        else:
-            bottle.abort(500)  # Invalid connection type. This should never be executed.
-    except IdentityNotFoundException:
-        bottle.abort(404)
-    except ApiException:
-        bottle.abort(500)  # Failed to make API call for some reason
-
-    return {'didDocument': identity.get_did_document(), 'methodMetadata': identity.get_method_metadata()}
+    return _resolve(did, chain_id)
 
 
 @get('/1.0/identifiers/did\:factom\:testnet\:<chain_id:re:[0-9A-Fa-f]{64}>')
 def resolve_testnet(chain_id):
     did = '{}{}{}'.format(consts.DID_PREFIX, consts.NETWORK_TESTNET, chain_id)
-    identity = None
+    return _resolve(did, chain_id, testnet=True)
+
+
+@post('/1.0/identifiers/batch')
+def resolve_batch():
+    """Resolve a list of DIDs, given as {"identifiers": [...]}, concurrently. Duplicates are resolved once, and the
+    result (or error) for each DID is returned under its own status code."""
+    try:
+        body = json.loads(request.body.read().decode())
+        dids = body['identifiers']
+    except (ValueError, TypeError, KeyError):
+        bottle.abort(400)
+    if not isinstance(dids, list) or not all(isinstance(did, str) for did in dids):
+        bottle.abort(400)
+
+    dids = list(OrderedDict.fromkeys(dids))
+    if len(dids) > driver_config.batch_max_size:
+        bottle.abort(413)
+
+    with ThreadPoolExecutor(max_workers=driver_config.batch_concurrency) as executor:
+        results = list(executor.map(resolver.resolve_batch_item, dids))
+    response.content_type = 'application/json'
+    with metrics.timed('serialize'):
+        return responses.batch_response(dids, results)
+
+
+def _resolve(did: str, chain_id: str, testnet=False):
     try:
-        if driver_config.factom_connection == DriverConfig.FACTOMD:
-            identity = factomd_jsonrpc_connection.get_identity(driver_config, did, chain_id, testnet=True)
-        elif driver_config.factom_connection == DriverConfig.TFA_EXPLORER:
-            identity = tfa_explorer_connection.get_identity(driver_config, did, chain_id, testnet=True)
-        elif driver_config.factom_connection == DriverConfig.HARMONY:
-            # TODO: switch this to use the Harmony connection if Harmony ever spins up a community testnet environment
-            # For now, fall back to using a factomd connection
-            identity = factomd_jsonrpc_connection.get_identity(driver_config, did, chain_id, testnet=True)
-        else:
-            bottle.abort(500)  # Invalid connection type. This should never be executed.
-    except IdentityNotFoundException:
-        bottle.abort(404)
-    except ApiException:
-        bottle.abort(500)  # Failed to make API call for some reason
-
-    return {'didDocument': identity.get_did_document(), 'methodMetadata': identity.get_method_metadata()}
+        version_height = responses.parse_version_height(request.query.get('versionHeight'))
+    except ValueError:
+        bottle.abort(400)
+
+    try:
+        identity = resolver.resolve(did, chain_id, testnet)
+        if version_height is not None:
+            # Historical resolutions are derived from the current state of the identity
+            identity = identity.at_height(version_height)
+    except (IdentityNotFoundException, failover.BackendUnavailableException, failover.ResolutionTimeoutException) as e:
+        bottle.abort(error_status(e)[0])
+
+    # Clients that already have the current state of the identity get a 304, without a body. Otherwise, the response
+    # is serialized once per identity state, and then served as is.
+    etag = identity.get_etag()
+    if responses.etag_matches(request.get_header('If-None-Match'), etag):
+        return HTTPResponse(status=304, headers={'ETag': etag})
+    response.set_header('ETag', etag)
+    response.content_type = 'application/json'
+    with metrics.timed('serialize'):
+        return identity.serialize()
+
+
+@error(400)
+def error400(e):
+    body = {'errors': {'detail': 'Bad request'}}
+    return json.dumps(body, separators=(',', ':'))
 
 
 @error(404)
@@ -101,12 +163,37 @@ def error405(e):
     return json.dumps(body, separators=(',', ':'))
 
 
+@error(413)
+def error413(e):
+    body = {'errors': {'detail': 'Too many identifiers'}}
+    return json.dumps(body, separators=(',', ':'))
+
+
 @error(500)
 def error500(e):
     body = {'errors': {'detail': 'Internal server error'}}
     return json.dumps(body, separators=(',', ':'))
 
 
+@error(503)
+def error503(e):
+    body = {'errors': {'detail': 'Service unavailable'}}
+    return json.dumps(body, separators=(',', ':'))
+
+
+@error(504)
+def error504(e):
+    body = {'errors': {'detail': 'Gateway timeout'}}
+    return json.dumps(body, separators=(',', ':'))
+
+
+# Warm start. Each worker loads the snapshot and preloads the DIDs itself (with gunicorn's --preload, the background
+# threads would only run in the master process).
+resolver.start_snapshots()
+if driver_config.preload_dids:
+    threading.Thread(target=warm_start.preload, name='preload', daemon=True,
+                     args=(resolver.resolve_did, driver_config.preload_dids, driver_config.batch_concurrency)).start()
+
 # Entry point ONLY when run locally. The docker setup uses gunicorn and this block will not be executed.
 if __name__ == '__main__':
     run(host='localhost', port=8080)
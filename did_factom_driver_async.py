@@ -0,0 +1,9 @@
+from aiohttp import web
+from src.async_server import create_app
+
+
+app = create_app()
+
+# Entry point ONLY when run locally. With gunicorn (and aiohttp's worker class) this block will not be executed.
+if __name__ == '__main__':
+    web.run_app(app, host='localhost', port=8080)
@@ -0,0 +1,89 @@
+from . import async_http
+from . import consts
+from . import factomd_jsonrpc_connection
+from . import metrics
+from . import models
+from .chain_state import ChainStateStore
+from .config import DriverConfig
+from aiohttp import ClientSession, ClientTimeout
+from factom.exceptions import MissingChainHead, handle_error_response
+
+
+# The non-blocking version of factomd_jsonrpc_connection, used by the asyncio server (see async_http)
+
+
+async def get_identity(session: ClientSession, driver_config: DriverConfig, did: str, chain_id: str,
+                       testnet=False, state_store: ChainStateStore = None):
+    network = consts.NETWORK_MAINNET if not testnet else consts.NETWORK_TESTNET
+    url = '{}/v2'.format(driver_config.rpc_url_mainnet if not testnet else driver_config.rpc_url_testnet)
+    timeout = async_http.client_timeout(driver_config, DriverConfig.FACTOMD)
+
+    identity, cursor = (None, None) if state_store is None else state_store.get(network, chain_id, did)
+    try:
+        chain_head = (await _factomd_request(session, url, timeout, 'chain-head', {'chainid': chain_id}))['chainhead']
+    except MissingChainHead:
+        raise models.ChainNotFoundException()
+    if not chain_head or chain_head == factomd_jsonrpc_connection.NULL_BLOCK:
+        raise models.ChainNotFoundException()
+
+    # Walk the entry blocks backwards, keeping only the hashes of their entries (see the blocking connection)
+    entry_blocks = []
+    keymr = chain_head
+    stop_keymr = None if cursor is None else cursor.keymr
+    from_height = 0 if cursor is None else cursor.height + 1
+    while keymr != factomd_jsonrpc_connection.NULL_BLOCK and keymr != stop_keymr:
+        block = await _factomd_request(session, url, timeout, 'entry-block', {'keymr': keymr})
+        if block['header']['dbheight'] < from_height:
+            break
+        entry_hashes = [entry_pointer['entryhash'] for entry_pointer in block['entrylist']]
+        entry_blocks.append(factomd_jsonrpc_connection.EntryBlock(keymr, block['header']['dbheight'], entry_hashes))
+        keymr = block['header']['prevkeymr']
+    entry_blocks.reverse()
+
+    # Entries are fetched with one JSON-RPC batch request per batch, and each batch is applied before the next one
+    batch_size = driver_config.factomd_batch_size
+    entry_pointers = [(block, entry_hash) for block in entry_blocks for entry_hash in block.entry_hashes]
+    include_first = identity is None
+    for i in range(0, len(entry_pointers), batch_size):
+        batch = entry_pointers[i:i + batch_size]
+        calls = [('entry', {'hash': entry_hash}) for _, entry_hash in batch]
+        payload = factomd_jsonrpc_connection.batch_payload(calls)
+        with metrics.backend_call(DriverConfig.FACTOMD):
+            async with session.post(url, json=payload, timeout=timeout) as resp:
+                raw_body = await resp.read()
+        body = async_http.decode_json(raw_body)
+        if resp.status >= 400 or not isinstance(body, list):
+            handle_error_response(_JsonRpcErrorResponse(body))
+        entries = []
+        with metrics.timed('decode'):
+            for (block, entry_hash), entry in zip(batch, factomd_jsonrpc_connection.batch_results(calls, body)):
+                entries.append(factomd_jsonrpc_connection.to_chain_entry(block, entry_hash, entry, include_first))
+                include_first = False
+        identity, cursor = factomd_jsonrpc_connection.apply_entries(did, chain_id, identity, cursor, entries)
+
+    if identity is None:
+        raise models.IdentityNotFoundException()
+    if state_store is not None:
+        state_store.put(network, chain_id, identity, cursor)
+    return identity
+
+
+async def _factomd_request(session: ClientSession, url: str, timeout: ClientTimeout, method: str, params: dict):
+    payload = {'jsonrpc': '2.0', 'id': 0, 'method': method, 'params': params}
+    with metrics.backend_call(DriverConfig.FACTOMD):
+        async with session.post(url, json=payload, timeout=timeout) as resp:
+            raw_body = await resp.read()
+    body = async_http.decode_json(raw_body)
+    if resp.status >= 400 or 'error' in body:
+        handle_error_response(_JsonRpcErrorResponse(body))
+    return body['result']
+
+
+class _JsonRpcErrorResponse:
+    """Just enough of a requests Response for factom-api to raise the exception that matches a JSON-RPC error"""
+
+    def __init__(self, body):
+        self.body = body if isinstance(body, dict) else {}
+
+    def json(self):
+        return self.body
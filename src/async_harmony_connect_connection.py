@@ -0,0 +1,121 @@
+import asyncio
+from . import async_http
+from . import consts
+from . import harmony_connect_connection
+from . import metrics
+from . import models
+from .chain_state import ChainStateStore
+from .config import DriverConfig
+from aiohttp import ClientSession
+from factom_sdk.utils.common_util import CommonUtil
+from harmony_connect_client.rest import ApiException
+from types import SimpleNamespace
+
+
+# The non-blocking version of harmony_connect_connection, used by the asyncio server (see async_http)
+
+
+async def get_identity(session: ClientSession, driver_config: DriverConfig, did: str, chain_id: str,
+                       testnet=False, state_store: ChainStateStore = None):
+    if driver_config.harmony_caching_enabled:
+        return await _get_identity_with_cache(session, driver_config, did, chain_id)
+
+    # The first entry is always fetched, as its stage is the identity's stage
+    response = await _harmony_get(session, driver_config, 'chains/{}/entries/first'.format(chain_id),
+                                  not_found=models.ChainNotFoundException)
+    identity, cursor = (None, None) if state_store is None else state_store.get(consts.NETWORK_MAINNET, chain_id, did)
+    identity, cursor = harmony_connect_connection.start_identity(did, chain_id, _harmony_entry(response['data']),
+                                                                 identity, cursor)
+    if cursor is None:
+        return identity
+
+    # At this point, we know there is a valid identity at the given chain ID
+    # Entries are fetched concurrently (and the next page listed while the current one is fetched), but are applied
+    # strictly in chain order
+    page_size = harmony_connect_connection.PAGE_SIZE
+    semaphore = asyncio.Semaphore(driver_config.harmony_fetch_concurrency)
+
+    async def get_page(offset):
+        async with semaphore:
+            return await _harmony_get(session, driver_config, 'chains/{}/entries'.format(chain_id),
+                                      params={'limit': page_size, 'offset': offset})
+
+    async def get_entry(entry_hash):
+        async with semaphore:
+            response = await _harmony_get(session, driver_config, 'chains/{}/entries/{}'.format(chain_id, entry_hash))
+        return _harmony_entry(response['data'])
+
+    page = asyncio.ensure_future(get_page(cursor.offset))
+    try:
+        keep_parsing = True
+        while keep_parsing:
+            all_entries_response = await page
+
+            data = all_entries_response['data']
+            next_offset = cursor.offset + len(data)
+            if all_entries_response['count'] <= next_offset or not data:
+                keep_parsing = False
+            else:
+                page = asyncio.ensure_future(get_page(next_offset))
+
+            entry_tasks = [asyncio.ensure_future(get_entry(e['entry_hash'])) for e in data]
+            try:
+                entries = await asyncio.gather(*entry_tasks)
+            finally:
+                for entry_task in entry_tasks:
+                    entry_task.cancel()
+            cursor, keep_reading = harmony_connect_connection.apply_entries(identity, cursor, entries)
+            keep_parsing = keep_parsing and keep_reading
+    finally:
+        page.cancel()
+
+    if state_store is not None:
+        state_store.put(consts.NETWORK_MAINNET, chain_id, identity, cursor)
+    return identity
+
+
+async def _get_identity_with_cache(session: ClientSession, driver_config: DriverConfig, did: str, chain_id: str):
+    page_size = driver_config.harmony_key_page_size
+    semaphore = asyncio.Semaphore(driver_config.harmony_fetch_concurrency)
+
+    async def get_keys(offset):
+        async with semaphore:
+            return await _harmony_get(session, driver_config, 'identities/{}/keys'.format(chain_id),
+                                      params={'limit': page_size, 'offset': offset})
+
+    # The identity and the first page of its keys are requested together (see the blocking connection)
+    first_page = asyncio.ensure_future(get_keys(0))
+    try:
+        response = await _harmony_get(session, driver_config, 'identities/{}'.format(chain_id),
+                                      not_found=models.IdentityNotFoundException)
+        keys_response = await first_page
+    finally:
+        first_page.cancel()
+    pages = await asyncio.gather(*[get_keys(offset) for offset in range(page_size, keys_response['count'], page_size)])
+
+    identity = harmony_connect_connection.identity_from_cache(did, chain_id,
+                                                              CommonUtil.decode_response(response)['data'])
+    harmony_connect_connection.add_cached_keys(identity, [k for page in [keys_response] + pages for k in page['data']])
+    return identity
+
+
+async def _harmony_get(session: ClientSession, driver_config: DriverConfig, path: str, params=None, not_found=None):
+    """GET a Harmony Connect API path. A 404 raises the given not_found exception, if any, or an ApiException."""
+    url = '{}/{}'.format(driver_config.harmony_url.rstrip('/'), path)
+    headers = {'app_id': driver_config.harmony_app_id, 'app_key': driver_config.harmony_app_key}
+    with metrics.backend_call(DriverConfig.HARMONY):
+        async with session.get(url, params=params, headers=headers,
+                               timeout=async_http.client_timeout(driver_config, DriverConfig.HARMONY)) as resp:
+            if resp.status == 404 and not_found is not None:
+                raise not_found()
+            if resp.status >= 400:
+                raise ApiException(status=resp.status, reason=resp.reason)
+            raw_body = await resp.read()
+    return async_http.decode_json(raw_body)
+
+
+def _harmony_entry(data: dict):
+    """Give an entry returned by Harmony the same shape as the entry models of the Harmony Connect client"""
+    dblock = data.get('dblock')
+    return SimpleNamespace(entry_hash=data['entry_hash'], external_ids=data['external_ids'], content=data['content'],
+                           stage=data['stage'], dblock=None if dblock is None else SimpleNamespace(**dblock))
@@ -0,0 +1,23 @@
+import json
+from . import metrics
+from .config import DriverConfig
+from aiohttp import ClientTimeout
+
+
+# Helpers of the non-blocking backend connections (async_*_connection), used by the asyncio server. Each of them parses
+# entries and builds up the identity with the very same helpers as its blocking connection, and only differs in how the
+# backend is called. They are split by backend, like the blocking connections, so that a worker only imports the client
+# libraries of the backends it resolves with (see backends).
+
+
+def client_timeout(driver_config: DriverConfig, backend: str):
+    """The connect and read timeouts of calls to the given backend. The resolution as a whole is bounded by the resolve
+    timeout, as it is cancelled once past its deadline."""
+    connect_timeout, read_timeout = driver_config.http_timeouts.get(backend, driver_config.http_timeout)
+    return ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+
+
+def decode_json(raw_body: bytes):
+    # Response bodies are read within the backend call, and decoded outside of it
+    with metrics.timed('decode'):
+        return json.loads(raw_body.decode())
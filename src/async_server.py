@@ -0,0 +1,274 @@
+import asyncio
+import json
+import logging
+import time
+from . import backends
+from . import consts
+from . import failover
+from . import metrics
+from . import responses
+from . import warm_start
+from .config import DriverConfig
+from .models import IdentityNotFoundException
+from .profiling import RequestProfiler
+from .resolver import BaseResolver, InvalidDidException, batch_error, bind, error_status, parse_did
+from .single_flight import AsyncSingleFlight
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, web
+from collections import OrderedDict
+
+
+ERROR_DETAILS = {
+    400: 'Bad request',
+    404: 'Page not found',
+    405: 'Method not allowed',
+    413: 'Too many identifiers',
+    500: 'Internal server error',
+    503: 'Service unavailable',
+    504: 'Gateway timeout'
+}
+
+HTTP_ERRORS = {
+    404: web.HTTPNotFound,
+    503: web.HTTPServiceUnavailable,
+    504: web.HTTPGatewayTimeout
+}
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncResolver(BaseResolver):
+    """Resolves DIDs without blocking the event loop, sharing one HTTP client session between all requests"""
+
+    def __init__(self, driver_config: DriverConfig):
+        super().__init__(driver_config, AsyncSingleFlight())
+        self.session = None
+        self.snapshot_writer = None
+        self.preload_task = None
+
+    async def open(self, app=None):
+        connect_timeout, read_timeout = self.driver_config.http_timeout
+        connector = TCPConnector(limit=self.driver_config.http_pool_size,
+                                 force_close=not self.driver_config.http_keep_alive)
+        self.session = ClientSession(connector=connector,
+                                     timeout=ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout))
+
+    async def warm_up(self, app=None):
+        """Load the resolution state snapshot, and start resolving the DIDs to preload in the background"""
+        self.snapshot_writer = self.start_snapshots()
+        if self.driver_config.preload_dids:
+            self.preload_task = asyncio.ensure_future(warm_start.preload_async(
+                self.resolve_did, self.driver_config.preload_dids, self.driver_config.batch_concurrency))
+
+    async def close(self, app=None):
+        if self.preload_task is not None:
+            self.preload_task.cancel()
+            self.preload_task = None
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.stop()
+            self.snapshot_writer = None
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def resolve_did(self, did: str):
+        chain_id, testnet = parse_did(did)
+        return await self.resolve(did, chain_id, testnet)
+
+    async def resolve_batch_item(self, did: str):
+        try:
+            identity = await self.resolve_did(did)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return batch_error(did, e)
+        return responses.batch_result(identity)
+
+    async def resolve(self, did: str, chain_id: str, testnet=False):
+        network = consts.NETWORK_MAINNET if not testnet else consts.NETWORK_TESTNET
+        identity = self._cached(network, chain_id, did)
+        if identity is not None:
+            return identity
+
+        # Concurrent resolutions of the same identity share a single backend resolution (see Resolver.resolve)
+        return bind(await self.resolution_flights.do((network, chain_id), self._get_and_cache_identity, did, chain_id,
+                                                     testnet), did)
+
+    async def _get_and_cache_identity(self, did: str, chain_id: str, testnet=False):
+        network = consts.NETWORK_MAINNET if not testnet else consts.NETWORK_TESTNET
+        try:
+            identity = await self.get_identity(did, chain_id, testnet)
+        except IdentityNotFoundException as e:
+            self.negative_cache.put(network, chain_id, e)
+            raise
+        return self.resolved_document_cache.put(network, chain_id, identity)
+
+    async def get_identity(self, did: str, chain_id: str, testnet=False):
+        network = consts.NETWORK_MAINNET if not testnet else consts.NETWORK_TESTNET
+        connections = failover.get_backends(self.driver_config, testnet)
+        return await failover.resolve_async(
+            self.driver_config, network, connections,
+            lambda backend, deadline: self.get_identity_from(backend, did, chain_id, testnet, deadline),
+            health=self.backend_health)
+
+    async def get_identity_from(self, backend: str, did: str, chain_id: str, testnet=False, deadline=None):
+        network = consts.NETWORK_MAINNET if not testnet else consts.NETWORK_TESTNET
+        # The shared store's SQLite calls may wait on other workers' locks, so they are made off the event loop
+        state_store = self.chain_state_store.for_backend(backend, shared=False)
+        use_shared = self.shared_chain_state_store is not None
+        loop = asyncio.get_event_loop()
+        if use_shared:
+            await loop.run_in_executor(None, state_store.load_shared, network, chain_id, did)
+
+        slow_threshold = self.driver_config.slow_resolution_log_threshold or None
+        get_identity = backends.ASYNC_CONNECTORS.get(backend)
+        with metrics.resolve_scope(backend, chain_id, slow_threshold, deadline=deadline):
+            identity = await get_identity(self.session, self.driver_config, did, chain_id, testnet=testnet,
+                                          state_store=state_store)
+        if use_shared:
+            await loop.run_in_executor(None, state_store.save_shared, network, chain_id)
+        return identity
+
+
+def create_app(driver_config: DriverConfig = None):
+    """Create the asyncio version of the driver's web app, with the same routes and responses as the Bottle app"""
+    resolver = AsyncResolver(driver_config or DriverConfig())
+    # Only the connectors of the configured backends are imported up front (see the Bottle app)
+    backends.ASYNC_CONNECTORS.load(failover.get_backends(resolver.driver_config))
+    app = web.Application(middlewares=[_metrics_middleware(resolver.profiler), _error_middleware])
+    app.on_startup.append(resolver.open)
+    app.on_startup.append(resolver.warm_up)
+    app.on_cleanup.append(resolver.close)
+
+    async def health_check(request):
+        return _json_response({'data': 'Healthy!'})
+
+    async def stats(request):
+        return _json_response({'data': resolver.stats()})
+
+    async def get_metrics(request):
+        return web.Response(text=metrics.REGISTRY.render(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+    async def resolve(request):
+        did = request.match_info['did']
+        try:
+            chain_id, testnet = parse_did(did)
+        except InvalidDidException:
+            raise web.HTTPNotFound()
+
+        try:
+            version_height = responses.parse_version_height(request.query.get('versionHeight'))
+        except ValueError:
+            raise web.HTTPBadRequest()
+
+        try:
+            identity = await resolver.resolve(did, chain_id, testnet=testnet)
+            if version_height is not None:
+                # Historical resolutions are derived from the current state of the identity (see the Bottle app)
+                identity = identity.at_height(version_height)
+        except (IdentityNotFoundException, failover.BackendUnavailableException,
+                failover.ResolutionTimeoutException) as e:
+            raise HTTP_ERRORS[error_status(e)[0]]()
+        # Clients that already have the current state of the identity get a 304 (see the Bottle app)
+        etag = identity.get_etag()
+        if responses.etag_matches(request.headers.get('If-None-Match'), etag):
+            return web.Response(status=304, headers={'ETag': etag})
+        with metrics.timed('serialize'):
+            body = identity.serialize()
+        return web.Response(body=body, content_type='application/json', headers={'ETag': etag})
+
+    async def resolve_batch(request):
+        """Resolve a list of DIDs, given as {"identifiers": [...]}, concurrently. Duplicates are resolved once, and
+        the result (or error) for each DID is returned under its own status code."""
+        try:
+            body = json.loads((await request.read()).decode())
+            dids = body['identifiers']
+        except (ValueError, TypeError, KeyError):
+            raise web.HTTPBadRequest()
+        if not isinstance(dids, list) or not all(isinstance(did, str) for did in dids):
+            raise web.HTTPBadRequest()
+
+        dids = list(OrderedDict.fromkeys(dids))
+        if len(dids) > resolver.driver_config.batch_max_size:
+            raise web.HTTPRequestEntityTooLarge(resolver.driver_config.batch_max_size, len(dids))
+
+        semaphore = asyncio.Semaphore(resolver.driver_config.batch_concurrency)
+
+        async def resolve_item(did):
+            async with semaphore:
+                return await resolver.resolve_batch_item(did)
+
+        results = await asyncio.gather(*[resolve_item(did) for did in dids])
+        with metrics.timed('serialize'):
+            body = responses.batch_response(dids, results)
+        return web.Response(body=body, content_type='application/json')
+
+    # Bottle strips trailing slashes from all requests, so both forms of each route are served here as well
+    for method, path, handler in [('GET', '/health', health_check),
+                                  ('GET', '/stats', stats),
+                                  ('GET', '/metrics', get_metrics),
+                                  ('POST', '/1.0/identifiers/batch', resolve_batch),
+                                  ('GET', '/1.0/identifiers/{did}', resolve)]:
+        app.router.add_route(method, path, handler)
+        app.router.add_route(method, path + '/', handler)
+    resolver.register_metrics()
+    return app
+
+
+def _metrics_middleware(profiler: RequestProfiler):
+    """Measure requests to the app's routes, by handler name, once errors have been turned into responses. Resolutions
+    also get a Server-Timing header, and a sampled fraction of them is profiled (see the Bottle app)."""
+
+    @web.middleware
+    async def middleware(request, handler):
+        resource = request.match_info.route.resource
+        if resource is None:
+            return await handler(request)
+
+        route_name = request.match_info.route.handler.__name__
+        timed_route = route_name.startswith('resolve')
+        profile = profiler.sample() if timed_route else None
+        start = time.perf_counter()
+        status = 500
+        try:
+            with metrics.request_timing(profile) as timing:
+                if profile is None:
+                    resp = await handler(request)
+                else:
+                    resp = await profile.run_async(handler(request))
+            status = resp.status
+            if timed_route:
+                resp.headers['Server-Timing'] = timing.header()
+            return resp
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            if profile is not None:
+                profile.finish('{}-{}'.format(route_name, request.match_info.get('did', '')))
+            metrics.observe_request(route_name, status, time.perf_counter() - start)
+
+    return middleware
+
+
+@web.middleware
+async def _error_middleware(request, handler):
+    """Turn errors into the same JSON bodies as the Bottle app's error handlers"""
+    try:
+        return await handler(request)
+    except web.HTTPException as e:
+        if e.status not in ERROR_DETAILS:
+            raise
+        return _error_response(e.status)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception('Failed to handle %s %s', request.method, request.path)
+        return _error_response(500)
+
+
+def _error_response(status: int):
+    return _json_response({'errors': {'detail': ERROR_DETAILS[status]}}, status=status)
+
+
+def _json_response(body, status=200):
+    return web.Response(text=json.dumps(body, separators=(',', ':')), status=status, content_type='application/json')
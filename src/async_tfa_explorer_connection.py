@@ -0,0 +1,76 @@
+import asyncio
+from . import async_http
+from . import consts
+from . import metrics
+from . import models
+from . import tfa_explorer_connection
+from .chain_state import ChainStateStore
+from .config import DriverConfig
+from aiohttp import ClientSession, ClientTimeout
+from collections import deque
+
+
+# The non-blocking version of tfa_explorer_connection, used by the asyncio server (see async_http)
+
+
+async def get_identity(session: ClientSession, driver_config: DriverConfig, did: str, chain_id: str,
+                       testnet=False, state_store: ChainStateStore = None):
+    api_base_url = driver_config.tfa_explorer_mainnet if not testnet else driver_config.tfa_explorer_testnet
+    network = consts.NETWORK_MAINNET if not testnet else consts.NETWORK_TESTNET
+    timeout = async_http.client_timeout(driver_config, DriverConfig.TFA_EXPLORER)
+
+    identity, cursor = (None, None) if state_store is None else state_store.get(network, chain_id, did)
+    if identity is None:
+        entries = await _get_entries(session, api_base_url, timeout, chain_id, 1, 0)
+        if not entries:
+            raise models.ChainNotFoundException()
+        identity, cursor = tfa_explorer_connection.create_identity(did, chain_id, entries[0])
+        if cursor is None:
+            return identity
+
+    # At this point, we know there is a valid identity at the given chain ID
+    # Pages grow in size, and are fetched concurrently once the chain needs more than one (see the blocking connection)
+    pages = tfa_explorer_connection.PagePlan(driver_config, cursor.offset)
+    concurrency = max(driver_config.tfa_explorer_fetch_concurrency, 1)
+    windows = deque()
+
+    def fetch_next_window():
+        limit, offset = pages.next_page()
+        windows.append((asyncio.ensure_future(
+            _get_entries(session, api_base_url, timeout, chain_id, limit, offset)), limit))
+
+    fetch_next_window()
+    try:
+        while True:
+            window, limit = windows.popleft()
+            entries = await window
+            cursor, keep_parsing = tfa_explorer_connection.apply_entries(identity, cursor, entries)
+            outcome = pages.after_page(entries, limit, cursor) if keep_parsing else tfa_explorer_connection.PagePlan.END
+            if outcome == tfa_explorer_connection.PagePlan.END:
+                break
+            if outcome == tfa_explorer_connection.PagePlan.RESTART:
+                for window, _ in windows:
+                    window.cancel()
+                windows.clear()
+
+            while len(windows) < concurrency:
+                fetch_next_window()
+    finally:
+        for window, _ in windows:
+            window.cancel()
+
+    if state_store is not None:
+        state_store.put(network, chain_id, identity, cursor)
+    return identity
+
+
+async def _get_entries(session: ClientSession, api_base_url: str, timeout: ClientTimeout, chain_id: str,
+                       limit: int, offset: int):
+    url = '{}/chain/entries/{}?limit={}&offset={}'.format(api_base_url, chain_id, limit, offset)
+    with metrics.backend_call(DriverConfig.TFA_EXPLORER):
+        async with session.get(url, timeout=timeout) as resp:
+            if resp.status != 200:
+                raise ValueError
+            raw_body = await resp.read()
+    result = async_http.decode_json(raw_body).get('result')
+    return [] if result is None else result
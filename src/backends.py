@@ -0,0 +1,57 @@
+import importlib
+import threading
+from .config import DriverConfig
+
+
+class BackendRegistry:
+    """The function that resolves identities with each connection type, given as "module:function" (relative to this
+    package). A module is only imported once its connection type is loaded or first used, so that workers don't import
+    the client libraries of the backends they don't resolve with."""
+
+    def __init__(self, connectors: dict):
+        self._connectors = dict(connectors)
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def register(self, backend: str, connector: str):
+        with self._lock:
+            self._connectors[backend] = connector
+            self._loaded.pop(backend, None)
+
+    def get(self, backend: str):
+        connector = self._loaded.get(backend)
+        if connector is not None:
+            return connector
+
+        with self._lock:
+            if backend not in self._loaded:
+                if backend not in self._connectors:
+                    raise ValueError('Invalid factom connection type: "{}"'.format(backend))
+                module_name, function_name = self._connectors[backend].split(':')
+                module = importlib.import_module(module_name, __package__)
+                self._loaded[backend] = getattr(module, function_name)
+            return self._loaded[backend]
+
+    def load(self, backends: list):
+        """Import the connectors of the given connection types up front (e.g. those configured), so that the first
+        resolutions don't wait on it"""
+        for backend in backends:
+            self.get(backend)
+
+    def loaded(self):
+        return sorted(self._loaded)
+
+
+# get_identity(driver_config, did, chain_id, testnet=False, state_store=None)
+CONNECTORS = BackendRegistry({
+    DriverConfig.FACTOMD: '.factomd_jsonrpc_connection:get_identity',
+    DriverConfig.TFA_EXPLORER: '.tfa_explorer_connection:get_identity',
+    DriverConfig.HARMONY: '.harmony_connect_connection:get_identity'
+})
+
+# The asyncio versions: get_identity(session, driver_config, did, chain_id, testnet=False, state_store=None)
+ASYNC_CONNECTORS = BackendRegistry({
+    DriverConfig.FACTOMD: '.async_factomd_connection:get_identity',
+    DriverConfig.TFA_EXPLORER: '.async_tfa_explorer_connection:get_identity',
+    DriverConfig.HARMONY: '.async_harmony_connect_connection:get_identity'
+})
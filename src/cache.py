@@ -0,0 +1,179 @@
+import hashlib
+import math
+import threading
+import time
+from .models import NotAnIdentityException
+from collections import OrderedDict
+
+
+class ResolvedDocumentCache:
+    """Bounded LRU cache of resolved identities keyed by (network, chain_id), with TTLs that depend on the identity's
+    stage. DIDs that refer to the same chain (e.g. "did:factom:<chain_id>" and "did:factom:mainnet:<chain_id>") share
+    an entry; the identity bound to each DID (along with its rendered result) is kept alongside it."""
+
+    def __init__(self, max_size=1024, pending_ttl=10, confirmed_ttl=120, clock=time.monotonic):
+        self.max_size = max_size
+        self.pending_ttl = pending_ttl
+        self.confirmed_ttl = confirmed_ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, network: str, chain_id: str, did: str):
+        """Return the cached identity bound to the given DID, or None if there is no fresh entry for its chain. The
+        identity must not be modified."""
+        key = (network, chain_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, identity, identities = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            did_identity = identities.get(did)
+
+        if did_identity is None:
+            did_identity = identity.copy(did)
+            with self._lock:
+                identities[did] = did_identity
+        return did_identity
+
+    def put(self, network: str, chain_id: str, identity):
+        """Cache the given resolved identity, which must not be modified afterwards, and return it"""
+        if self.max_size <= 0:
+            return identity
+
+        ttl = self.pending_ttl if identity.stage == 'pending' else self.confirmed_ttl
+        key = (network, chain_id)
+        with self._lock:
+            self._entries[key] = (self.clock() + ttl, identity, {identity.did: identity})
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return identity
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxSize': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+
+class NegativeCache:
+    """Bounded LRU cache of the chains that resolved to no identity, keyed by (network, chain_id), so that repeated
+    lookups of the same chain are answered without contacting the backends.
+
+    Missing chains are kept for missing_ttl seconds, as they may yet be created. A chain that exists but isn't an
+    identity never becomes one, so it is kept for not_identity_ttl seconds, and also added to a bloom filter that keeps
+    remembering it (with a small rate of false positives) once it has been evicted or has expired."""
+
+    def __init__(self, max_size=10000, missing_ttl=60, not_identity_ttl=3600, bloom_capacity=1000000,
+                 bloom_error_rate=1e-6, clock=time.monotonic):
+        self.max_size = max_size
+        self.missing_ttl = missing_ttl
+        self.not_identity_ttl = not_identity_ttl
+        self.clock = clock
+        self.hits = 0
+        self.bloom_hits = 0
+        self.misses = 0
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self._bloom_filters = [self._new_bloom_filter()] if bloom_capacity > 0 else []
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, network: str, chain_id: str):
+        """Whether the chain is known not to resolve to an identity"""
+        key = (network, chain_id)
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is not None:
+                if expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True
+                del self._entries[key]
+            if any(_bloom_key(network, chain_id) in bloom_filter for bloom_filter in self._bloom_filters):
+                self.bloom_hits += 1
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def put(self, network: str, chain_id: str, error: Exception):
+        """Remember that the chain resolved to no identity, for as long as the given IdentityNotFoundException allows"""
+        if self.max_size <= 0:
+            return
+
+        not_identity = isinstance(error, NotAnIdentityException)
+        ttl = self.not_identity_ttl if not_identity else self.missing_ttl
+        key = (network, chain_id)
+        with self._lock:
+            self._entries[key] = self.clock() + ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            if not_identity and self._bloom_filters:
+                # Once the current filter is full, a new one is started and the oldest one is dropped, which keeps the
+                # false positive rate bounded
+                if self._bloom_filters[-1].count >= self.bloom_capacity:
+                    self._bloom_filters = [self._bloom_filters[-1], self._new_bloom_filter()]
+                self._bloom_filters[-1].add(_bloom_key(network, chain_id))
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxSize': self.max_size,
+            'hits': self.hits,
+            'bloomHits': self.bloom_hits,
+            'misses': self.misses,
+            'bloomSize': sum(bloom_filter.count for bloom_filter in self._bloom_filters)
+        }
+
+    def _new_bloom_filter(self):
+        return BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+
+
+class BloomFilter:
+    """Compact set of strings, sized for the given capacity and false positive rate. There are no false negatives."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.bit_count = max(int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)), 8)
+        self.hash_count = max(int(round(self.bit_count / capacity * math.log(2))), 1)
+        self.count = 0
+        self._bits = bytearray((self.bit_count + 7) // 8)
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def _positions(self, item: str):
+        # Double hashing: the hash_count positions are derived from two 64-bit hashes
+        digest = hashlib.sha256(item.encode()).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        return [(h1 + i * h2) % self.bit_count for i in range(self.hash_count)]
+
+
+def _bloom_key(network: str, chain_id: str):
+    return '{}{}'.format(network, chain_id)
@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+
+# Where a chain was last resolved up to:
+# - entry_hash: hash of the last confirmed entry that was applied
+# - height: directory block height of that entry
+# - offset: number of confirmed entries in the chain that have been applied (i.e. the index of the next entry)
+# - keymr: KeyMR of the entry block holding that entry, if known by the connection that produced the cursor
+ChainCursor = namedtuple('ChainCursor', ['entry_hash', 'height', 'offset', 'keymr'])
+
+
+class ChainStateStore:
+    """Bounded, thread-safe store of each chain's resolved Identity state along with the cursor it was resolved up to.
+    Connectors use it to fetch and apply only the entries added since the last resolution of a chain.
+
+    States missing from the store are looked up in the shared store, if given (see shared_cache), which also gets a
+    copy of every state stored. Callers that must not block on the shared store (i.e. the asyncio server) skip it with
+    shared=False, and copy states from and to it with load_shared and save_shared in a thread of their own."""
+
+    def __init__(self, max_size=1024, shared=None):
+        self.max_size = max_size
+        self.shared = shared
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, network: str, chain_id: str, did: str, shared=True):
+        """Return a private copy of the stored identity (bound to the given DID) and its cursor, or (None, None)"""
+        with self._lock:
+            state = self._states.get((network, chain_id))
+            if state is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._states.move_to_end((network, chain_id))
+        if state is None:
+            return (None, None) if self.shared is None or not shared else self._get_shared(network, chain_id, did)
+        identity, cursor = state
+        return identity.copy(did), cursor
+
+    def put(self, network: str, chain_id: str, identity, cursor: ChainCursor, shared=True):
+        """Store a copy of the identity, unless a state further along the chain has already been stored"""
+        if self.max_size <= 0 or identity.stage == 'pending':
+            return
+
+        if self.shared is not None and shared:
+            self.shared.put(network, chain_id, identity, cursor)
+        self._put(network, chain_id, identity.copy(), cursor)
+
+    def _put(self, network: str, chain_id: str, identity, cursor: ChainCursor):
+        with self._lock:
+            existing = self._states.get((network, chain_id))
+            if existing is not None and existing[1].offset > cursor.offset:
+                return
+            self._states[(network, chain_id)] = (identity, cursor)
+            self._states.move_to_end((network, chain_id))
+            while len(self._states) > self.max_size:
+                self._states.popitem(last=False)
+
+    def _get_shared(self, network: str, chain_id: str, did: str):
+        identity, cursor = self.shared.get(network, chain_id, did)
+        if identity is not None:
+            self._put(network, chain_id, identity.copy(), cursor)
+        return identity, cursor
+
+    def load_shared(self, network: str, chain_id: str, did: str):
+        """Copy the chain's state from the shared store, unless this store already has it"""
+        if self.shared is None:
+            return
+        with self._lock:
+            if (network, chain_id) in self._states:
+                return
+        self._get_shared(network, chain_id, did)
+
+    def save_shared(self, network: str, chain_id: str):
+        """Copy the chain's state to the shared store"""
+        with self._lock:
+            state = self._states.get((network, chain_id))
+        if self.shared is not None and state is not None:
+            self.shared.put(network, chain_id, *state)
+
+    def dump(self):
+        """Return the stored states, least recently used first, as (network, chain_id, identity, cursor) tuples. The
+        identities must not be modified."""
+        with self._lock:
+            return [(network, chain_id, identity, cursor)
+                    for (network, chain_id), (identity, cursor) in self._states.items()]
+
+    def for_backend(self, backend: str, shared=True):
+        """A view of the store for a single backend. Cursors are only meaningful to the connector that produced them
+        (e.g. a page offset may fall in the middle of an entry block), so each backend's states are kept apart."""
+        return BackendChainStateStore(self, backend, shared)
+
+    def stats(self):
+        return {
+            'size': len(self._states),
+            'maxSize': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def __len__(self):
+        return len(self._states)
+
+
+class BackendChainStateStore:
+    """A backend's view of a ChainStateStore (see ChainStateStore.for_backend)"""
+
+    def __init__(self, store: ChainStateStore, backend: str, shared=True):
+        self.store = store
+        self.backend = backend
+        self.shared = shared
+
+    def get(self, network: str, chain_id: str, did: str):
+        return self.store.get(self._network(network), chain_id, did, shared=self.shared)
+
+    def put(self, network: str, chain_id: str, identity, cursor: ChainCursor):
+        self.store.put(self._network(network), chain_id, identity, cursor, shared=self.shared)
+
+    def load_shared(self, network: str, chain_id: str, did: str):
+        self.store.load_shared(self._network(network), chain_id, did)
+
+    def save_shared(self, network: str, chain_id: str):
+        self.store.save_shared(self._network(network), chain_id)
+
+    def _network(self, network: str):
+        return '{}/{}'.format(self.backend, network)
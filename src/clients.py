@@ -0,0 +1,111 @@
+import os
+import requests
+import threading
+from . import failover
+from . import metrics
+from .config import DriverConfig
+from requests.adapters import HTTPAdapter
+
+
+# Long-lived clients, built once per worker process (gunicorn forks workers, and connection pools must not be shared
+# across processes) and keyed by backend and network. The client libraries of each backend are only imported once one
+# of its clients is built.
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+
+
+class PooledSession(requests.Session):
+    """A requests Session with a bounded connection pool and the given backend's timeouts, capped to the deadline of
+    the resolution in progress. Requests are measured as calls to the backend."""
+
+    def __init__(self, driver_config: DriverConfig, backend: str = 'other'):
+        super().__init__()
+        self.backend = backend
+        adapter = HTTPAdapter(pool_connections=driver_config.http_pool_size, pool_maxsize=driver_config.http_pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        self.timeout = driver_config.http_timeouts.get(backend, driver_config.http_timeout)
+        if not driver_config.http_keep_alive:
+            self.headers['Connection'] = 'close'
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        kwargs['timeout'] = failover.cap_timeout(kwargs['timeout'])
+        with metrics.backend_call(self.backend):
+            return super().request(method, url, **kwargs)
+
+
+def get_session(driver_config: DriverConfig, backend: str, network: str):
+    """Get the shared HTTP session used for the given backend and network"""
+    return _get_client(('session', backend, network), lambda: PooledSession(driver_config, backend))
+
+
+def get_factomd(driver_config: DriverConfig, testnet=False):
+    """Get the shared factomd JSON-RPC client for the given network"""
+    def create():
+        from factom import Factomd
+        factomd = Factomd(host=driver_config.rpc_url_mainnet if not testnet else driver_config.rpc_url_testnet)
+        session = PooledSession(driver_config, DriverConfig.FACTOMD)
+        session.headers.update(factomd.session.headers)
+        factomd.session = session
+        return factomd
+
+    return _get_client(('factomd', testnet), create)
+
+
+def get_harmony_entries_api(driver_config: DriverConfig):
+    """Get the shared Harmony Connect entries API client"""
+    def create():
+        import harmony_connect_client as api
+        from .harmony_clients import MeasuredApiClient
+        api_config = api.Configuration()
+        api_config.host = driver_config.harmony_url
+        api_config.api_key['app_id'] = driver_config.harmony_app_id
+        api_config.api_key['app_key'] = driver_config.harmony_app_key
+        api_config.connection_pool_maxsize = driver_config.http_pool_size
+        api_client = MeasuredApiClient(api_config)
+        if not driver_config.http_keep_alive:
+            api_client.set_default_header('Connection', 'close')
+        return api.EntriesApi(api_client)
+
+    return _get_client(('harmony', 'entries'), create)
+
+
+def get_harmony_sdk(driver_config: DriverConfig):
+    """Get the shared Factom SDK client for Harmony Connect"""
+    def create():
+        from .harmony_clients import PooledRequestHandler
+        from factom_sdk import FactomClient
+        factom_sdk = FactomClient(driver_config.harmony_url, driver_config.harmony_app_id,
+                                  driver_config.harmony_app_key)
+        session = PooledSession(driver_config, DriverConfig.HARMONY)
+        request_handler = PooledRequestHandler(session, driver_config.harmony_url, driver_config.harmony_app_id,
+                                               driver_config.harmony_app_key)
+        factom_sdk.identities.request_handler = request_handler
+        factom_sdk.identities.keys.request_handler = request_handler
+        return factom_sdk
+
+    return _get_client(('harmony', 'sdk'), create)
+
+
+def reset():
+    """Drop all clients, so that they get rebuilt on next use"""
+    global _clients_pid
+    with _clients_lock:
+        _clients.clear()
+        _clients_pid = None
+
+
+def _get_client(key, create):
+    global _clients_pid
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        client = _clients.get(key)
+        if client is None:
+            client = create()
+            _clients[key] = client
+        return client
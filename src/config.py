@@ -13,15 +13,32 @@ class DriverConfig:
         if self.factom_connection not in DriverConfig.valid_connection_types:
             raise ValueError('Invalid factom connection type: "{}"'.format(self.factom_connection))
 
+        # Ordered list of backends to resolve with, overriding factomConnection. The next backend is tried when the
+        # previous one fails, or in parallel once the ones started so far have taken longer than the hedge delay (in
+        # seconds, 0 to disable hedging)
+        connections = os.getenv('uniresolver_driver_did_factom_factomConnections', '')
+        self.factom_connections = [c.strip() for c in connections.split(',') if c.strip()]
+        for connection in self.factom_connections:
+            if connection not in DriverConfig.valid_connection_types:
+                raise ValueError('Invalid factom connection type: "{}"'.format(connection))
+        self.hedge_delay = float(os.getenv('uniresolver_driver_did_factom_hedgeDelay', '2'))
+        self.backend_workers = int(os.getenv('uniresolver_driver_did_factom_backendWorkers', '32'))
+
         # Factomd JSON RPC
         self.rpc_url_mainnet = os.getenv('uniresolver_driver_did_factom_rpcUrlMainnet', 'https://api.factomd.net')
         self.rpc_url_testnet = os.getenv('uniresolver_driver_did_factom_rpcUrlTestnet', 'https://dev.factomd.net')
+        self.factomd_batch_size = int(os.getenv('uniresolver_driver_did_factom_rpcBatchSize', '50'))
 
         # TFA's Explorer API
         self.tfa_explorer_mainnet = os.getenv('uniresolver_driver_did_factom_tfaExplorerApiUrlMainnet',
                                               'https://explorer.factoid.org/api/v1')
         self.tfa_explorer_testnet = os.getenv('uniresolver_driver_did_factom_tfaExplorerApiUrlTestnet',
                                               'https://testnet.factoid.org/api/v1')
+        self.tfa_explorer_page_size = int(os.getenv('uniresolver_driver_did_factom_tfaExplorerApiPageSize', '25'))
+        self.tfa_explorer_max_page_size = int(
+            os.getenv('uniresolver_driver_did_factom_tfaExplorerApiMaxPageSize', '100'))
+        self.tfa_explorer_fetch_concurrency = int(
+            os.getenv('uniresolver_driver_did_factom_tfaExplorerApiFetchConcurrency', '4'))
 
         # Factom Inc's Harmony Connect
         self.harmony_url = os.getenv('uniresolver_driver_did_factom_harmonyApiUrl', 'https://api.factom.com/v1')
@@ -29,3 +46,81 @@ class DriverConfig:
         self.harmony_app_key = os.getenv('uniresolver_driver_did_factom_harmonyApiAppKey', '')
         caching = os.getenv('uniresolver_driver_did_factom_harmonyApiCachingEnabled', 'false')
         self.harmony_caching_enabled = caching.lower() == 'true'
+        self.harmony_fetch_concurrency = int(os.getenv('uniresolver_driver_did_factom_harmonyApiFetchConcurrency', '8'))
+        self.harmony_key_page_size = int(os.getenv('uniresolver_driver_did_factom_harmonyApiKeyPageSize', '25'))
+
+        # HTTP connections to the backends, shared by all requests handled by a worker
+        self.http_pool_size = int(os.getenv('uniresolver_driver_did_factom_httpPoolSize', '10'))
+        self.http_keep_alive = os.getenv('uniresolver_driver_did_factom_httpKeepAlive', 'true').lower() == 'true'
+        self.http_timeout = (float(os.getenv('uniresolver_driver_did_factom_httpConnectTimeout', '5')),
+                             float(os.getenv('uniresolver_driver_did_factom_httpReadTimeout', '30')))
+        # Connect and read timeouts (in seconds) of each backend, defaulting to the ones above
+        self.http_timeouts = {
+            DriverConfig.FACTOMD: self._get_timeout('rpc'),
+            DriverConfig.TFA_EXPLORER: self._get_timeout('tfaExplorerApi'),
+            DriverConfig.HARMONY: self._get_timeout('harmonyApi')
+        }
+
+        # Total time (in seconds) a resolution may take, across all the backends it tries (0 to disable)
+        self.resolve_timeout = float(os.getenv('uniresolver_driver_did_factom_resolveTimeout', '60'))
+
+        # A backend's circuit opens once the error rate of its last resolutions (on a network) reaches the threshold
+        # (0 to disable), and it is then left out for the open duration (in seconds), before a trial resolution
+        self.circuit_breaker_window = int(os.getenv('uniresolver_driver_did_factom_circuitBreakerWindow', '20'))
+        self.circuit_breaker_error_threshold = float(
+            os.getenv('uniresolver_driver_did_factom_circuitBreakerErrorThreshold', '0.5'))
+        self.circuit_breaker_open_duration = float(
+            os.getenv('uniresolver_driver_did_factom_circuitBreakerOpenDuration', '30'))
+
+        # Batch resolution
+        self.batch_max_size = int(os.getenv('uniresolver_driver_did_factom_batchMaxSize', '1000'))
+        self.batch_concurrency = int(os.getenv('uniresolver_driver_did_factom_batchConcurrency', '8'))
+
+        # Resolution state
+        self.chain_state_cache_size = int(os.getenv('uniresolver_driver_did_factom_chainStateCacheSize', '1024'))
+        # Resolution state shared by all the workers of a host, in an SQLite database at the given path (empty to
+        # disable), bounded to the given number of chains
+        self.shared_cache_path = os.getenv('uniresolver_driver_did_factom_sharedCachePath', '')
+        self.shared_cache_size = int(os.getenv('uniresolver_driver_did_factom_sharedCacheSize', '100000'))
+
+        # Warm start: resolution state is saved to a snapshot file (empty to disable) every snapshotInterval seconds
+        # (0 to only save it at exit) and loaded back at startup, and the given DIDs are resolved in the background as
+        # soon as the driver starts
+        self.snapshot_path = os.getenv('uniresolver_driver_did_factom_snapshotPath', '')
+        self.snapshot_interval = float(os.getenv('uniresolver_driver_did_factom_snapshotInterval', '300'))
+        dids = os.getenv('uniresolver_driver_did_factom_preloadDids', '')
+        self.preload_dids = [d.strip() for d in dids.split(',') if d.strip()]
+
+        # Fraction of resolution requests profiled with cProfile (0 to disable), and where their profiles are written
+        self.profile_sample_rate = float(os.getenv('uniresolver_driver_did_factom_profileSampleRate', '0'))
+        self.profile_directory = os.getenv('uniresolver_driver_did_factom_profileDirectory', '/tmp/did-factom-profiles')
+
+        # Resolutions that take longer than this (in seconds) are logged, along with the work they took (0 to disable)
+        self.slow_resolution_log_threshold = float(
+            os.getenv('uniresolver_driver_did_factom_slowResolutionLogThreshold', '5'))
+
+        # Resolved DID document cache, with TTLs (in seconds) for "pending" and for "factom"/"anchored" identities
+        self.resolved_document_cache_size = int(
+            os.getenv('uniresolver_driver_did_factom_resolvedDocumentCacheSize', '1024'))
+        self.resolved_document_cache_pending_ttl = float(
+            os.getenv('uniresolver_driver_did_factom_resolvedDocumentCachePendingTtl', '10'))
+        self.resolved_document_cache_confirmed_ttl = float(
+            os.getenv('uniresolver_driver_did_factom_resolvedDocumentCacheConfirmedTtl', '120'))
+
+        # Negative cache of the chains that resolved to no identity, with TTLs (in seconds) for missing chains and for
+        # chains that are not identities, which are also remembered by a bloom filter sized for the given capacity and
+        # false positive rate (capacity 0 to disable)
+        self.negative_cache_size = int(os.getenv('uniresolver_driver_did_factom_negativeCacheSize', '10000'))
+        self.negative_cache_missing_chain_ttl = float(
+            os.getenv('uniresolver_driver_did_factom_negativeCacheMissingChainTtl', '60'))
+        self.negative_cache_not_identity_ttl = float(
+            os.getenv('uniresolver_driver_did_factom_negativeCacheNotIdentityTtl', '3600'))
+        self.negative_cache_bloom_capacity = int(
+            os.getenv('uniresolver_driver_did_factom_negativeCacheBloomCapacity', '1000000'))
+        self.negative_cache_bloom_error_rate = float(
+            os.getenv('uniresolver_driver_did_factom_negativeCacheBloomErrorRate', '0.000001'))
+
+    def _get_timeout(self, prefix: str):
+        connect_timeout, read_timeout = self.http_timeout
+        return (float(os.getenv('uniresolver_driver_did_factom_{}ConnectTimeout'.format(prefix), connect_timeout)),
+                float(os.getenv('uniresolver_driver_did_factom_{}ReadTimeout'.format(prefix), read_timeout)))
@@ -1,31 +1,154 @@
+from . import clients
 from . import consts
+from . import metrics
 from . import models
+from .chain_state import ChainCursor, ChainStateStore
 from .config import DriverConfig
 from factom import Factomd
-from factom.exceptions import MissingChainHead
+from factom.exceptions import FactomAPIError, MissingChainHead, handle_error_response
+from collections import namedtuple
+from itertools import islice
 
 
-def get_identity(driver_config: DriverConfig, did: str, chain_id: str, testnet=False):
-    rpc_url = driver_config.rpc_url_mainnet if not testnet else driver_config.rpc_url_testnet
-    factomd = Factomd(host=rpc_url)
+NULL_BLOCK = '0' * 64
+
+EntryBlock = namedtuple('EntryBlock', ['keymr', 'height', 'entry_hashes'])
+ChainEntry = namedtuple('ChainEntry', ['entry_hash', 'height', 'keymr', 'external_ids', 'content'])
+
+
+def get_identity(driver_config: DriverConfig, did: str, chain_id: str, testnet=False,
+                 state_store: ChainStateStore = None):
+    network = consts.NETWORK_MAINNET if not testnet else consts.NETWORK_TESTNET
+    factomd = clients.get_factomd(driver_config, testnet)
+
+    identity, cursor = (None, None) if state_store is None else state_store.get(network, chain_id, did)
     try:
-        chain = factomd.read_chain(chain_id, include_entry_context=True)
+        chain_head = factomd.chain_head(chain_id)['chainhead']
     except MissingChainHead:
-        raise models.IdentityNotFoundException()
+        raise models.ChainNotFoundException()
+    if not chain_head or chain_head == NULL_BLOCK:
+        raise models.ChainNotFoundException()
+
+    # Only the entry blocks written after the cursor need to be fetched
+    if cursor is None:
+        entry_blocks = _get_entry_blocks(factomd, chain_head)
+    else:
+        entry_blocks = _get_entry_blocks(factomd, chain_head, cursor.height + 1, cursor.keymr)
+    entries = _read_entries(factomd, entry_blocks, driver_config.factomd_batch_size, include_first=identity is None)
+    identity, cursor = apply_entries(did, chain_id, identity, cursor, entries)
+
+    if state_store is not None:
+        state_store.put(network, chain_id, identity, cursor)
+    return identity
+
 
-    entry = chain[-1]
-    if len(entry['extids']) <= 1 or entry['extids'][0] != consts.IDENTITY_CHAIN_TAG:
-        raise models.IdentityNotFoundException()
+def apply_entries(did: str, chain_id: str, identity: models.Identity, cursor: ChainCursor, entries):
+    """Apply the given ChainEntries (in chain order) to the identity, first creating it from the chain's first entry if
+    there is no identity yet. Returns the identity and the cursor after the last entry."""
+    entry_count = 0
+    entries = iter(entries)
+    if identity is None:
+        entry = next(entries, None)
+        if entry is None:
+            raise models.ChainNotFoundException()
+        if len(entry.external_ids) <= 1 or entry.external_ids[0] != consts.IDENTITY_CHAIN_TAG:
+            raise models.NotAnIdentityException()
 
-    identity = models.Identity(did, chain_id)
-    identity.process_creation(entry['entryhash'], entry['extids'], entry['content'],
-                              stage='factom', height=entry['dbheight'])
+        identity = models.Identity(did, chain_id)
+        identity.process_creation(entry.entry_hash, entry.external_ids, entry.content,
+                                  stage='factom', height=entry.height)
+        cursor = ChainCursor(entry.entry_hash, entry.height, 1, entry.keymr)
+        entry_count += 1
 
     # At this point, we know there is a valid identity at the given chain ID
-    for entry in reversed(chain[:-1]):
-        if len(entry['extids']) != 5 or entry['extids'][0] != consts.KEY_REPLACEMENT_TAG:
+    for entry in entries:
+        entry_count += 1
+        cursor = ChainCursor(entry.entry_hash, entry.height, cursor.offset + 1, entry.keymr)
+        if entry.external_ids is None:
             continue
 
-        identity.process_key_replacement(entry['entryhash'], entry['extids'], entry['dbheight'])
+        identity.process_key_replacement(entry.entry_hash, entry.external_ids, entry.height)
 
-    return identity
+    metrics.count_entries(DriverConfig.FACTOMD, entry_count)
+    return identity, cursor
+
+
+def _get_entry_blocks(factomd: Factomd, keymr: str, from_height=0, stop_keymr=None):
+    """Walk the entry block chain backwards from the given KeyMR, returning all blocks at or above from_height (and
+    after stop_keymr) in chain order. Only the hashes of each block's entries are kept."""
+    entry_blocks = []
+    while keymr != NULL_BLOCK and keymr != stop_keymr:
+        block = factomd.entry_block(keymr)
+        if block['header']['dbheight'] < from_height:
+            break
+        entry_hashes = [entry_pointer['entryhash'] for entry_pointer in block['entrylist']]
+        entry_blocks.append(EntryBlock(keymr, block['header']['dbheight'], entry_hashes))
+        keymr = block['header']['prevkeymr']
+    entry_blocks.reverse()
+    return entry_blocks
+
+
+def _read_entries(factomd: Factomd, entry_blocks: list, batch_size=50, include_first=False):
+    """A generator that yields each entry of the given entry blocks in chain order. Entries are fetched with one
+    JSON-RPC batch request per batch_size entries (which may span several entry blocks), and only one batch is held in
+    memory at a time.
+
+    Only key replacements (and the very first entry, if include_first is set) have their external IDs and content
+    decoded and kept. Any other entry is dropped based on its external IDs alone, and yielded without them."""
+    entry_pointers = ((block, entry_hash) for block in entry_blocks for entry_hash in block.entry_hashes)
+    while True:
+        batch = list(islice(entry_pointers, batch_size))
+        if not batch:
+            return
+
+        results = _batch_request(factomd, [('entry', {'hash': entry_hash}) for _, entry_hash in batch])
+        with metrics.timed('decode'):
+            entries = []
+            for (block, entry_hash), entry in zip(batch, results):
+                entries.append(to_chain_entry(block, entry_hash, entry, include_first))
+                include_first = False
+        yield from entries
+
+
+def to_chain_entry(block: EntryBlock, entry_hash: str, entry: dict, keep_content=False):
+    """Convert an entry returned by factomd into a ChainEntry. Its external IDs are only decoded and kept for key
+    replacements (or if keep_content is set, along with the content)."""
+    if keep_content:
+        external_ids = [bytes.fromhex(x) for x in entry['extids']]
+        content = bytes.fromhex(entry['content'])
+    elif len(entry['extids']) == 5 and bytes.fromhex(entry['extids'][0]) == consts.KEY_REPLACEMENT_TAG:
+        external_ids = [bytes.fromhex(x) for x in entry['extids']]
+        content = None
+    else:
+        external_ids = None
+        content = None
+    return ChainEntry(entry_hash, block.height, block.keymr, external_ids, content)
+
+
+def batch_payload(calls: list):
+    """Build a JSON-RPC batch request for the given (method, params) calls"""
+    return [{'jsonrpc': '2.0', 'id': i, 'method': method, 'params': params} for i, (method, params) in enumerate(calls)]
+
+
+def batch_results(calls: list, body: list, resp=None):
+    """Return the results of a JSON-RPC batch response in the order of the calls, raising if any of the calls failed"""
+    responses = {r.get('id'): r for r in body}
+    results = []
+    for i in range(len(calls)):
+        response = responses.get(i, {'error': {'message': 'Missing response in batch'}})
+        if 'error' in response:
+            error = response['error']
+            raise FactomAPIError(message=error.get('message'), code=error.get('code'), data=error.get('data'),
+                                 response=resp)
+        results.append(response['result'])
+    return results
+
+
+def _batch_request(factomd: Factomd, calls: list):
+    """Make several JSON-RPC calls in a single batch request, returning their results in the same order"""
+    resp = factomd.session.request('POST', factomd.url, json=batch_payload(calls))
+    with metrics.timed('decode'):
+        body = resp.json()
+    if resp.status_code >= 400 or not isinstance(body, list):
+        handle_error_response(resp)
+    return batch_results(calls, body, resp)
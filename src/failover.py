@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from . import metrics
+from .config import DriverConfig
+from .health import BackendHealthRegistry
+from .models import IdentityNotFoundException
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+# Resolution across an ordered list of backends. The healthiest backend is tried first (see BackendHealthRegistry).
+# The next one is started when the previous one fails (failover), or when none of the backends started so far has
+# answered within the hedge delay (hedging). The first identity found is returned. A backend that answers that the
+# identity doesn't exist is taken at its word, so not found is only returned once every backend that was started has
+# answered or failed. The whole resolution must complete within the resolve timeout.
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+class ResolutionTimeoutException(Exception):
+    pass
+
+
+class BackendUnavailableException(Exception):
+    pass
+
+
+def get_backends(driver_config: DriverConfig, testnet=False):
+    """The backends to resolve with, in order of preference"""
+    backends = driver_config.factom_connections or [driver_config.factom_connection]
+    if testnet:
+        # TODO: switch this to use the Harmony connection if Harmony ever spins up a community testnet environment
+        # For now, fall back to using a factomd connection
+        backends = [backend for backend in backends if backend != DriverConfig.HARMONY] or [DriverConfig.FACTOMD]
+    return backends
+
+
+def resolve(driver_config: DriverConfig, network: str, backends: list, resolve_with,
+            health: BackendHealthRegistry = None):
+    """Resolve with resolve_with(backend, deadline), across the given backends. Attempts run in a shared thread pool.
+    Attempts that lose the race, or outlive the deadline, are left to finish in the background, and stop at their next
+    backend call once past the deadline (see cap_timeout)."""
+    backends = _route(network, backends, health)
+    deadline = None if driver_config.resolve_timeout <= 0 else time.monotonic() + driver_config.resolve_timeout
+    if len(backends) == 1 and deadline is None:
+        if not _allow(health, network, backends[0]):
+            raise BackendUnavailableException()
+        metrics.BACKEND_ATTEMPTS.inc(backends[0], 'first')
+        return _attempt(health, network, backends[0], resolve_with, deadline)
+
+    executor = _get_executor(driver_config)
+    remaining = list(backends)
+    attempts = {}
+    outcome = _Outcome()
+
+    def start_next(reason):
+        backend = _next_allowed(health, network, remaining)
+        if backend is None:
+            return False
+        metrics.BACKEND_ATTEMPTS.inc(backend, reason)
+        # The attempt's backend calls are attributed to the request that started it (see metrics.request_timing)
+        attempt = metrics.propagate(_attempt)
+        attempts[executor.submit(attempt, health, network, backend, resolve_with, deadline)] = backend
+        return True
+
+    if not start_next('first'):
+        raise BackendUnavailableException()
+    while attempts:
+        done, _ = wait(attempts, timeout=_wait_time(driver_config, remaining, deadline), return_when=FIRST_COMPLETED)
+        if not done:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise ResolutionTimeoutException()
+            start_next('hedge')
+            continue
+
+        for attempt in done:
+            backend = attempts.pop(attempt)
+            try:
+                return attempt.result()
+            except IdentityNotFoundException as e:
+                outcome.not_found = e
+            except Exception as e:
+                outcome.fail(backend, e)
+                if remaining:
+                    start_next('failover')
+    return outcome.result()
+
+
+async def resolve_async(driver_config: DriverConfig, network: str, backends: list, resolve_with,
+                        health: BackendHealthRegistry = None):
+    """Resolve with the coroutine function resolve_with(backend, deadline), across the given backends (see resolve).
+    Attempts that lose the race, or outlive the deadline, are cancelled."""
+    backends = _route(network, backends, health)
+    deadline = None if driver_config.resolve_timeout <= 0 else time.monotonic() + driver_config.resolve_timeout
+    if len(backends) == 1 and deadline is None:
+        if not _allow(health, network, backends[0]):
+            raise BackendUnavailableException()
+        metrics.BACKEND_ATTEMPTS.inc(backends[0], 'first')
+        return await _attempt_async(health, network, backends[0], resolve_with, deadline)
+
+    remaining = list(backends)
+    attempts = {}
+    outcome = _Outcome()
+
+    def start_next(reason):
+        backend = _next_allowed(health, network, remaining)
+        if backend is None:
+            return False
+        metrics.BACKEND_ATTEMPTS.inc(backend, reason)
+        attempts[asyncio.ensure_future(_attempt_async(health, network, backend, resolve_with, deadline))] = backend
+        return True
+
+    if not start_next('first'):
+        raise BackendUnavailableException()
+    try:
+        while attempts:
+            done, _ = await asyncio.wait(attempts, timeout=_wait_time(driver_config, remaining, deadline),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                if deadline is not None and time.monotonic() >= deadline:
+                    if health is not None:
+                        for backend in attempts.values():
+                            health.get(backend, network).record(driver_config.resolve_timeout, True)
+                    raise ResolutionTimeoutException()
+                start_next('hedge')
+                continue
+
+            for attempt in done:
+                backend = attempts.pop(attempt)
+                try:
+                    return attempt.result()
+                except IdentityNotFoundException as e:
+                    outcome.not_found = e
+                except Exception as e:
+                    outcome.fail(backend, e)
+                    if remaining:
+                        start_next('failover')
+        return outcome.result()
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+
+
+def remaining_time():
+    """Seconds left before the deadline of the resolution in progress, or None if it has no deadline. Raises
+    ResolutionTimeoutException if the deadline has passed."""
+    scope = metrics.current_scope()
+    if scope is None or scope.deadline is None:
+        return None
+    remaining = scope.deadline - time.monotonic()
+    if remaining <= 0:
+        raise ResolutionTimeoutException()
+    return remaining
+
+
+def cap_timeout(timeout):
+    """Cap the timeout of a backend call, given in seconds or as a (connect, read) tuple, to the time left before the
+    deadline of the resolution in progress"""
+    remaining = remaining_time()
+    if remaining is None:
+        return timeout
+    if timeout is None:
+        return remaining, remaining
+    if isinstance(timeout, tuple):
+        return tuple(min(t, remaining) for t in timeout)
+    return min(timeout, remaining)
+
+
+def _route(network: str, backends: list, health: BackendHealthRegistry = None):
+    if health is None:
+        return list(backends)
+    routed = health.route(network, backends)
+    if not routed:
+        raise BackendUnavailableException()
+    return routed
+
+
+def _allow(health, network: str, backend: str):
+    return health is None or health.get(backend, network).allow()
+
+
+def _next_allowed(health, network: str, remaining: list):
+    """Pop the next backend that a resolution can be started with. A backend routed while due for a trial is skipped
+    if another resolution has claimed the trial since."""
+    while remaining:
+        backend = remaining.pop(0)
+        if _allow(health, network, backend):
+            return backend
+    return None
+
+
+def _wait_time(driver_config: DriverConfig, remaining: list, deadline):
+    """How long to wait for the attempts in flight before hedging, or before giving up"""
+    wait_times = []
+    if remaining and driver_config.hedge_delay > 0:
+        wait_times.append(driver_config.hedge_delay)
+    if deadline is not None:
+        wait_times.append(max(deadline - time.monotonic(), 0))
+    return min(wait_times) if wait_times else None
+
+
+def _attempt(health, network: str, backend: str, resolve_with, deadline):
+    start = time.monotonic()
+    try:
+        identity = resolve_with(backend, deadline)
+    except IdentityNotFoundException:
+        _record(health, network, backend, start, failed=False)
+        raise
+    except Exception:
+        _record(health, network, backend, start, failed=True)
+        raise
+    _record(health, network, backend, start, failed=False)
+    return identity
+
+
+async def _attempt_async(health, network: str, backend: str, resolve_with, deadline):
+    start = time.monotonic()
+    try:
+        identity = await resolve_with(backend, deadline)
+    except IdentityNotFoundException:
+        _record(health, network, backend, start, failed=False)
+        raise
+    except asyncio.CancelledError:
+        raise  # Lost the race, or outlived the deadline (which is recorded then)
+    except Exception:
+        _record(health, network, backend, start, failed=True)
+        raise
+    _record(health, network, backend, start, failed=False)
+    return identity
+
+
+def _record(health, network: str, backend: str, start: float, failed: bool):
+    if health is not None:
+        health.get(backend, network).record(time.monotonic() - start, failed)
+
+
+class _Outcome:
+    """How a resolution went, once no backend found the identity"""
+
+    def __init__(self):
+        self.not_found = None
+        self.error = None
+
+    def fail(self, backend: str, error: Exception):
+        logger.warning('Failed to resolve with %s: %r', backend, error)
+        self.error = error
+
+    def result(self):
+        if self.not_found is not None:
+            raise self.not_found
+        raise self.error or IdentityNotFoundException()
+
+
+def _get_executor(driver_config: DriverConfig):
+    # Built once per worker process, as threads don't survive gunicorn's fork
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=driver_config.backend_workers)
+            _executor_pid = os.getpid()
+        return _executor
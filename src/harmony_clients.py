@@ -0,0 +1,49 @@
+import harmony_connect_client as api
+from . import failover
+from . import metrics
+from .clients import PooledSession
+from .config import DriverConfig
+from factom_sdk.request_handler.request_handler import RequestHandler
+from factom_sdk.utils.common_util import CommonUtil
+from urllib.parse import urljoin
+
+
+# Clients of Harmony Connect, only imported (along with the Harmony Connect client and the Factom SDK) by workers that
+# resolve with Harmony (see clients.get_harmony_entries_api and clients.get_harmony_sdk)
+
+class MeasuredApiClient(api.ApiClient):
+    """A Harmony Connect API client whose requests are measured as calls to Harmony, and whose timeouts are capped to
+    the deadline of the resolution in progress"""
+
+    def request(self, *args, **kwargs):
+        kwargs['_request_timeout'] = failover.cap_timeout(kwargs.get('_request_timeout'))
+        with metrics.backend_call(DriverConfig.HARMONY):
+            return super().request(*args, **kwargs)
+
+    def deserialize(self, response, response_type):
+        with metrics.timed('decode'):
+            return super().deserialize(response, response_type)
+
+
+class PooledRequestHandler(RequestHandler):
+    """A Factom SDK request handler that sends its requests through a PooledSession, rather than opening a new
+    connection for every request"""
+
+    def __init__(self, session: PooledSession, base_url: str, app_id: str, app_key: str):
+        super().__init__(base_url, app_id, app_key)
+        self.session = session
+
+    def _generic_request(self, method, endpoint, **kwargs):
+        headers = {
+            'app_id': kwargs.get('app_id') or self.app_id,
+            'app_key': kwargs.get('app_key') or self.app_key
+        }
+        base_url = kwargs.get('base_url') or self.base_url
+        if not base_url.endswith('/'):
+            base_url += '/'
+
+        response = self.session.request(method, urljoin(base_url, endpoint), params=kwargs.get('params'),
+                                        json=kwargs.get('data'), headers=headers)
+        response.raise_for_status()
+        with metrics.timed('decode'):
+            return CommonUtil.decode_response(response.json())
@@ -1,131 +1,192 @@
 import base64
-import harmony_connect_client as api
+from . import clients
 from . import consts
+from . import metrics
 from . import models
+from .chain_state import ChainCursor, ChainStateStore
 from .config import DriverConfig
-from factom_sdk import FactomClient
+from concurrent.futures import ThreadPoolExecutor
 from harmony_connect_client.rest import ApiException
-from identitykeys import PublicIdentityKey
 from requests import HTTPError
 
 
 IDENTITY_CHAIN_TAG_BASE64 = base64.b64encode(consts.IDENTITY_CHAIN_TAG).decode()
 KEY_REPLACEMENT_TAG_BASE64 = base64.b64encode(consts.KEY_REPLACEMENT_TAG).decode()
+PAGE_SIZE = 25
 
 
-def get_identity(driver_config: DriverConfig, did: str, chain_id: str):
+def get_identity(driver_config: DriverConfig, did: str, chain_id: str, testnet=False,
+                 state_store: ChainStateStore = None):
+    # Harmony Connect only serves mainnet (see failover.get_backends)
     if driver_config.harmony_caching_enabled:
         return _get_identity_with_cache(driver_config, did, chain_id)
 
-    return _get_identity_without_cache(driver_config, did, chain_id)
+    return _get_identity_without_cache(driver_config, did, chain_id, state_store)
 
 
 def _get_identity_with_cache(driver_config: DriverConfig, did: str, chain_id: str):
     """Fetch a cached copy of the identity's current state from Harmony.
     Useful for identities with an absurd number of key replacements, or for a chain with a lot of spam."""
-    factom_sdk = FactomClient(driver_config.harmony_url, driver_config.harmony_app_id, driver_config.harmony_app_key)
-    try:
-        identity = factom_sdk.identities.get(chain_id)
-    except HTTPError as e:
-        raise models.IdentityNotFoundException() if e.response.status_code == 404 else e
+    factom_sdk = clients.get_harmony_sdk(driver_config)
+    page_size = driver_config.harmony_key_page_size
+
+    # The identity and the first page of its keys are requested together. The first page gives the number of keys,
+    # so all of the remaining pages can then be requested at once.
+    get_identity_response = metrics.propagate(factom_sdk.identities.get)
+    list_keys = metrics.propagate(factom_sdk.identities.keys.list)
+    with ThreadPoolExecutor(max_workers=driver_config.harmony_fetch_concurrency) as executor:
+        identity_future = executor.submit(get_identity_response, chain_id)
+        first_page = executor.submit(list_keys, chain_id, limit=page_size, offset=0)
+        try:
+            identity_response = identity_future.result()
+        except HTTPError as e:
+            raise models.IdentityNotFoundException() if e.response.status_code == 404 else e
+
+        keys_response = first_page.result()
+        pages = [
+            executor.submit(list_keys, chain_id, limit=page_size, offset=offset)
+            for offset in range(page_size, keys_response.get('count'), page_size)
+        ]
+        keys = list(keys_response.get('data'))
+        for page in pages:
+            keys.extend(page.result().get('data'))
+
+    identity = identity_from_cache(did, chain_id, identity_response.get('data'))
+    add_cached_keys(identity, keys)
+    return identity
 
-    identity_response = identity.get('data')
+
+def identity_from_cache(did: str, chain_id: str, identity_response: dict):
+    """Create the identity from Harmony's cached copy of its current state, without its key history"""
     identity = models.Identity(did, chain_id)
     identity.version = identity_response.get('version')
     identity.name = identity_response.get('names')
     identity.created_height = identity_response.get('created_height')
     identity.stage = identity_response.get('stage')
     identity.active_keys = {
-        k.get('key'):
-        {
-            'id': '{}#key-{}'.format(did, k.get('priority')),
-            'controller': did,
-            'type': consts.PUBLIC_KEY_TYPE,
-            'publicKeyHex': PublicIdentityKey(key_string=k.get('key')).to_bytes().hex(),
-            'activatedHeight': k.get('activated_height'),
-            'retiredHeight': None,
-            'priority': k.get('priority'),
-            'entryHash': k.get('entry_hash')
-        }
-        for k in identity_response.get('active_keys')
+        k.get('key'): _cached_key_object(k, retired_height=None) for k in identity_response.get('active_keys')
     }
+    _set_last_entry_hash(identity, identity.active_keys.values())
+    return identity
 
-    limit = 25
-    page = 1
-    offset = 0
-    while True:
-        keys_response = factom_sdk.identities.keys.list(chain_id, limit=limit, offset=offset)
-        for k in keys_response.get('data'):
-            if k.get('activated_height') is None:
-                continue
-            identity.all_keys[k.get('key')] = {
-                'id': '{}#key-{}'.format(did, k.get('priority')),
-                'controller': did,
-                'type': consts.PUBLIC_KEY_TYPE,
-                'publicKeyHex': PublicIdentityKey(key_string=k.get('key')).to_bytes().hex(),
-                'activatedHeight': k.get('activated_height'),
-                'retiredHeight': k.get('retired_height'),
-                'priority': k.get('priority'),
-                'entryHash': k.get('entry_hash')
-            }
-
-        if keys_response.get('count') <= page * limit:
-            break
-        offset += limit
-        page += 1
 
-    return identity
+def add_cached_keys(identity: models.Identity, keys: list):
+    """Add Harmony's cached keys to the identity's key history, in priority and activation order, skipping keys that
+    were never activated"""
+    keys = [k for k in keys if k.get('activated_height') is not None]
+    keys.sort(key=lambda k: (k.get('priority'), k.get('activated_height')))
+    for k in keys:
+        identity.all_keys[k.get('key')] = _cached_key_object(k, retired_height=k.get('retired_height'))
+    _set_last_entry_hash(identity, identity.all_keys.values())
+
 
+def _set_last_entry_hash(identity: models.Identity, keys):
+    # Harmony's cached state doesn't say which entry was applied last, but it is the one that activated the newest key
+    keys = [k for k in keys if k.activated_height is not None]
+    if keys:
+        identity.last_entry_hash = max(keys, key=lambda k: k.activated_height).entry_hash
 
-def _get_identity_without_cache(driver_config: DriverConfig, did: str, chain_id: str):
-    """Parse the entire chain to build up the identity's current state"""
-    api_config = api.Configuration()
-    api_config.host = driver_config.harmony_url
-    api_config.api_key['app_id'] = driver_config.harmony_app_id
-    api_config.api_key['app_key'] = driver_config.harmony_app_key
-    entries_api = api.EntriesApi(api.ApiClient(api_config))
 
+def _cached_key_object(k: dict, retired_height):
+    return models.Key(k.get('key'), k.get('priority'), k.get('activated_height'), retired_height, k.get('entry_hash'))
+
+
+def _get_identity_without_cache(driver_config: DriverConfig, did: str, chain_id: str,
+                                state_store: ChainStateStore = None):
+    """Parse the chain to build up the identity's current state, resuming from the stored cursor if there is one"""
+    entries_api = clients.get_harmony_entries_api(driver_config)
+    timeout = driver_config.http_timeouts[DriverConfig.HARMONY]
+
+    # The first entry is always fetched, as its stage is the identity's stage
     try:
-        entry = entries_api.get_first_entry(chain_id).data
+        entry = entries_api.get_first_entry(chain_id, _request_timeout=timeout).data
     except ApiException as e:
-        raise models.IdentityNotFoundException() if e.status == 404 else e
+        raise models.ChainNotFoundException() if e.status == 404 else e
+
+    identity, cursor = (None, None) if state_store is None else state_store.get(consts.NETWORK_MAINNET, chain_id, did)
+    identity, cursor = start_identity(did, chain_id, entry, identity, cursor)
+    if cursor is None:
+        return identity
+
+    # At this point, we know there is a valid identity at the given chain ID
+    # Entries are fetched concurrently (and the next page listed while the current one is fetched), but are applied
+    # strictly in chain order
+    get_entries = metrics.propagate(entries_api.get_entries_by_chain_id)
+    get_entry = metrics.propagate(entries_api.get_entry_by_hash)
+    with ThreadPoolExecutor(max_workers=driver_config.harmony_fetch_concurrency) as executor:
+        page = executor.submit(get_entries, chain_id, limit=PAGE_SIZE, offset=cursor.offset,
+                               _request_timeout=timeout)
+        keep_parsing = True
+        while keep_parsing:
+            all_entries_response = page.result()
+
+            next_offset = cursor.offset + len(all_entries_response.data)
+            if all_entries_response.count <= next_offset or not all_entries_response.data:
+                keep_parsing = False
+            else:
+                page = executor.submit(get_entries, chain_id, limit=PAGE_SIZE,
+                                       offset=next_offset, _request_timeout=timeout)
+
+            entry_futures = [
+                executor.submit(get_entry, chain_id, entry_description.entry_hash,
+                                _request_timeout=timeout)
+                for entry_description in all_entries_response.data
+            ]
+            cursor, keep_reading = apply_entries(identity, cursor, (f.result().data for f in entry_futures))
+            keep_parsing = keep_parsing and keep_reading
+
+            if not keep_parsing:
+                page.cancel()
+                for entry_future in entry_futures:
+                    entry_future.cancel()
+
+    if state_store is not None:
+        state_store.put(consts.NETWORK_MAINNET, chain_id, identity, cursor)
+    return identity
 
+
+def start_identity(did: str, chain_id: str, entry, identity: models.Identity = None, cursor: ChainCursor = None):
+    """Check the chain's first entry, then either update the stored identity's stage from it or create the identity
+    from it. Returns the identity and the cursor to resume parsing from, which is None if the first entry is still
+    replicated (i.e. the identity is pending)."""
     if len(entry.external_ids) <= 1 or entry.external_ids[0] != IDENTITY_CHAIN_TAG_BASE64:
-        raise models.IdentityNotFoundException()
+        raise models.NotAnIdentityException()
+
+    if identity is not None and entry.stage != 'replicated':
+        identity.stage = entry.stage
+        return identity, cursor
 
-    content = base64.b64decode(entry.content)
-    external_ids = [base64.b64decode(x.encode()) for x in entry.external_ids]
+    with metrics.timed('decode'):
+        content = base64.b64decode(entry.content)
+        external_ids = [base64.b64decode(x.encode()) for x in entry.external_ids]
     identity = models.Identity(did, chain_id)
     if entry.stage == 'replicated':
         identity.process_creation(entry.entry_hash, external_ids, content)
-        return identity
+        return identity, None
 
     identity.process_creation(entry.entry_hash, external_ids, content, stage=entry.stage, height=entry.dblock.height)
+    return identity, ChainCursor(entry.entry_hash, entry.dblock.height, 1, None)
 
-    # At this point, we know there is a valid identity at the given chain ID
-    limit = 25
-    page = 1
-    offset = 0
-    keep_parsing = True
-    while keep_parsing:
-        all_entries_response = entries_api.get_entries_by_chain_id(chain_id, limit=limit, offset=offset)
 
-        if all_entries_response.count <= page * limit:
+def apply_entries(identity: models.Identity, cursor: ChainCursor, entries):
+    """Apply entries (in chain order) to the identity, stopping at the first replicated entry. Returns the cursor after
+    the last entry applied, and whether parsing should go on."""
+    key_replacements = []
+    keep_parsing = True
+    entry_count = 0
+    for entry in entries:
+        entry_count += 1
+        if entry.stage == 'replicated':
             keep_parsing = False
+            break
 
-        for entry_description in all_entries_response.data:
-            entry = entries_api.get_entry_by_hash(chain_id, entry_description.entry_hash).data
-            if entry.stage == 'replicated':
-                keep_parsing = False
-                break
-
-            if len(entry.external_ids) != 5 or entry.external_ids[0] != KEY_REPLACEMENT_TAG_BASE64:
-                continue
+        cursor = ChainCursor(entry.entry_hash, entry.dblock.height, cursor.offset + 1, None)
+        if len(entry.external_ids) != 5 or entry.external_ids[0] != KEY_REPLACEMENT_TAG_BASE64:
+            continue
 
+        with metrics.timed('decode'):
             external_ids = [base64.b64decode(x.encode()) for x in entry.external_ids]
-            identity.process_key_replacement(entry.entry_hash, external_ids, entry.dblock.height)
-
-        offset += limit
-        page += 1
-
-    return identity
+        key_replacements.append((entry.entry_hash, external_ids, entry.dblock.height))
+    metrics.count_entries(DriverConfig.HARMONY, entry_count)
+    identity.process_key_replacements(key_replacements)
+    return cursor, keep_parsing
@@ -0,0 +1,128 @@
+import threading
+import time
+from .config import DriverConfig
+from collections import deque
+
+
+# Weight of the latest resolution in a backend's rolling latency
+LATENCY_ALPHA = 0.2
+
+
+class BackendHealth:
+    """Rolling latency and error rate of the resolutions made with a backend on a network, with a circuit breaker.
+    The circuit opens once the error rate over the last `window` resolutions reaches `error_threshold`. While it is
+    open, a single trial resolution is let through every `open_duration` seconds, and the circuit closes again as soon
+    as one succeeds."""
+
+    def __init__(self, window=20, error_threshold=0.5, open_duration=30.0, clock=time.monotonic):
+        self.error_threshold = error_threshold
+        self.open_duration = open_duration
+        self.min_resolutions = max(window // 2, 1)
+        self.clock = clock
+        self.latency = None
+        self.opened_at = None
+        self._failures = deque(maxlen=max(window, 1))
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, failed: bool):
+        with self._lock:
+            self._failures.append(failed)
+            if not failed and self.latency is None:
+                self.latency = latency
+            elif not failed:
+                self.latency += LATENCY_ALPHA * (latency - self.latency)
+            if self.opened_at is not None:
+                if not failed:
+                    # A trial succeeded
+                    self.opened_at = None
+                    self._failures.clear()
+            elif self.error_threshold > 0 and len(self._failures) >= self.min_resolutions \
+                    and self._error_rate() >= self.error_threshold:
+                self.opened_at = self.clock()
+
+    def allow(self):
+        """Whether a resolution can be made with the backend. Claims the trial if the circuit is due for one, so call it
+        only when the resolution is about to be made."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.clock() - self.opened_at >= self.open_duration:
+                self.opened_at = self.clock()
+                return True
+            return False
+
+    def available(self):
+        """Whether the circuit is closed, or due for a trial (without claiming the trial)"""
+        with self._lock:
+            return self.opened_at is None or self.clock() - self.opened_at >= self.open_duration
+
+    def trial_due(self):
+        with self._lock:
+            return self.opened_at is not None and self.clock() - self.opened_at >= self.open_duration
+
+    def is_open(self):
+        return self.opened_at is not None
+
+    def error_rate(self):
+        with self._lock:
+            return self._error_rate()
+
+    def score(self, error_penalty: float):
+        """Expected cost of a resolution, in seconds: the rolling latency, plus error_penalty for each expected error"""
+        return (self.latency or 0.0) + self.error_rate() * error_penalty
+
+    def _error_rate(self):
+        return sum(self._failures) / len(self._failures) if self._failures else 0.0
+
+
+class BackendHealthRegistry:
+    """Health of every backend, per network, used to route resolutions to the healthiest backends"""
+
+    def __init__(self, driver_config: DriverConfig):
+        self.driver_config = driver_config
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def get(self, backend: str, network: str):
+        with self._lock:
+            health = self._health.get((backend, network))
+            if health is None:
+                health = BackendHealth(window=self.driver_config.circuit_breaker_window,
+                                       error_threshold=self.driver_config.circuit_breaker_error_threshold,
+                                       open_duration=self.driver_config.circuit_breaker_open_duration)
+                self._health[(backend, network)] = health
+            return health
+
+    def route(self, network: str, backends: list):
+        """Order the backends from healthiest to least healthy, leaving out those whose circuit is open. A backend due
+        for a trial comes first, so that the trial is made even while the other backends are healthy (its trial is only
+        claimed when the resolution is started with it, see BackendHealth.allow). Backends with the same score keep
+        their configured order."""
+        available = [backend for backend in backends if self.get(backend, network).available()]
+        penalty = self.driver_config.resolve_timeout or sum(self.driver_config.http_timeout)
+        return sorted(available, key=lambda backend: (not self.get(backend, network).trial_due(),
+                                                      self.get(backend, network).score(penalty)))
+
+    def stats(self):
+        with self._lock:
+            items = sorted(self._health.items())
+        return [{
+            'backend': backend,
+            'network': network.rstrip(':'),
+            'latency': health.latency,
+            'errorRate': health.error_rate(),
+            'circuitOpen': health.is_open()
+        } for (backend, network), health in items]
+
+    def collect(self):
+        """Gauges for the metrics endpoint (see metrics.Registry.set_collector)"""
+        stats = self.stats()
+        labels = ('backend', 'network')
+        return [
+            ('did_factom_backend_latency_seconds', 'gauge', 'Rolling latency of the resolutions made with each backend',
+             [((s['backend'], s['network']), s['latency'] or 0) for s in stats], labels),
+            ('did_factom_backend_error_rate', 'gauge', 'Error rate of the latest resolutions made with each backend',
+             [((s['backend'], s['network']), s['errorRate']) for s in stats], labels),
+            ('did_factom_backend_circuit_open', 'gauge', 'Whether the circuit breaker of each backend is open',
+             [((s['backend'], s['network']), int(s['circuitOpen'])) for s in stats], labels),
+        ]
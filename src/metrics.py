@@ -0,0 +1,414 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import contextvars
+except ImportError:  # Python < 3.7
+    contextvars = None
+
+
+# A minimal, dependency-free metrics registry that renders the Prometheus text exposition format. Metrics are kept per
+# worker process.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+logger = logging.getLogger(__name__)
+
+
+class Counter:
+
+    def __init__(self, name: str, documentation: str, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def collect(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} counter'.format(self.name)]
+        with self._lock:
+            values = sorted(self._values.items(), key=_sort_key)
+        for label_values, value in values:
+            lines.append('{}{} {}'.format(self.name, _labels(self.label_names, label_values), value))
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, documentation: str, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                # Cumulative bucket counts, then the sum and the count of all observations
+                series = self._values[label_values] = [0] * len(self.buckets) + [0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def get_count(self, *label_values):
+        series = self._values.get(label_values)
+        return 0 if series is None else series[-1]
+
+    def collect(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            values = [(label_values, list(series)) for label_values, series in self._values.items()]
+        values.sort(key=_sort_key)
+        for label_values, series in values:
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-2] + series[-1:]):
+                labels = _labels(self.label_names + ('le',), label_values + (bound,))
+                lines.append('{}_bucket{} {}'.format(self.name, labels, count))
+            labels = _labels(self.label_names, label_values)
+            lines.append('{}_sum{} {}'.format(self.name, labels, series[-2]))
+            lines.append('{}_count{} {}'.format(self.name, labels, series[-1]))
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = OrderedDict()
+
+    def counter(self, name: str, documentation: str, label_names=()):
+        metric = Counter(name, documentation, label_names)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, label_names=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, label_names, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def set_collector(self, name: str, collect):
+        """Set a function that returns metrics read at the time of each scrape, as (name, type, documentation,
+        [(label values, value)], label names) tuples. Setting a collector again under the same name replaces it."""
+        self.collectors[name] = collect
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        for collect in list(self.collectors.values()):
+            for name, metric_type, documentation, samples, label_names in collect():
+                lines.append('# HELP {} {}'.format(name, documentation))
+                lines.append('# TYPE {} {}'.format(name, metric_type))
+                for label_values, value in samples:
+                    lines.append('{}{} {}'.format(name, _labels(label_names, label_values), value))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'did_factom_http_requests_total', 'HTTP requests handled by the driver, by route and status code',
+    ('route', 'status'))
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    'did_factom_http_request_duration_seconds', 'Time taken to handle HTTP requests, by route', ('route',))
+BATCH_ITEMS = REGISTRY.counter(
+    'did_factom_batch_items_total', 'DIDs resolved in batch requests, by status code', ('status',))
+BACKEND_CALLS = REGISTRY.counter(
+    'did_factom_backend_calls_total', 'HTTP calls made to the backends, by backend and outcome', ('backend', 'outcome'))
+BACKEND_CALL_DURATION = REGISTRY.histogram(
+    'did_factom_backend_call_duration_seconds', 'Time taken by HTTP calls to the backends', ('backend',))
+BACKEND_ATTEMPTS = REGISTRY.counter(
+    'did_factom_backend_attempts_total', 'Resolutions started with each backend, by reason: first, hedge or failover',
+    ('backend', 'reason'))
+RESOLVE_DURATION = REGISTRY.histogram(
+    'did_factom_resolve_duration_seconds', 'Time taken to resolve identities from a backend, by outcome',
+    ('backend', 'outcome'))
+RESOLVE_BACKEND_CALLS = REGISTRY.histogram(
+    'did_factom_resolve_backend_calls', 'Number of backend HTTP calls made per identity resolution', ('backend',),
+    buckets=COUNT_BUCKETS)
+ENTRIES_SCANNED = REGISTRY.counter(
+    'did_factom_entries_scanned_total', 'Identity chain entries read from the backends', ('backend',))
+SIGNATURE_CHECKS = REGISTRY.counter(
+    'did_factom_signature_checks_total', 'Key replacement signatures checked while processing identity chains')
+SIGNATURES_VERIFIED = REGISTRY.counter(
+    'did_factom_signatures_verified_total', 'Ed25519 signature verifications actually computed (i.e. not memoized)')
+
+
+class ResolveScope:
+    """The work done by a single identity resolution, and the time (on the monotonic clock) by which it must be done"""
+
+    def __init__(self, backend: str, chain_id: str, deadline=None):
+        self.backend = backend
+        self.chain_id = chain_id
+        self.deadline = deadline
+        self.backend_calls = 0
+        self.entries_scanned = 0
+        self._lock = threading.Lock()
+
+    def add(self, backend_calls=0, entries_scanned=0):
+        with self._lock:
+            self.backend_calls += backend_calls
+            self.entries_scanned += entries_scanned
+
+
+class RequestTiming:
+    """Time spent in each phase of an HTTP request, reported in its Server-Timing header: calls to each backend,
+    decoding of their responses, signature verification and serialization of the response. Phases that run
+    concurrently (e.g. hedged or parallel backend calls) are summed, so their total may exceed the request's."""
+
+    def __init__(self, profile=None):
+        self.start = time.perf_counter()
+        self.profile = profile
+        self._phases = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, duration: float):
+        with self._lock:
+            total, count = self._phases.get(phase, (0, 0))
+            self._phases[phase] = (total + duration, count + 1)
+
+    def get(self, phase: str):
+        return self._phases.get(phase, (0, 0))
+
+    def header(self):
+        with self._lock:
+            phases = list(self._phases.items())
+        parts = ['{};dur={:.1f};desc="{} calls"'.format(phase, total * 1000, count) if count > 1
+                 else '{};dur={:.1f}'.format(phase, total * 1000)
+                 for phase, (total, count) in phases]
+        parts.append('total;dur={:.1f}'.format((time.perf_counter() - self.start) * 1000))
+        return ', '.join(parts)
+
+
+class _ContextSlot:
+    """A value set for the current context (i.e. thread, or asyncio task and the tasks it starts)"""
+
+    def __init__(self, name: str):
+        if contextvars is not None:
+            self._var = contextvars.ContextVar(name, default=None)
+        else:
+            self._local = threading.local()
+
+    def get(self):
+        if contextvars is not None:
+            return self._var.get()
+        return getattr(self._local, 'value', None)
+
+    def set(self, value):
+        if contextvars is not None:
+            return self._var.set(value)
+        previous = self.get()
+        self._local.value = value
+        return previous
+
+    def reset(self, token):
+        if contextvars is not None:
+            self._var.reset(token)
+        else:
+            self._local.value = token
+
+
+# The resolution in progress, so that backend calls can be attributed to it, and the timing of the request it is
+# made for. Worker threads started by a resolution must be given them explicitly (see propagate); asyncio tasks
+# inherit them.
+_scope_slot = _ContextSlot('did_factom_resolve_scope')
+_timing_slot = _ContextSlot('did_factom_request_timing')
+
+
+def current_scope():
+    return _scope_slot.get()
+
+
+def _set_scope(scope):
+    return _scope_slot.set(scope)
+
+
+def _reset_scope(token):
+    _scope_slot.reset(token)
+
+
+def current_timing():
+    return _timing_slot.get()
+
+
+class request_timing:
+    """Context manager that times the phases of an HTTP request (see RequestTiming)"""
+
+    def __init__(self, profile=None):
+        self.timing = RequestTiming(profile)
+
+    def __enter__(self):
+        self.token = _timing_slot.set(self.timing)
+        return self.timing
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _timing_slot.reset(self.token)
+        return False
+
+
+class timed:
+    """Context manager that adds the time spent in its block to a phase of the current request's timing, if any"""
+
+    def __init__(self, phase: str):
+        self.phase = phase
+
+    def __enter__(self):
+        self.timing = current_timing()
+        if self.timing is not None:
+            self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.timing is not None:
+            self.timing.add(self.phase, time.perf_counter() - self.start)
+        return False
+
+
+class resolve_scope:
+    """Context manager that measures an identity resolution. Resolutions slower than slow_threshold seconds are
+    logged along with their chain ID and the work they took."""
+
+    def __init__(self, backend: str, chain_id: str, slow_threshold=None, deadline=None):
+        self.scope = ResolveScope(backend, chain_id, deadline)
+        self.slow_threshold = slow_threshold
+
+    def __enter__(self):
+        self.token = _set_scope(self.scope)
+        self.start = time.perf_counter()
+        return self.scope
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start
+        _reset_scope(self.token)
+        if exc_type is None:
+            outcome = 'found'
+        elif _is_not_found(exc_type):
+            outcome = 'not_found'
+        elif exc_type.__name__ == 'CancelledError':
+            outcome = 'cancelled'  # Lost a race with a hedged resolution
+        else:
+            outcome = 'error'
+        RESOLVE_DURATION.observe(duration, self.scope.backend, outcome)
+        RESOLVE_BACKEND_CALLS.observe(self.scope.backend_calls, self.scope.backend)
+        if self.slow_threshold is not None and duration >= self.slow_threshold:
+            logger.warning('Slow resolution of chain %s from %s: %.3fs, %d backend calls, %d entries scanned (%s)',
+                           self.scope.chain_id, self.scope.backend, duration, self.scope.backend_calls,
+                           self.scope.entries_scanned, outcome)
+        return False
+
+
+class backend_call:
+    """Context manager that measures an HTTP call to a backend"""
+
+    def __init__(self, backend: str):
+        self.backend = backend
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        scope = current_scope()
+        if scope is not None:
+            scope.add(backend_calls=1)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start
+        BACKEND_CALL_DURATION.observe(duration, self.backend)
+        timing = current_timing()
+        if timing is not None:
+            timing.add('backend-{}'.format(self.backend), duration)
+        # A chain that is not found is a successful call, as far as the backend is concerned
+        failed = exc_type is not None and not _is_not_found(exc_type)
+        BACKEND_CALLS.inc(self.backend, 'error' if failed else 'ok')
+        return False
+
+
+def count_entries(backend: str, count: int):
+    """Count entries read from a backend, for the resolution in progress"""
+    if count:
+        ENTRIES_SCANNED.inc(backend, amount=count)
+        scope = current_scope()
+        if scope is not None:
+            scope.add(entries_scanned=count)
+
+
+def propagate(function):
+    """Wrap a function submitted to a worker thread, so that its work is attributed to the current resolution and
+    request (and profiled along with the request, if it is being profiled)"""
+    scope = current_scope()
+    timing = current_timing()
+
+    def wrapper(*args, **kwargs):
+        scope_token = _set_scope(scope)
+        timing_token = _timing_slot.set(timing)
+        try:
+            if timing is not None and timing.profile is not None:
+                return timing.profile.run(function, *args, **kwargs)
+            return function(*args, **kwargs)
+        finally:
+            _timing_slot.reset(timing_token)
+            _reset_scope(scope_token)
+
+    return wrapper
+
+
+def observe_request(route: str, status: int, duration: float):
+    HTTP_REQUESTS.inc(route, status)
+    HTTP_REQUEST_DURATION.observe(duration, route)
+
+
+def set_cache_collector(caches: dict, resolution_flights):
+    """Report the hits, misses and hit ratio of the given caches (by name), and how many resolutions were coalesced"""
+    def collect():
+        stats = [((name,), cache.stats()) for name, cache in sorted(caches.items())]
+        flights = resolution_flights.stats()
+        return [
+            ('did_factom_cache_hits_total', 'counter', 'Lookups served from each cache',
+             [(name, s['hits']) for name, s in stats], ('cache',)),
+            ('did_factom_cache_misses_total', 'counter', 'Lookups not served from each cache',
+             [(name, s['misses']) for name, s in stats], ('cache',)),
+            ('did_factom_cache_hit_ratio', 'gauge', 'Share of the lookups served from each cache, since startup',
+             [(name, s['hits'] / max(s['hits'] + s['misses'], 1)) for name, s in stats], ('cache',)),
+            ('did_factom_cache_size', 'gauge', 'Number of entries held in each cache',
+             [(name, s['size']) for name, s in stats], ('cache',)),
+            ('did_factom_resolutions_total', 'counter', 'Identity resolutions made from the backends',
+             [((), flights['calls'] - flights['coalesced'])], ()),
+            ('did_factom_resolutions_coalesced_total', 'counter',
+             'Resolutions that waited for a concurrent resolution of the same identity',
+             [((), flights['coalesced'])], ()),
+            ('did_factom_resolutions_in_flight', 'gauge', 'Identity resolutions in progress',
+             [((), flights['inFlight'])], ()),
+        ]
+
+    REGISTRY.set_collector('caches', collect)
+
+
+def _is_not_found(exc_type):
+    # Exceptions are matched by name, as models depends on this module
+    return any(cls.__name__ == 'IdentityNotFoundException' for cls in exc_type.__mro__)
+
+
+def _sort_key(item):
+    return tuple(str(value) for value in item[0])
+
+
+def _labels(names: tuple, values: tuple):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append('{}="{}"'.format(name, value))
+    return '{' + ','.join(pairs) + '}'
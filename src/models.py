@@ -1,6 +1,9 @@
+import hashlib
 import json
 from . import consts
-from collections import OrderedDict
+from . import metrics
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
 from identitykeys import is_valid_idpub, PublicIdentityKey
 
 
@@ -8,6 +11,61 @@ class IdentityNotFoundException(Exception):
     pass
 
 
+class ChainNotFoundException(IdentityNotFoundException):
+    """The chain doesn't exist (yet)"""
+    pass
+
+
+class NotAnIdentityException(IdentityNotFoundException):
+    """The chain exists, but its first entry isn't tagged as an identity chain. As a chain ID is the hash of the
+    external IDs of the chain's first entry, the chain can never become an identity."""
+    pass
+
+
+# The same keys (and, on spam-heavy chains, the very same key replacements) show up again and again across entries and
+# across requests, so parsing keys and verifying signatures is memoized in bounded caches
+@lru_cache(maxsize=4096)
+def is_valid_key(key: str):
+    return is_valid_idpub(key)
+
+
+@lru_cache(maxsize=4096)
+def get_public_key(key: str):
+    return PublicIdentityKey(key_string=key)
+
+
+@lru_cache(maxsize=4096)
+def get_public_key_hex(key: str):
+    return get_public_key(key).to_bytes().hex()
+
+
+@lru_cache(maxsize=8192)
+def verify_signature(signer_key: str, signature: bytes, message: bytes):
+    metrics.SIGNATURES_VERIFIED.inc()
+    return get_public_key(signer_key).verify(signature, message)
+
+
+class Key(namedtuple('Key', ['key', 'priority', 'activated_height', 'retired_height', 'entry_hash'])):
+    """A compact, immutable record of one of an identity's keys. Fields that only depend on the DID are added when
+    the key is rendered, so the same records can be shared by copies of an identity bound to other DIDs."""
+    __slots__ = ()
+
+    def retire(self, height: int):
+        return self._replace(retired_height=height)
+
+    def to_json(self, did: str):
+        return {
+            'id': '{}#key-{}'.format(did, self.priority),
+            'controller': did,
+            'type': consts.PUBLIC_KEY_TYPE,
+            'publicKeyHex': get_public_key_hex(self.key),
+            'activatedHeight': self.activated_height,
+            'retiredHeight': self.retired_height,
+            'priority': self.priority,
+            'entryHash': self.entry_hash
+        }
+
+
 class Identity:
 
     def __init__(self, did, chain_id):
@@ -19,6 +77,9 @@ class Identity:
         self.name = None
         self.created_height = None
         self.stage = None
+        self.last_entry_hash = None
+        self.version_height = None
+        self._serialized = (None, None)
 
     def process_creation(self, entry_hash: str, external_ids: list, content: bytes, stage='pending', height=None):
         if stage == 'pending':
@@ -34,10 +95,11 @@ class Identity:
         # - Content is a proper JSON object with 'version' and 'keys' elements
         # - All elements of the 'keys' array are valid public keys (idpub format)
         if external_ids[0] != consts.IDENTITY_CHAIN_TAG:
-            raise IdentityNotFoundException()
+            raise NotAnIdentityException()
 
         try:
-            content_json = json.loads(content.decode())
+            with metrics.timed('decode'):
+                content_json = json.loads(content.decode())
         except json.JSONDecodeError:
             raise IdentityNotFoundException()
 
@@ -46,20 +108,11 @@ class Identity:
                 raise IdentityNotFoundException()
 
             for i, key in enumerate(content_json['keys']):
-                if not is_valid_idpub(key):
+                if not is_valid_key(key):
                     raise IdentityNotFoundException()
                 elif key in self.active_keys:
                     continue
-                key_object = {
-                    'id': '{}#key-{}'.format(self.did, i),
-                    'controller': self.did,
-                    'type': consts.PUBLIC_KEY_TYPE,
-                    'publicKeyHex': PublicIdentityKey(key_string=key).to_bytes().hex(),
-                    'activatedHeight': height,
-                    'retiredHeight': None,
-                    'priority': i,
-                    'entryHash': entry_hash
-                }
+                key_object = Key(key, i, height, None, entry_hash)
                 self.active_keys[key] = key_object
                 self.all_keys[key] = key_object
         else:
@@ -69,20 +122,37 @@ class Identity:
         self.name = [x.decode() for x in external_ids[1:]]
         self.created_height = height
         self.stage = stage
+        self.last_entry_hash = entry_hash
 
     def process_key_replacement(self, entry_hash: str, external_ids: list, height: int):
         if len(external_ids) != 5 or external_ids[0] != consts.KEY_REPLACEMENT_TAG:
             return
 
-        old_key = external_ids[1].decode()
-        new_key = external_ids[2].decode()
+        try:
+            old_key = external_ids[1].decode()
+            new_key = external_ids[2].decode()
+            signer_key = external_ids[4].decode()
+        except UnicodeDecodeError:
+            return False
         signature = external_ids[3]
-        signer_key = external_ids[4].decode()
 
         # all provided keys must be valid
-        if not is_valid_idpub(old_key) or not is_valid_idpub(new_key) or not is_valid_idpub(signer_key):
+        if not is_valid_key(old_key) or not is_valid_key(new_key) or not is_valid_key(signer_key):
             return False
 
+        return self._apply_key_replacement(entry_hash, old_key, new_key, signature, signer_key, height)
+
+    def process_key_replacements(self, entries: list):
+        """Convenience wrapper calling process_key_replacement on each (entry_hash, external_ids, height) tuple, in
+        chain order. Returns the number of replacements applied."""
+        applied = 0
+        for entry_hash, external_ids, height in entries:
+            if self.process_key_replacement(entry_hash, external_ids, height):
+                applied += 1
+        return applied
+
+    def _apply_key_replacement(self, entry_hash: str, old_key: str, new_key: str, signature: bytes, signer_key: str,
+                               height: int):
         # new_key must never have been active
         if new_key in self.all_keys:
             return False
@@ -92,50 +162,139 @@ class Identity:
             return False
 
         # signer_key must be the same (or higher) priority as old_key
-        old_priority = self.active_keys[old_key]['priority']
-        if old_priority < self.active_keys[signer_key]['priority']:
+        old_priority = self.active_keys[old_key].priority
+        if old_priority < self.active_keys[signer_key].priority:
             return False
 
         # Finally check the signature
         message = self.chain_id.encode() + old_key.encode() + new_key.encode()
-        k = PublicIdentityKey(key_string=signer_key)
-        if not k.verify(signature, message):
+        metrics.SIGNATURE_CHECKS.inc()
+        with metrics.timed('verify'):
+            valid = verify_signature(signer_key, signature, message)
+        if not valid:
             return False
 
         # Key replacement is valid and finalized
-        self.all_keys[old_key]['retiredHeight'] = height
-        new_key_object = {
-            'id': '{}#key-{}'.format(self.did, old_priority),
-            'controller': self.did,
-            'type': consts.PUBLIC_KEY_TYPE,
-            'publicKeyHex': PublicIdentityKey(key_string=new_key).to_bytes().hex(),
-            'activatedHeight': height,
-            'retiredHeight': None,
-            'priority': old_priority,
-            'entryHash': entry_hash
-        }
+        self.all_keys[old_key] = self.all_keys[old_key].retire(height)
+        new_key_object = Key(new_key, old_priority, height, None, entry_hash)
         del self.active_keys[old_key]
         self.active_keys[new_key] = new_key_object
         self.all_keys[new_key] = new_key_object
+        self.last_entry_hash = entry_hash
         return True
 
+    def copy(self, did=None):
+        """Return an independent copy of this identity, optionally bound to another DID for the same chain
+        (e.g. "did:factom:<chain_id>" and "did:factom:mainnet:<chain_id>")"""
+        did = self.did if did is None else did
+        identity = Identity(did, self.chain_id)
+        identity.version = self.version
+        identity.name = None if self.name is None else list(self.name)
+        identity.created_height = self.created_height
+        identity.stage = self.stage
+        identity.last_entry_hash = self.last_entry_hash
+        identity.version_height = self.version_height
+        # Key records are immutable, so they are shared rather than copied
+        identity.all_keys = OrderedDict(self.all_keys)
+        identity.active_keys = dict(self.active_keys)
+        if did == self.did:
+            identity._serialized = self._serialized
+        return identity
+
+    def to_state(self):
+        """Return the identity's state as a JSON-serializable dict, independent of the DID it is bound to"""
+        return {
+            'version': self.version,
+            'name': self.name,
+            'createdHeight': self.created_height,
+            'stage': self.stage,
+            'lastEntryHash': self.last_entry_hash,
+            'activeKeys': [list(k) for k in self.active_keys.values()],
+            'allKeys': [list(k) for k in self.all_keys.values()]
+        }
+
+    @classmethod
+    def from_state(cls, did: str, chain_id: str, state: dict):
+        """Create the identity (bound to the given DID) from a state returned by to_state"""
+        identity = cls(did, chain_id)
+        identity.version = state.get('version')
+        identity.name = state.get('name')
+        identity.created_height = state.get('createdHeight')
+        identity.stage = state.get('stage')
+        identity.last_entry_hash = state.get('lastEntryHash')
+        identity.active_keys = {k[0]: Key(*k) for k in state.get('activeKeys')}
+        identity.all_keys = OrderedDict((k[0], Key(*k)) for k in state.get('allKeys'))
+        return identity
+
+    def at_height(self, height: int):
+        """Return the state of the identity as of the given block height. Key records keep the heights at which each
+        key was activated and retired, so every height of the key history is a checkpoint: the keys active at a height
+        are those activated at or below it and not retired at or below it, in the order they were activated."""
+        if self.created_height is None or height < self.created_height:
+            raise IdentityNotFoundException()
+
+        identity = Identity(self.did, self.chain_id)
+        identity.version = self.version
+        identity.name = None if self.name is None else list(self.name)
+        identity.created_height = self.created_height
+        identity.stage = self.stage
+        identity.version_height = height
+        last_key = None
+        for key in self.all_keys.values():
+            if key.activated_height is None or key.activated_height > height:
+                continue
+            if key.retired_height is None or key.retired_height > height:
+                key = key._replace(retired_height=None)
+                identity.active_keys[key.key] = key
+            identity.all_keys[key.key] = key
+            if last_key is None or key.activated_height >= last_key.activated_height:
+                last_key = key
+        identity.last_entry_hash = None if last_key is None else last_key.entry_hash
+        return identity
+
     def get_did_document(self):
         key_count = len(self.active_keys)
         did_document = {
             '@context': consts.DID_CONTEXT,
             'id': self.did,
             'service': [],
-            'publicKey': list(self.active_keys.values()),
+            'publicKey': [k.to_json(self.did) for k in self.active_keys.values()],
             'authentication': ['{}#key-{}'.format(self.did, key_count - 1)]
         }
         return did_document
 
     def get_method_metadata(self):
-        return {
+        method_metadata = {
             'version': self.version,
             'name': self.name,
             'createdHeight': self.created_height,
             'stage': self.stage,
-            'publicKeyHistory': list(self.all_keys.values())
+            'publicKeyHistory': [k.to_json(self.did) for k in self.all_keys.values()]
         }
+        if self.version_height is not None:
+            method_metadata['versionHeight'] = self.version_height
+        return method_metadata
+
+    def get_etag(self):
+        """Return a strong ETag for the identity's resolution result. Once created, an identity only changes when an
+        entry gets applied to it or when its stage changes, and the result also depends on the DID it is bound to and
+        the height it is resolved at."""
+        state = '{}|{}|{}'.format(self.did, self.last_entry_hash, self.stage)
+        if self.version_height is not None:
+            state += '|{}'.format(self.version_height)
+        return '"{}"'.format(hashlib.sha256(state.encode()).hexdigest()[:32])
+
+    def get_resolution_result(self):
+        return {'didDocument': self.get_did_document(), 'methodMetadata': self.get_method_metadata()}
 
+    def serialize(self):
+        """Return the resolution result of the identity, serialized to JSON. It is serialized once per identity state,
+        and the same bytes are returned until the state changes."""
+        # Once an identity is created, every change to it either updates its stage or adds a key to its history
+        state = (self.did, self.stage, self.version, self.created_height, len(self.all_keys), len(self.active_keys),
+                 self.version_height)
+        rendered_state, serialized = self._serialized
+        if rendered_state != state:
+            serialized = json.dumps(self.get_resolution_result(), separators=(',', ':')).encode()
+            self._serialized = (state, serialized)
+        return serialized
@@ -0,0 +1,89 @@
+import cProfile
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class RequestProfiler:
+    """Profiles a sampled fraction of requests with cProfile, and writes the profile of each one to the given
+    directory (to be read with pstats, or a viewer such as snakeviz). At most one request is profiled at a time per
+    worker process."""
+
+    def __init__(self, sample_rate: float, directory: str, random=random.random):
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.random = random
+        self._lock = threading.Lock()
+
+    def sample(self):
+        """Return a RequestProfile to profile the current request with, or None if it isn't sampled"""
+        if self.sample_rate <= 0 or self.random() >= self.sample_rate:
+            return None
+        if not self._lock.acquire(blocking=False):
+            return None
+        return RequestProfile(self)
+
+    def _path(self, name: str):
+        return os.path.join(self.directory, '{}-{}-{}.prof'.format(
+            int(time.time() * 1000), os.getpid(), re.sub(r'[^0-9A-Za-z_.-]', '_', name)))
+
+
+class RequestProfile:
+    """The profiles of the threads that worked on a sampled request (see metrics.propagate)"""
+
+    def __init__(self, profiler: RequestProfiler):
+        self.profiler = profiler
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._finished = False
+
+    def run(self, function, *args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active in this thread (or process, for the Python versions that only allow one)
+            return function(*args, **kwargs)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self._lock:
+                if not self._finished:
+                    self._profiles.append(profile)
+
+    async def run_async(self, coroutine):
+        """Profile the event loop's thread while the coroutine runs. Other requests handled by the event loop in the
+        meantime are profiled too."""
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return await coroutine
+        try:
+            return await coroutine
+        finally:
+            profile.disable()
+            self._profiles.append(profile)
+
+    def finish(self, name: str):
+        """Write the request's profile (named after the given request name), and return its path"""
+        with self._lock:
+            self._finished = True
+        path = self.profiler._path(name)
+        try:
+            os.makedirs(self.profiler.directory, exist_ok=True)
+            pstats.Stats(*self._profiles).dump_stats(path)
+            return path
+        except OSError as e:
+            logger.warning('Failed to write the profile of %s: %r', name, e)
+            return None
+        finally:
+            self.profiler._lock.release()
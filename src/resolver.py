@@ -0,0 +1,180 @@
+import logging
+import re
+from . import backends
+from . import consts
+from . import failover
+from . import metrics
+from . import responses
+from . import warm_start
+from .cache import NegativeCache, ResolvedDocumentCache
+from .chain_state import ChainStateStore
+from .config import DriverConfig
+from .health import BackendHealthRegistry
+from .models import IdentityNotFoundException
+from .profiling import RequestProfiler
+from .shared_cache import SharedChainStateStore
+from .single_flight import SingleFlight
+
+
+# The resolver core shared by the Bottle app and the asyncio server: DID parsing, the caches, backend health and
+# profiler of a worker, and the mapping of resolution errors to response statuses. Resolver resolves with blocking
+# calls, and async_server.AsyncResolver with coroutines, on top of the same BaseResolver.
+
+DID_PATTERN = re.compile(r'^did:factom:((?:mainnet|testnet):)?([0-9A-Fa-f]{64})$')
+
+
+class InvalidDidException(ValueError):
+    pass
+
+
+# Status and detail of the responses to resolutions that fail with each exception, or else with a 500
+RESOLUTION_ERRORS = [
+    (InvalidDidException, 400, 'Invalid DID'),
+    (IdentityNotFoundException, 404, 'Not found'),
+    (failover.BackendUnavailableException, 503, 'Service unavailable'),  # The circuits of all the backends are open
+    (failover.ResolutionTimeoutException, 504, 'Gateway timeout')
+]
+
+logger = logging.getLogger(__name__)
+
+
+def parse_did(did: str):
+    """Return the chain ID of a Factom DID, and whether it is on testnet. Raises InvalidDidException if it isn't one."""
+    match = DID_PATTERN.match(did)
+    if match is None:
+        raise InvalidDidException('Invalid DID')
+    network, chain_id = match.groups()
+    return chain_id, network == consts.NETWORK_TESTNET
+
+
+def bind(identity, did: str):
+    """The identity bound to the given DID (a resolution shared by several DIDs of a chain is for one of them)"""
+    return identity if identity.did == did else identity.copy(did)
+
+
+def error_status(e: Exception):
+    """The status and detail of the response to a resolution that failed with the given exception"""
+    for exception_type, status, detail in RESOLUTION_ERRORS:
+        if isinstance(e, exception_type):
+            return status, detail
+    return 500, 'Internal server error'
+
+
+def batch_error(did: str, e: Exception):
+    """The result in a batch response of a resolution that failed with the given exception"""
+    status, detail = error_status(e)
+    if status == 500:
+        logger.error('Failed to resolve %s', did, exc_info=e)
+    return responses.batch_error(status, detail)
+
+
+class BaseResolver:
+    """The caches, backend health and profiler of a worker, and the given group to coalesce resolutions with"""
+
+    def __init__(self, driver_config: DriverConfig, resolution_flights):
+        self.driver_config = driver_config
+        self.shared_chain_state_store = None
+        if driver_config.shared_cache_path:
+            self.shared_chain_state_store = SharedChainStateStore(driver_config.shared_cache_path,
+                                                                  driver_config.shared_cache_size)
+        self.chain_state_store = ChainStateStore(driver_config.chain_state_cache_size,
+                                                 shared=self.shared_chain_state_store)
+        self.resolved_document_cache = ResolvedDocumentCache(
+            driver_config.resolved_document_cache_size,
+            pending_ttl=driver_config.resolved_document_cache_pending_ttl,
+            confirmed_ttl=driver_config.resolved_document_cache_confirmed_ttl)
+        self.negative_cache = NegativeCache(driver_config.negative_cache_size,
+                                            missing_ttl=driver_config.negative_cache_missing_chain_ttl,
+                                            not_identity_ttl=driver_config.negative_cache_not_identity_ttl,
+                                            bloom_capacity=driver_config.negative_cache_bloom_capacity,
+                                            bloom_error_rate=driver_config.negative_cache_bloom_error_rate)
+        self.resolution_flights = resolution_flights
+        self.backend_health = BackendHealthRegistry(driver_config)
+        self.profiler = RequestProfiler(driver_config.profile_sample_rate, driver_config.profile_directory)
+
+    def register_metrics(self):
+        """Report the caches and the backends' health on the metrics endpoint"""
+        caches = {'resolvedDocument': self.resolved_document_cache, 'negative': self.negative_cache,
+                  'chainState': self.chain_state_store}
+        if self.shared_chain_state_store is not None:
+            caches['sharedChainState'] = self.shared_chain_state_store
+        metrics.set_cache_collector(caches, self.resolution_flights)
+        metrics.REGISTRY.set_collector('backend_health', self.backend_health.collect)
+
+    def stats(self):
+        return {
+            'resolvedDocumentCache': self.resolved_document_cache.stats(),
+            'negativeCache': self.negative_cache.stats(),
+            'resolutions': self.resolution_flights.stats(),
+            'backends': self.backend_health.stats()
+        }
+
+    def start_snapshots(self):
+        """Load the resolution state snapshot, if any, and return the SnapshotWriter that saves it (started)"""
+        if not self.driver_config.snapshot_path:
+            return None
+        warm_start.load_snapshot(self.chain_state_store, self.driver_config.snapshot_path)
+        snapshot_writer = warm_start.SnapshotWriter(self.chain_state_store, self.driver_config.snapshot_path,
+                                                    self.driver_config.snapshot_interval)
+        snapshot_writer.start()
+        return snapshot_writer
+
+    def _cached(self, network: str, chain_id: str, did: str):
+        """The cached identity, or None if it has to be resolved. Raises IdentityNotFoundException if it is known not
+        to exist."""
+        identity = self.resolved_document_cache.get(network, chain_id, did)
+        if identity is None and self.negative_cache.get(network, chain_id):
+            raise IdentityNotFoundException()
+        return identity
+
+
+class Resolver(BaseResolver):
+    """Resolves DIDs with blocking backend calls"""
+
+    def __init__(self, driver_config: DriverConfig):
+        super().__init__(driver_config, SingleFlight())
+
+    def resolve_did(self, did: str):
+        chain_id, testnet = parse_did(did)
+        return self.resolve(did, chain_id, testnet)
+
+    def resolve_batch_item(self, did: str):
+        try:
+            identity = self.resolve_did(did)
+        except Exception as e:
+            return batch_error(did, e)
+        return responses.batch_result(identity)
+
+    def resolve(self, did: str, chain_id: str, testnet=False):
+        network = consts.NETWORK_MAINNET if not testnet else consts.NETWORK_TESTNET
+        identity = self._cached(network, chain_id, did)
+        if identity is not None:
+            return identity
+
+        # Concurrent resolutions of the same identity share a single backend resolution (and its result or exception)
+        return bind(self.resolution_flights.do((network, chain_id), self._get_and_cache_identity, did, chain_id,
+                                               testnet), did)
+
+    def _get_and_cache_identity(self, did: str, chain_id: str, testnet=False):
+        network = consts.NETWORK_MAINNET if not testnet else consts.NETWORK_TESTNET
+        try:
+            identity = self.get_identity(did, chain_id, testnet)
+        except IdentityNotFoundException as e:
+            self.negative_cache.put(network, chain_id, e)
+            raise
+        return self.resolved_document_cache.put(network, chain_id, identity)
+
+    def get_identity(self, did: str, chain_id: str, testnet=False):
+        network = consts.NETWORK_MAINNET if not testnet else consts.NETWORK_TESTNET
+        connections = failover.get_backends(self.driver_config, testnet)
+        return failover.resolve(
+            self.driver_config, network, connections,
+            lambda backend, deadline: self.get_identity_from(backend, did, chain_id, testnet, deadline),
+            health=self.backend_health)
+
+    def get_identity_from(self, backend: str, did: str, chain_id: str, testnet=False, deadline=None):
+        state_store = self.chain_state_store.for_backend(backend)
+        slow_threshold = self.driver_config.slow_resolution_log_threshold or None
+        get_identity = backends.CONNECTORS.get(backend)
+        with metrics.resolve_scope(backend, chain_id, slow_threshold, deadline=deadline):
+            return get_identity(self.driver_config, did, chain_id, testnet=testnet, state_store=state_store)
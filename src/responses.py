@@ -0,0 +1,45 @@
+import json
+from . import metrics
+
+
+def etag_matches(if_none_match: str, etag: str):
+    """Whether an If-None-Match header matches the given ETag (with the weak comparison that applies to GET)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+
+def parse_version_height(value: str):
+    """The block height given by the versionHeight query parameter, or None if it isn't set. Raises ValueError if it
+    isn't a non-negative integer."""
+    if value is None or value == '':
+        return None
+    if not value.isdigit():
+        raise ValueError('Invalid versionHeight: "{}"'.format(value))
+    return int(value)
+
+
+# Batch responses are assembled from each identity's serialized resolution result, rather than re-serialized
+
+
+def batch_result(identity) -> bytes:
+    """The result of a successful resolution in a batch response: the identity's resolution result, with its status"""
+    metrics.BATCH_ITEMS.inc(200)
+    return identity.serialize()[:-1] + b',"status":200}'
+
+
+def batch_error(status: int, detail: str) -> bytes:
+    metrics.BATCH_ITEMS.inc(status)
+    return json.dumps({'status': status, 'errors': {'detail': detail}}, separators=(',', ':')).encode()
+
+
+def batch_response(dids: list, results: list) -> bytes:
+    """Assemble a batch response mapping each DID to its serialized result, in order"""
+    return b''.join([
+        b'{"results":{',
+        b','.join(json.dumps(did).encode() + b':' + result for did, result in zip(dids, results)),
+        b'}}'
+    ])
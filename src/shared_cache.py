@@ -0,0 +1,116 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from .chain_state import ChainCursor
+from .models import Identity
+
+
+class SharedChainStateStore:
+    """Bounded store of each chain's resolved Identity state and cursor, in an SQLite database that all the worker
+    processes of a host share. Once any worker has resolved a chain, the others resume from its cursor instead of
+    walking the chain again.
+
+    States are stored in a write transaction that never replaces a state further along the chain. Once the store
+    holds more than max_size states, the least recently stored ones are evicted (a chain's state is stored again each
+    time it gets resolved, so the chains in use stay in)."""
+
+    def __init__(self, path: str, max_size=100000, busy_timeout=5, clock=time.time):
+        self.path = path
+        self.max_size = max_size
+        self.busy_timeout = busy_timeout
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._local = threading.local()
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS chain_states ('
+            'network TEXT NOT NULL, chain_id TEXT NOT NULL, entry_offset INTEGER NOT NULL, cursor TEXT NOT NULL, '
+            'state TEXT NOT NULL, stored_at REAL NOT NULL, PRIMARY KEY (network, chain_id))')
+        self._connection().execute('CREATE INDEX IF NOT EXISTS chain_states_stored_at ON chain_states (stored_at)')
+
+    def get(self, network: str, chain_id: str, did: str):
+        """Return the stored identity (bound to the given DID) and its cursor, or (None, None)"""
+        try:
+            row = self._connection().execute(
+                'SELECT cursor, state FROM chain_states WHERE network = ? AND chain_id = ?',
+                (network, chain_id)).fetchone()
+        except sqlite3.Error:
+            # The shared store only saves work, so resolutions go on without it
+            self._count('errors')
+            return None, None
+        if row is None:
+            self._count('misses')
+            return None, None
+
+        self._count('hits')
+        cursor, state = row
+        return Identity.from_state(did, chain_id, json.loads(state)), ChainCursor(*json.loads(cursor))
+
+    def put(self, network: str, chain_id: str, identity, cursor: ChainCursor):
+        """Store the identity's state, unless a state further along the chain has already been stored"""
+        if self.max_size <= 0 or identity.stage == 'pending':
+            return
+
+        state = json.dumps(identity.to_state(), separators=(',', ':'))
+        try:
+            connection = self._connection()
+            # An upsert (INSERT ... ON CONFLICT) would need SQLite 3.24, which the Docker image doesn't have
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute(
+                    'SELECT entry_offset FROM chain_states WHERE network = ? AND chain_id = ?',
+                    (network, chain_id)).fetchone()
+                if row is None or cursor.offset >= row[0]:
+                    connection.execute(
+                        'INSERT OR REPLACE INTO chain_states '
+                        '(network, chain_id, entry_offset, cursor, state, stored_at) VALUES (?, ?, ?, ?, ?, ?)',
+                        (network, chain_id, cursor.offset, json.dumps(list(cursor)), state, self.clock()))
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            if self._count('_puts') % 64 == 0:
+                self.evict()
+        except sqlite3.Error:
+            self._count('errors')
+
+    def evict(self):
+        """Evict the least recently stored states over max_size"""
+        self._connection().execute(
+            'DELETE FROM chain_states WHERE rowid IN (SELECT rowid FROM chain_states ORDER BY stored_at '
+            'LIMIT max((SELECT count(*) FROM chain_states) - ?, 0))', (self.max_size,))
+
+    def stats(self):
+        try:
+            size = self._connection().execute('SELECT count(*) FROM chain_states').fetchone()[0]
+        except sqlite3.Error:
+            size = 0
+        return {
+            'size': size,
+            'maxSize': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors
+        }
+
+    def _count(self, name: str):
+        with self._lock:
+            value = getattr(self, name) + 1
+            setattr(self, name, value)
+        return value
+
+    def _connection(self):
+        # SQLite connections can't be shared across threads, nor across a fork (e.g. when gunicorn preloads the app)
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
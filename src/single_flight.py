@@ -0,0 +1,76 @@
+import asyncio
+import threading
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key: while a call is in flight, later calls for its key wait for it and
+    share its result (or exception) instead of making their own"""
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+            call = self._in_flight.get(key)
+            waiting = call is not None
+            if waiting:
+                self.coalesced += 1
+            else:
+                call = _Call()
+                self._in_flight[key] = call
+
+        if waiting:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        return {'inFlight': len(self._in_flight), 'calls': self.calls, 'coalesced': self.coalesced}
+
+
+class AsyncSingleFlight:
+    """The asyncio version of SingleFlight, for coroutine functions. A waiter that gets cancelled does not cancel the
+    call it was waiting on, as other waiters may still need it."""
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight = {}
+
+    async def do(self, key, function, *args, **kwargs):
+        self.calls += 1
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = asyncio.ensure_future(function(*args, **kwargs))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda f: self._in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {'inFlight': len(self._in_flight), 'calls': self.calls, 'coalesced': self.coalesced}
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
@@ -1,77 +1,172 @@
 import base64
-import requests
+import itertools
+from . import clients
 from . import consts
+from . import metrics
 from . import models
+from .chain_state import ChainCursor, ChainStateStore
 from .config import DriverConfig
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests import Session
 
 
 IDENTITY_CHAIN_TAG_BASE64 = base64.b64encode(consts.IDENTITY_CHAIN_TAG).decode()
 KEY_REPLACEMENT_TAG_BASE64 = base64.b64encode(consts.KEY_REPLACEMENT_TAG).decode()
 
 
-def get_identity(driver_config: DriverConfig, did: str, chain_id: str, testnet=False):
+def get_identity(driver_config: DriverConfig, did: str, chain_id: str, testnet=False,
+                 state_store: ChainStateStore = None):
     api_base_url = driver_config.tfa_explorer_mainnet if not testnet else driver_config.tfa_explorer_testnet
-    entry = get_first_entry_in_chain(api_base_url, chain_id)
+    network = consts.NETWORK_MAINNET if not testnet else consts.NETWORK_TESTNET
+    session = clients.get_session(driver_config, DriverConfig.TFA_EXPLORER, network)
 
+    identity, cursor = (None, None) if state_store is None else state_store.get(network, chain_id, did)
+    if identity is None:
+        entry = get_first_entry_in_chain(session, api_base_url, chain_id)
+        identity, cursor = create_identity(did, chain_id, entry)
+        if cursor is None:
+            return identity
+
+    # At this point, we know there is a valid identity at the given chain ID
+    # Pages grow in size as the chain turns out to be long, and once a chain needs more than one page, the following
+    # pages are fetched concurrently. They are still applied strictly in chain order.
+    pages = PagePlan(driver_config, cursor.offset)
+    concurrency = max(driver_config.tfa_explorer_fetch_concurrency, 1)
+    windows = deque()
+    get_entries = metrics.propagate(get_entries_in_chain)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        def fetch_next_window():
+            limit, offset = pages.next_page()
+            windows.append((executor.submit(get_entries, session, api_base_url, chain_id, limit, offset), limit))
+
+        fetch_next_window()
+        while True:
+            window, limit = windows.popleft()
+            entries = window.result()
+            cursor, keep_parsing = apply_entries(identity, cursor, entries)
+            outcome = pages.after_page(entries, limit, cursor) if keep_parsing else PagePlan.END
+            if outcome != PagePlan.NEXT:
+                for window, _ in windows:
+                    window.cancel()
+                windows.clear()
+            if outcome == PagePlan.END:
+                break
+
+            while len(windows) < concurrency:
+                fetch_next_window()
+
+    if state_store is not None:
+        state_store.put(network, chain_id, identity, cursor)
+    return identity
+
+
+def get_page_sizes(driver_config: DriverConfig):
+    """Yield the size of each page to request, doubling from the initial page size up to the maximum page size"""
+    page_size = max(driver_config.tfa_explorer_page_size, 1)
+    while True:
+        yield page_size
+        page_size = max(min(page_size * 2, driver_config.tfa_explorer_max_page_size), page_size)
+
+
+class PagePlan:
+    """The offset and size of each page of a chain to request, from the given offset on (see get_page_sizes).
+
+    A page with fewer entries than requested ends the chain, unless more were requested than the API has returned in
+    a page so far: the API may cap the page size below tfaExplorerApiMaxPageSize. The pages requested after such a page
+    would then leave out entries, so they are dropped, and the chain is read on from the end of the page, with pages of
+    the size the API returned."""
+
+    END = 'end'
+    NEXT = 'next'
+    RESTART = 'restart'
+
+    def __init__(self, driver_config: DriverConfig, offset: int):
+        self.offset = offset
+        self.largest_page = max(driver_config.tfa_explorer_page_size, 1)
+        self._page_sizes = get_page_sizes(driver_config)
+
+    def next_page(self):
+        """Return the limit and offset of the next page to request"""
+        limit = next(self._page_sizes)
+        offset = self.offset
+        self.offset += limit
+        return limit, offset
+
+    def after_page(self, entries: list, limit: int, cursor: ChainCursor):
+        """Whether the chain ends with the given page of entries (END), goes on with the pages already requested
+        (NEXT), or goes on from the given cursor, after dropping the pages already requested (RESTART)"""
+        if not entries or (len(entries) < limit and limit <= self.largest_page):
+            return PagePlan.END
+        self.largest_page = max(self.largest_page, len(entries))
+        if len(entries) < limit:
+            self.offset = cursor.offset
+            self._page_sizes = itertools.repeat(len(entries))
+            return PagePlan.RESTART
+        return PagePlan.NEXT
+
+
+def create_identity(did: str, chain_id: str, entry: dict):
+    """Create the identity from the chain's first entry, as returned by the explorer. Returns the identity and the
+    cursor after the first entry, which is None if the entry is still pending."""
     if entry['extid_count'] <= 1 or entry['extids'][0] != IDENTITY_CHAIN_TAG_BASE64:
-        raise models.IdentityNotFoundException()
+        raise models.NotAnIdentityException()
 
-    content = base64.b64decode(entry['content'])
-    external_ids = [base64.b64decode(x.encode()) for x in entry['extids']]
+    with metrics.timed('decode'):
+        content = base64.b64decode(entry['content'])
+        external_ids = [base64.b64decode(x.encode()) for x in entry['extids']]
 
     identity = models.Identity(did, chain_id)
     if entry['pending']:
         identity.process_creation(entry['entry_hash'], external_ids, content)
-        return identity
+        return identity, None
 
     identity.process_creation(entry['entry_hash'], external_ids, content, stage='factom', height=entry['block_height'])
+    return identity, ChainCursor(entry['entry_hash'], entry['block_height'], 1, None)
 
-    # At this point, we know there is a valid identity at the given chain ID
-    limit = 25
-    page = 1
-    offset = 1
-    keep_parsing = True
-    while keep_parsing:
-        entries = get_entries_in_chain(api_base_url, chain_id, limit, offset)
 
-        if len(entries) < limit:
+def apply_entries(identity: models.Identity, cursor: ChainCursor, entries: list):
+    """Apply a page of entries (in chain order) to the identity, stopping at the first pending entry. Returns the
+    cursor after the last entry applied, and whether parsing should go on past this page."""
+    key_replacements = []
+    keep_parsing = True
+    entry_count = 0
+    for entry in entries:
+        entry_count += 1
+        if entry['pending']:
             keep_parsing = False
-
-        for entry in entries:
-            if entry['extid_count'] != 5:
-                continue
-            elif entry['pending']:
-                keep_parsing = False
-                break
-            elif entry['extids'][0] != KEY_REPLACEMENT_TAG_BASE64:
-                continue
+            break
+        cursor = ChainCursor(entry['entry_hash'], entry['block_height'], cursor.offset + 1, None)
+        if entry['extid_count'] != 5 or entry['extids'][0] != KEY_REPLACEMENT_TAG_BASE64:
+            continue
+        with metrics.timed('decode'):
             external_ids = [base64.b64decode(x.encode()) for x in entry['extids']]
-            identity.process_key_replacement(entry['entry_hash'], external_ids, entry['block_height'])
-
-        offset += limit
-        page += 1
-
-    return identity
+        key_replacements.append((entry['entry_hash'], external_ids, entry['block_height']))
+    metrics.count_entries(DriverConfig.TFA_EXPLORER, entry_count)
+    identity.process_key_replacements(key_replacements)
+    return cursor, keep_parsing
 
 
-def get_first_entry_in_chain(api_base_url: str, chain_id: str):
+def get_first_entry_in_chain(session: Session, api_base_url: str, chain_id: str):
     url = '{}/chain/entries/{}?limit=1&offset=0'.format(api_base_url, chain_id)
-    resp = requests.get(url)
+    resp = session.get(url)
     if resp.status_code != 200:
         raise ValueError
 
-    result = resp.json().get('result')
+    with metrics.timed('decode'):
+        result = resp.json().get('result')
     if result is None:
-        raise models.IdentityNotFoundException()
+        raise models.ChainNotFoundException()
 
     return result[0]
 
 
-def get_entries_in_chain(api_base_url: str, chain_id: str, limit=25, offset=0):
+def get_entries_in_chain(session: Session, api_base_url: str, chain_id: str, limit=25, offset=0):
     url = '{}/chain/entries/{}?limit={}&offset={}'.format(api_base_url, chain_id, limit, offset)
-    resp = requests.get(url)
+    resp = session.get(url)
     if resp.status_code != 200:
         raise ValueError
 
-    result = resp.json().get('result')
+    with metrics.timed('decode'):
+        result = resp.json().get('result')
     return [] if result is None else result
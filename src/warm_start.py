@@ -0,0 +1,161 @@
+import asyncio
+import atexit
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from .chain_state import ChainCursor, ChainStateStore
+from .models import Identity
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+def save_snapshot(store: ChainStateStore, path: str):
+    """Write the store's chain states to the given file, replacing it atomically, and return how many were written.
+
+    Every worker process saves its own store to the same file, so the states already in it are merged in: for each
+    chain, the state furthest along the chain is kept, and only the store's max_size most recent states are written."""
+    with _locked(path):
+        states, offsets = OrderedDict(), {}
+        try:
+            for state in _read_states(path):
+                states[(state[0], state[1])] = state
+                offsets[(state[0], state[1])] = ChainCursor(*state[4]).offset
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError, AttributeError, IndexError) as e:
+            logger.warning('Overwriting the snapshot at %s: %r', path, e)
+            states, offsets = OrderedDict(), {}
+
+        for network, chain_id, identity, cursor in store.dump():
+            if offsets.get((network, chain_id), -1) > cursor.offset:
+                continue
+            states.pop((network, chain_id), None)
+            states[(network, chain_id)] = [network, chain_id, identity.did, identity.to_state(), list(cursor)]
+        states = list(states.values())[-store.max_size:] if store.max_size > 0 else []
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': SNAPSHOT_VERSION, 'states': states}, f, separators=(',', ':'))
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    return len(states)
+
+
+def load_snapshot(store: ChainStateStore, path: str):
+    """Load the chain states of a snapshot written by save_snapshot into the store, and return how many were loaded.
+    A missing or unreadable snapshot is skipped: the driver then starts cold."""
+    try:
+        states = [(network, chain_id, Identity.from_state(did, chain_id, state), ChainCursor(*cursor))
+                  for network, chain_id, did, state, cursor in _read_states(path)]
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        logger.warning('Skipped the snapshot at %s: %r', path, e)
+        return 0
+
+    for network, chain_id, identity, cursor in states:
+        store.put(network, chain_id, identity, cursor)
+    return len(states)
+
+
+def _read_states(path: str):
+    with open(path) as f:
+        snapshot = json.load(f)
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError('Unsupported snapshot version: {}'.format(snapshot.get('version')))
+    return snapshot.get('states')
+
+
+@contextlib.contextmanager
+def _locked(path: str):
+    # Serializes the merges of the worker processes, through a lock file next to the snapshot
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+class SnapshotWriter:
+    """Saves the store's chain states to a snapshot every interval seconds (0 to only save them at exit), from a
+    background thread"""
+
+    def __init__(self, store: ChainStateStore, path: str, interval=300):
+        self.store = store
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        atexit.register(self.stop)
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='snapshot-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        atexit.unregister(self.stop)
+        self.save()
+
+    def save(self):
+        try:
+            save_snapshot(self.store, self.path)
+        except OSError as e:
+            logger.warning('Failed to save the snapshot at %s: %r', self.path, e)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.save()
+
+
+def preload(resolve, dids: list, concurrency=8):
+    """Resolve the given DIDs concurrently with resolve(did), to warm the caches, and return how many were resolved"""
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda did: _preload(resolve, did), dids))
+    return sum(results)
+
+
+async def preload_async(resolve, dids: list, concurrency=8):
+    """The asyncio version of preload, with resolve(did) a coroutine function"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def preload_did(did):
+        async with semaphore:
+            try:
+                await resolve(did)
+                return True
+            except Exception as e:
+                logger.warning('Failed to preload %s: %r', did, e)
+                return False
+
+    return sum(await asyncio.gather(*[preload_did(did) for did in dids]))
+
+
+def _preload(resolve, did: str):
+    try:
+        resolve(did)
+        return True
+    except Exception as e:
+        logger.warning('Failed to preload %s: %r', did, e)
+        return False
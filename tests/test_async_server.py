@@ -0,0 +1,224 @@
+import unittest
+import identitykeys
+import json
+import os
+import tempfile
+import threading
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from src import consts
+from src import metrics
+from src.async_server import AsyncResolver, create_app
+from src.config import DriverConfig
+from tests.test_factomd_jsonrpc_connection import FakeFactomd
+from tests.test_harmony_connect_connection import FakeEntriesApi
+
+
+def create_factomd_app(factomd: FakeFactomd):
+    """Serve a FakeFactomd over HTTP, as the async server's backend"""
+    async def handle(request):
+        body = await request.json()
+        if isinstance(body, list):
+            return web.json_response([factomd.handle(call) for call in body])
+        response = factomd.handle(body)
+        return web.json_response(response, status=404 if 'error' in response else 200)
+
+    app = web.Application()
+    app.router.add_post('/v2', handle)
+    return app
+
+
+def create_harmony_app(entries_api: FakeEntriesApi):
+    """Serve a FakeEntriesApi over HTTP, as the async server's backend"""
+    def entry_json(entry):
+        dblock = None if entry.dblock is None else {'height': entry.dblock.height}
+        return {'entry_hash': entry.entry_hash, 'external_ids': entry.external_ids, 'content': entry.content,
+                'stage': entry.stage, 'dblock': dblock}
+
+    async def first_entry(request):
+        return web.json_response({'data': entry_json(entries_api.get_first_entry(entries_api.chain_id).data)})
+
+    async def entries(request):
+        response = entries_api.get_entries_by_chain_id(entries_api.chain_id, limit=int(request.query['limit']),
+                                                       offset=int(request.query['offset']))
+        data = [{'entry_hash': e.entry_hash} for e in response.data]
+        return web.json_response({'data': data, 'offset': response.offset, 'limit': response.limit,
+                                  'count': response.count})
+
+    async def entry(request):
+        response = entries_api.get_entry_by_hash(entries_api.chain_id, request.match_info['entry_hash'])
+        return web.json_response({'data': entry_json(response.data)})
+
+    app = web.Application()
+    app.router.add_get('/chains/{chain_id}/entries/first', first_entry)
+    app.router.add_get('/chains/{chain_id}/entries', entries)
+    app.router.add_get('/chains/{chain_id}/entries/{entry_hash}', entry)
+    return app
+
+
+class TestAsyncServer(unittest.IsolatedAsyncioTestCase):
+
+    chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+
+    async def asyncSetUp(self):
+        self.key_pairs = [identitykeys.generate_key_pair() for _ in range(3)]
+        public_keys = [pub.to_string() for _, pub in self.key_pairs]
+        content = json.dumps({'version': 1, 'keys': public_keys}, separators=(',', ':')).encode()
+        self.factomd = FakeFactomd(self.chain_id)
+        self.factomd.add_entry_block(1000, [([consts.IDENTITY_CHAIN_TAG, b'Test', b'v1'], content)])
+        self.factomd.add_entry_block(1001, [([b'spam'], b'spam')])
+
+        self.backend = TestServer(create_factomd_app(self.factomd))
+        await self.backend.start_server()
+        self.addAsyncCleanup(self.backend.close)
+
+        driver_config = DriverConfig()
+        driver_config.rpc_url_mainnet = str(self.backend.make_url('')).rstrip('/')
+        driver_config.rpc_url_testnet = driver_config.rpc_url_mainnet
+        self.driver_config = driver_config
+        self.client = TestClient(TestServer(create_app(driver_config)))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def test_resolve(self):
+        resp = await self.client.get('/1.0/identifiers/did:factom:mainnet:' + self.chain_id)
+        self.assertEqual(200, resp.status)
+        body = await resp.json()
+        self.assertEqual('did:factom:mainnet:' + self.chain_id, body['didDocument']['id'])
+        self.assertEqual(3, len(body['didDocument']['publicKey']))
+        self.assertEqual(1000, body['methodMetadata']['createdHeight'])
+        self.assertIn('backend-factomd;dur=', resp.headers['Server-Timing'])
+
+        # Served from the resolved document cache
+        calls = len(self.factomd.calls)
+        resp = await self.client.get('/1.0/identifiers/did:factom:' + self.chain_id + '/')
+        self.assertEqual(200, resp.status)
+        self.assertEqual(calls, len(self.factomd.calls))
+
+    async def test_version_height(self):
+        resp = await self.client.get('/1.0/identifiers/did:factom:' + self.chain_id, params={'versionHeight': '1001'})
+        self.assertEqual(200, resp.status)
+        self.assertEqual(1001, (await resp.json())['methodMetadata']['versionHeight'])
+
+        resp = await self.client.get('/1.0/identifiers/did:factom:' + self.chain_id, params={'versionHeight': '999'})
+        self.assertEqual(404, resp.status)
+        resp = await self.client.get('/1.0/identifiers/did:factom:' + self.chain_id, params={'versionHeight': 'x'})
+        self.assertEqual(400, resp.status)
+
+    async def test_error_bodies(self):
+        resp = await self.client.get('/1.0/identifiers/did:factom:' + '00' * 32)
+        self.assertEqual(404, resp.status)
+        self.assertEqual({'errors': {'detail': 'Page not found'}}, await resp.json())
+
+        resp = await self.client.get('/1.0/identifiers/did:factom:foo')
+        self.assertEqual(404, resp.status)
+
+        resp = await self.client.post('/health')
+        self.assertEqual(405, resp.status)
+        self.assertEqual({'errors': {'detail': 'Method not allowed'}}, await resp.json())
+
+    async def test_backend_error(self):
+        await self.backend.close()
+        resp = await self.client.get('/1.0/identifiers/did:factom:' + self.chain_id)
+        self.assertEqual(500, resp.status)
+        self.assertEqual({'errors': {'detail': 'Internal server error'}}, await resp.json())
+
+    async def test_batch(self):
+        dids = ['did:factom:' + self.chain_id, 'did:factom:testnet:' + self.chain_id, 'did:factom:' + '00' * 32,
+                'did:example:123']
+        resp = await self.client.post('/1.0/identifiers/batch', json={'identifiers': dids})
+        self.assertEqual(200, resp.status)
+        results = (await resp.json())['results']
+        self.assertEqual(dids, list(results))
+        self.assertEqual([200, 200, 404, 400], [r['status'] for r in results.values()])
+
+        resp = await self.client.post('/1.0/identifiers/batch', data=b'[]')
+        self.assertEqual(400, resp.status)
+        self.assertEqual({'errors': {'detail': 'Bad request'}}, await resp.json())
+
+    async def test_shared_chain_state(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.driver_config.shared_cache_path = os.path.join(directory.name, 'shared.db')
+        did = 'did:factom:' + self.chain_id
+        resolvers = [AsyncResolver(self.driver_config) for _ in range(2)]
+        for resolver in resolvers:
+            await resolver.open()
+            self.addAsyncCleanup(resolver.close)
+
+            # The shared store is never used from the event loop's thread
+            for method in ('get', 'put'):
+                def check_thread(*args, method=getattr(resolver.shared_chain_state_store, method)):
+                    self.assertIsNot(threading.main_thread(), threading.current_thread())
+                    return method(*args)
+                setattr(resolver.shared_chain_state_store, method, check_thread)
+
+        await resolvers[0].get_identity_from('factomd', did, self.chain_id)
+        self.factomd.calls.clear()
+        identity = await resolvers[1].get_identity_from('factomd', did, self.chain_id)
+        self.assertEqual(3, len(identity.active_keys))
+        self.assertEqual(['chain-head'], [c['method'] for c in self.factomd.calls])
+
+    async def test_metrics(self):
+        backend_calls = metrics.BACKEND_CALLS.get(DriverConfig.FACTOMD, 'ok')
+        resolutions = metrics.RESOLVE_DURATION.get_count(DriverConfig.FACTOMD, 'found')
+        await self.client.get('/1.0/identifiers/did:factom:' + self.chain_id)
+        await self.client.get('/1.0/identifiers/did:factom:' + '00' * 32)
+        self.assertLess(backend_calls, metrics.BACKEND_CALLS.get(DriverConfig.FACTOMD, 'ok'))
+        self.assertEqual(resolutions + 1, metrics.RESOLVE_DURATION.get_count(DriverConfig.FACTOMD, 'found'))
+
+        resp = await self.client.get('/metrics')
+        self.assertEqual(200, resp.status)
+        body = await resp.text()
+        self.assertIn('did_factom_http_requests_total{route="resolve",status="404"}', body)
+        self.assertIn('did_factom_resolve_backend_calls_bucket{backend="factomd",le="+Inf"}', body)
+
+
+class TestAsyncHarmonyConnection(unittest.IsolatedAsyncioTestCase):
+
+    chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+
+    async def asyncSetUp(self):
+        self.key_pairs = [identitykeys.generate_key_pair() for _ in range(3)]
+        public_keys = [pub.to_string() for _, pub in self.key_pairs]
+        content = json.dumps({'version': 1, 'keys': public_keys}, separators=(',', ':')).encode()
+        self.entries_api = FakeEntriesApi(self.chain_id)
+        self.entries_api.add_entry([consts.IDENTITY_CHAIN_TAG, b'Test', b'v1'], content)
+
+        backend = TestServer(create_harmony_app(self.entries_api))
+        await backend.start_server()
+        self.addAsyncCleanup(backend.close)
+
+        driver_config = DriverConfig()
+        driver_config.factom_connection = DriverConfig.HARMONY
+        driver_config.harmony_url = str(backend.make_url(''))
+        self.client = TestClient(TestServer(create_app(driver_config)))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    def replace_key(self, old_index, signer_index):
+        _, old_pub = self.key_pairs[old_index]
+        signer_priv, signer_pub = self.key_pairs[signer_index]
+        new_priv, new_pub = identitykeys.generate_key_pair()
+        self.key_pairs[old_index] = (new_priv, new_pub)
+        message = self.chain_id.encode() + old_pub.to_string().encode() + new_pub.to_string().encode()
+        return [
+            consts.KEY_REPLACEMENT_TAG,
+            old_pub.to_string().encode(),
+            new_pub.to_string().encode(),
+            signer_priv.sign(message),
+            signer_pub.to_string().encode()
+        ], b''
+
+    async def test_replacements_applied_in_order(self):
+        for i in range(40):
+            self.entries_api.add_entry(*self.replace_key(2, 2), height=1000 + i)
+        self.entries_api.add_entry(*self.replace_key(1, 1), stage='replicated')
+
+        resp = await self.client.get('/1.0/identifiers/did:factom:' + self.chain_id)
+        self.assertEqual(200, resp.status)
+        body = await resp.json()
+        self.assertEqual(43, len(body['methodMetadata']['publicKeyHistory']))
+        active_keys = {k['publicKeyHex'] for k in body['didDocument']['publicKey']}
+        self.assertNotIn(self.key_pairs[1][1].to_bytes().hex(), active_keys)
+        self.assertIn(self.key_pairs[2][1].to_bytes().hex(), active_keys)
@@ -0,0 +1,37 @@
+import unittest
+import os
+import subprocess
+import sys
+from src import backends
+from src import factomd_jsonrpc_connection
+from src.config import DriverConfig
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestBackendRegistry(unittest.TestCase):
+
+    def test_get(self):
+        registry = backends.BackendRegistry({DriverConfig.FACTOMD: '.factomd_jsonrpc_connection:get_identity'})
+        self.assertEqual([], registry.loaded())
+        self.assertIs(factomd_jsonrpc_connection.get_identity, registry.get(DriverConfig.FACTOMD))
+        self.assertEqual([DriverConfig.FACTOMD], registry.loaded())
+        with self.assertRaises(ValueError):
+            registry.get('foo')
+
+    def test_register(self):
+        registry = backends.BackendRegistry({})
+        registry.register('custom', 'src.consts:DID_PREFIX')
+        registry.load(['custom'])
+        self.assertEqual('did:factom:', registry.get('custom'))
+
+    def test_lazy_imports(self):
+        # A worker configured for factomd alone never imports the Harmony client libraries
+        env = dict(os.environ, uniresolver_driver_did_factom_factomConnection=DriverConfig.FACTOMD)
+        env.pop('uniresolver_driver_did_factom_factomConnections', None)
+        for app_module in ('did_factom_driver', 'did_factom_driver_async'):
+            script = ('import sys, {}; '
+                      'print(sorted({{"harmony_connect_client", "factom_sdk"}} & set(sys.modules)))').format(app_module)
+            output = subprocess.check_output([sys.executable, '-c', script], cwd=ROOT, env=env)
+            self.assertEqual('[]', output.decode().strip(), app_module)
@@ -0,0 +1,62 @@
+import unittest
+import importlib.util
+from benchmarks import chains
+from benchmarks import load
+from benchmarks import run
+from benchmarks.standins import StandIns
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_run_benchmark(self):
+        chain = chains.replacements_chain(scale=0.01)
+        with StandIns([chain]) as stand_ins:
+            results = [run.run_benchmark(stand_ins, chain, connector, repeat=1)
+                       for connector in ('factomd', 'tfa_explorer', 'harmony', 'harmony_cached')]
+
+        # All connectors resolve the same identity, with every key replacement applied
+        self.assertEqual([len(chain.entries) + 2] * 4, [result['allKeys'] for result in results])
+        for result in results:
+            self.assertGreater(result['upstreamCalls'], 0)
+            self.assertGreater(result['peakMemoryBytes'], 0)
+        self.assertGreater(results[0]['identityCpuSeconds']['median'], 0)
+
+    def test_chains_are_reproducible(self):
+        self.assertEqual(chains.invalid_replacements_chain(scale=0.005), chains.invalid_replacements_chain(scale=0.005))
+
+
+class TestLoad(unittest.TestCase):
+
+    def test_request_mix(self):
+        population = chains.identity_chains(20, scale=0.1)
+        paths = load.request_mix(population, 2000, missing_ratio=0.2, testnet_ratio=0.2, seed=1)
+        self.assertEqual(paths, load.request_mix(population, 2000, missing_ratio=0.2, testnet_ratio=0.2, seed=1))
+        self.assertEqual(2000, len(paths))
+
+        # A few DIDs get most of the requests, across all three route shapes
+        counts = sorted(((paths.count(path), path) for path in set(paths)), reverse=True)
+        self.assertGreater(counts[0][0], 10 * counts[-1][0])
+        self.assertTrue(any(':testnet:' in path for path in paths))
+        self.assertTrue(any(':mainnet:' in path for path in paths))
+        chain_ids = {chain.chain_id for chain in population}
+        self.assertTrue(any(path[-64:] not in chain_ids for path in paths))
+
+    def test_run_level(self):
+        population = chains.identity_chains(2, scale=0.1)
+        paths = ['/chain/entries/{}?limit=1&offset=0'.format(chain.chain_id) for chain in population]
+        with StandIns(population) as stand_ins:
+            result = load.run_level(stand_ins.urls['tfa_explorer'], paths, concurrency=2, duration=0.2)
+        self.assertEqual({'200': result['requests']}, result['statuses'])
+        self.assertGreater(result['throughput'], 0)
+        self.assertLessEqual(result['latencySeconds']['p50'], result['latencySeconds']['p99'])
+
+    @unittest.skipIf(importlib.util.find_spec('gunicorn') is None, 'gunicorn is not installed')
+    def test_run_load(self):
+        population = chains.identity_chains(5, scale=0.1)
+        paths = load.request_mix(population, 100, missing_ratio=0.2, testnet_ratio=0.2)
+        with StandIns(population) as stand_ins:
+            results = load.run_load(stand_ins, paths, workers=2, concurrency_levels=(1, 4), duration=0.5,
+                                    warmup=0.5)
+        self.assertEqual([1, 4], [result['concurrency'] for result in results])
+        for result in results:
+            self.assertEqual(set(), set(result['statuses']) - {'200', '404'})
@@ -0,0 +1,131 @@
+import unittest
+from src import consts
+from src.cache import BloomFilter, NegativeCache, ResolvedDocumentCache
+from src.models import ChainNotFoundException, IdentityNotFoundException, NotAnIdentityException
+from tests.test_chain_state import create_identity
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResolvedDocumentCache(unittest.TestCase):
+
+    did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+    mainnet_did = 'did:factom:mainnet:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+    chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+
+    def test_hit_and_miss(self):
+        cache = ResolvedDocumentCache()
+        self.assertIsNone(cache.get(consts.NETWORK_MAINNET, self.chain_id, self.did))
+
+        identity = create_identity(self.did, self.chain_id)
+        self.assertIs(identity, cache.put(consts.NETWORK_MAINNET, self.chain_id, identity))
+        self.assertIs(identity, cache.get(consts.NETWORK_MAINNET, self.chain_id, self.did))
+        self.assertIsNone(cache.get(consts.NETWORK_TESTNET, self.chain_id, self.did))
+        self.assertEqual(1, cache.stats()['hits'])
+        self.assertEqual(2, cache.stats()['misses'])
+
+    def test_shared_between_dids(self):
+        cache = ResolvedDocumentCache()
+        cache.put(consts.NETWORK_MAINNET, self.chain_id, create_identity(self.did, self.chain_id))
+
+        result = cache.get(consts.NETWORK_MAINNET, self.chain_id, self.mainnet_did).get_resolution_result()
+        self.assertEqual(self.mainnet_did, result['didDocument']['id'])
+        for k in result['methodMetadata']['publicKeyHistory']:
+            self.assertEqual(self.mainnet_did, k['controller'])
+        identity = cache.get(consts.NETWORK_MAINNET, self.chain_id, self.mainnet_did)
+        self.assertIs(identity, cache.get(consts.NETWORK_MAINNET, self.chain_id, self.mainnet_did))
+        self.assertEqual(self.did, cache.get(consts.NETWORK_MAINNET, self.chain_id, self.did).did)
+
+    def test_stage_ttls(self):
+        clock = FakeClock()
+        cache = ResolvedDocumentCache(pending_ttl=5, confirmed_ttl=60, clock=clock)
+        pending_chain_id = '00' * 32
+        cache.put(consts.NETWORK_MAINNET, pending_chain_id,
+                  create_identity('did:factom:' + pending_chain_id, pending_chain_id, stage='pending', height=None))
+        cache.put(consts.NETWORK_MAINNET, self.chain_id, create_identity(self.did, self.chain_id))
+
+        clock.now = 10
+        self.assertIsNone(cache.get(consts.NETWORK_MAINNET, pending_chain_id, 'did:factom:' + pending_chain_id))
+        self.assertIsNotNone(cache.get(consts.NETWORK_MAINNET, self.chain_id, self.did))
+
+        clock.now = 61
+        self.assertIsNone(cache.get(consts.NETWORK_MAINNET, self.chain_id, self.did))
+        self.assertEqual(2, cache.stats()['expirations'])
+
+    def test_lru_eviction(self):
+        cache = ResolvedDocumentCache(max_size=2)
+        chain_ids = ['{:064x}'.format(i) for i in range(3)]
+        cache.put(consts.NETWORK_MAINNET, chain_ids[0], create_identity('did:factom:' + chain_ids[0], chain_ids[0]))
+        cache.put(consts.NETWORK_MAINNET, chain_ids[1], create_identity('did:factom:' + chain_ids[1], chain_ids[1]))
+        cache.get(consts.NETWORK_MAINNET, chain_ids[0], 'did:factom:' + chain_ids[0])
+        cache.put(consts.NETWORK_MAINNET, chain_ids[2], create_identity('did:factom:' + chain_ids[2], chain_ids[2]))
+
+        self.assertIsNotNone(cache.get(consts.NETWORK_MAINNET, chain_ids[0], 'did:factom:' + chain_ids[0]))
+        self.assertIsNone(cache.get(consts.NETWORK_MAINNET, chain_ids[1], 'did:factom:' + chain_ids[1]))
+        self.assertEqual(1, cache.stats()['evictions'])
+
+    def test_disabled(self):
+        cache = ResolvedDocumentCache(max_size=0)
+        identity = cache.put(consts.NETWORK_MAINNET, self.chain_id, create_identity(self.did, self.chain_id))
+        self.assertEqual(self.did, identity.did)
+        self.assertIsNone(cache.get(consts.NETWORK_MAINNET, self.chain_id, self.did))
+
+
+class TestNegativeCache(unittest.TestCase):
+
+    chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+
+    def test_ttls(self):
+        clock = FakeClock()
+        cache = NegativeCache(missing_ttl=5, not_identity_ttl=60, bloom_capacity=0, clock=clock)
+        missing_chain_id = '00' * 32
+        self.assertFalse(cache.get(consts.NETWORK_MAINNET, missing_chain_id))
+        cache.put(consts.NETWORK_MAINNET, missing_chain_id, ChainNotFoundException())
+        cache.put(consts.NETWORK_MAINNET, self.chain_id, NotAnIdentityException())
+        self.assertTrue(cache.get(consts.NETWORK_MAINNET, missing_chain_id))
+        self.assertFalse(cache.get(consts.NETWORK_TESTNET, missing_chain_id))
+
+        clock.now = 10
+        self.assertFalse(cache.get(consts.NETWORK_MAINNET, missing_chain_id))
+        self.assertTrue(cache.get(consts.NETWORK_MAINNET, self.chain_id))
+
+        clock.now = 61
+        self.assertFalse(cache.get(consts.NETWORK_MAINNET, self.chain_id))
+        self.assertEqual({'size': 0, 'maxSize': 10000, 'hits': 2, 'bloomHits': 0, 'misses': 4, 'bloomSize': 0},
+                         cache.stats())
+
+    def test_bloom_filter_outlives_entries(self):
+        cache = NegativeCache(max_size=1, bloom_capacity=100)
+        cache.put(consts.NETWORK_MAINNET, self.chain_id, NotAnIdentityException())
+        cache.put(consts.NETWORK_MAINNET, '00' * 32, IdentityNotFoundException())
+        cache.put(consts.NETWORK_MAINNET, '11' * 32, ChainNotFoundException())
+
+        self.assertTrue(cache.get(consts.NETWORK_MAINNET, self.chain_id))
+        self.assertEqual(1, cache.stats()['bloomHits'])
+        # Only chains that are not identities are added to the bloom filter, as missing chains may yet be created
+        self.assertFalse(cache.get(consts.NETWORK_MAINNET, '00' * 32))
+        self.assertEqual(1, cache.stats()['bloomSize'])
+
+    def test_disabled(self):
+        cache = NegativeCache(max_size=0, bloom_capacity=0)
+        cache.put(consts.NETWORK_MAINNET, self.chain_id, NotAnIdentityException())
+        self.assertFalse(cache.get(consts.NETWORK_MAINNET, self.chain_id))
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_false_positive_rate(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom_filter.add('in-{}'.format(i))
+        self.assertTrue(all('in-{}'.format(i) in bloom_filter for i in range(1000)))
+        false_positives = sum('out-{}'.format(i) in bloom_filter for i in range(10000))
+        self.assertLess(false_positives, 300)
+
@@ -0,0 +1,131 @@
+import unittest
+import identitykeys
+import json
+from src import consts
+from src.chain_state import ChainCursor, ChainStateStore
+from src.models import Identity
+
+
+def create_identity(did, chain_id, stage='factom', height=123456):
+    external_ids = [consts.IDENTITY_CHAIN_TAG, b'Test', b'v1']
+    public_keys = [identitykeys.generate_key_pair()[1].to_string() for _ in range(3)]
+    content = {'version': 1, 'keys': public_keys}
+
+    identity = Identity(did, chain_id)
+    identity.process_creation(
+        entry_hash='00' * 32,
+        external_ids=external_ids,
+        content=json.dumps(content, separators=(',', ':')).encode(),
+        stage=stage,
+        height=height
+    )
+    return identity
+
+
+class TestIdentityCopy(unittest.TestCase):
+
+    def test_copy_is_independent(self):
+        did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        identity = create_identity(did, chain_id)
+
+        copied = identity.copy()
+        self.assertEqual(identity.get_did_document(), copied.get_did_document())
+        self.assertEqual(identity.get_method_metadata(), copied.get_method_metadata())
+
+        key = next(iter(copied.active_keys))
+        del copied.active_keys[key]
+        copied.all_keys[key] = copied.all_keys[key].retire(123457)
+        self.assertIn(key, identity.active_keys)
+        self.assertIsNone(identity.all_keys[key].retired_height)
+        self.assertEqual(identity.get_did_document()['id'], copied.get_did_document()['id'])
+
+    def test_copy_with_did(self):
+        did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        mainnet_did = 'did:factom:mainnet:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        identity = create_identity(did, chain_id)
+
+        copied = identity.copy(mainnet_did)
+        self.assertEqual(mainnet_did, copied.get_did_document()['id'])
+        for k in copied.get_method_metadata()['publicKeyHistory']:
+            self.assertEqual(mainnet_did, k['controller'])
+            self.assertTrue(k['id'].startswith(mainnet_did + '#key-'))
+        self.assertEqual(did, identity.get_did_document()['id'])
+
+    def test_rendered_once_per_state(self):
+        did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        identity = create_identity(did, chain_id, stage='pending', height=None)
+
+        serialized = identity.serialize()
+        self.assertEqual(identity.get_resolution_result(), json.loads(serialized.decode()))
+        self.assertIs(serialized, identity.serialize())
+        self.assertIs(serialized, identity.copy().serialize())
+        self.assertIsNot(serialized, identity.copy('did:factom:mainnet:' + chain_id).serialize())
+
+        identity.stage = 'factom'
+        self.assertEqual('factom', json.loads(identity.serialize().decode())['methodMetadata']['stage'])
+
+
+class TestChainStateStore(unittest.TestCase):
+
+    def test_get_missing(self):
+        store = ChainStateStore()
+        self.assertEqual((None, None), store.get(consts.NETWORK_MAINNET, '00' * 32, 'did:factom:' + '00' * 32))
+
+    def test_put_and_get(self):
+        did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        identity = create_identity(did, chain_id)
+        cursor = ChainCursor('11' * 32, 123460, 5, None)
+
+        store = ChainStateStore()
+        store.put(consts.NETWORK_MAINNET, chain_id, identity, cursor)
+        stored_identity, stored_cursor = store.get(consts.NETWORK_MAINNET, chain_id, did)
+        self.assertEqual(cursor, stored_cursor)
+        self.assertEqual(identity.get_method_metadata(), stored_identity.get_method_metadata())
+        self.assertIsNot(identity, stored_identity)
+        self.assertEqual((None, None), store.get(consts.NETWORK_TESTNET, chain_id, did))
+
+    def test_pending_not_stored(self):
+        did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        identity = create_identity(did, chain_id, stage='pending', height=None)
+
+        store = ChainStateStore()
+        store.put(consts.NETWORK_MAINNET, chain_id, identity, ChainCursor('11' * 32, 123460, 1, None))
+        self.assertEqual(0, len(store))
+
+    def test_older_cursor_ignored(self):
+        did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        identity = create_identity(did, chain_id)
+
+        store = ChainStateStore()
+        store.put(consts.NETWORK_MAINNET, chain_id, identity, ChainCursor('22' * 32, 123470, 10, None))
+        store.put(consts.NETWORK_MAINNET, chain_id, identity, ChainCursor('11' * 32, 123460, 5, None))
+        _, cursor = store.get(consts.NETWORK_MAINNET, chain_id, did)
+        self.assertEqual(10, cursor.offset)
+
+    def test_eviction(self):
+        store = ChainStateStore(max_size=2)
+        chain_ids = ['{:064x}'.format(i) for i in range(3)]
+        for chain_id in chain_ids:
+            identity = create_identity('did:factom:' + chain_id, chain_id)
+            store.put(consts.NETWORK_MAINNET, chain_id, identity, ChainCursor('11' * 32, 123460, 1, None))
+
+        self.assertEqual(2, len(store))
+        self.assertEqual((None, None), store.get(consts.NETWORK_MAINNET, chain_ids[0], 'did:factom:' + chain_ids[0]))
+
+    def test_backends_kept_apart(self):
+        did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        identity = create_identity(did, chain_id)
+
+        store = ChainStateStore()
+        store.for_backend('factomd').put(consts.NETWORK_MAINNET, chain_id, identity,
+                                         ChainCursor('11' * 32, 123460, 5, None))
+        _, cursor = store.for_backend('factomd').get(consts.NETWORK_MAINNET, chain_id, did)
+        self.assertEqual(5, cursor.offset)
+        self.assertEqual((None, None), store.for_backend('tfa_explorer').get(consts.NETWORK_MAINNET, chain_id, did))
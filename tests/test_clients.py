@@ -0,0 +1,35 @@
+import unittest
+from src import clients
+from src.config import DriverConfig
+from unittest import mock
+
+
+class TestClients(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(clients.reset)
+
+    def test_clients_are_reused(self):
+        driver_config = DriverConfig()
+        session = clients.get_session(driver_config, DriverConfig.TFA_EXPLORER, 'mainnet:')
+        self.assertIs(session, clients.get_session(driver_config, DriverConfig.TFA_EXPLORER, 'mainnet:'))
+        self.assertIsNot(session, clients.get_session(driver_config, DriverConfig.TFA_EXPLORER, 'testnet:'))
+
+        factomd = clients.get_factomd(driver_config)
+        self.assertIs(factomd, clients.get_factomd(driver_config))
+        self.assertIsInstance(factomd.session, clients.PooledSession)
+        self.assertEqual(driver_config.rpc_url_testnet, clients.get_factomd(driver_config, testnet=True).host)
+
+    def test_clients_rebuilt_in_new_process(self):
+        driver_config = DriverConfig()
+        session = clients.get_session(driver_config, DriverConfig.TFA_EXPLORER, 'mainnet:')
+        with mock.patch('os.getpid', return_value=-1):
+            self.assertIsNot(session, clients.get_session(driver_config, DriverConfig.TFA_EXPLORER, 'mainnet:'))
+
+    def test_default_timeout(self):
+        session = clients.PooledSession(DriverConfig())
+        with mock.patch('requests.Session.request') as request:
+            session.request('GET', 'http://localhost')
+            self.assertEqual(DriverConfig().http_timeout, request.call_args[1]['timeout'])
+            session.request('GET', 'http://localhost', timeout=1)
+            self.assertEqual(1, request.call_args[1]['timeout'])
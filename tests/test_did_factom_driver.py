@@ -0,0 +1,237 @@
+import unittest
+import did_factom_driver
+import io
+import json
+import threading
+from src import metrics
+from src.cache import NegativeCache, ResolvedDocumentCache
+from concurrent.futures import ThreadPoolExecutor
+from src.models import IdentityNotFoundException
+from src.single_flight import SingleFlight
+from tests.test_chain_state import create_identity
+from unittest import mock
+from wsgiref.util import setup_testing_defaults
+
+
+def call(method, path, body=None, headers=None):
+    """Call the driver's WSGI app, returning the status code, headers and decoded JSON (or plain text) body of the
+    response"""
+    body = b'' if body is None else json.dumps(body).encode()
+    path, _, query_string = path.partition('?')
+    environ = {'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query_string,
+               'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body)}
+    for name, value in (headers or {}).items():
+        environ['HTTP_' + name.upper().replace('-', '_')] = value
+    setup_testing_defaults(environ)
+
+    response = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        response['status'] = int(status.split()[0])
+        response['headers'] = {name.title(): value for name, value in response_headers}
+
+    response_body = b''.join(did_factom_driver.app(environ, start_response))
+    if response['headers'].get('Content-Type', '').startswith('text/plain'):
+        return response['status'], response['headers'], response_body.decode()
+    return response['status'], response['headers'], json.loads(response_body.decode()) if response_body else None
+
+
+class DriverTestCase(unittest.TestCase):
+
+    chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+    missing_chain_id = '00' * 32
+
+    def setUp(self):
+        patcher = mock.patch.object(did_factom_driver.resolver, 'resolved_document_cache', ResolvedDocumentCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(did_factom_driver.resolver, 'negative_cache', NegativeCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(did_factom_driver.resolver, 'get_identity', side_effect=self.get_identity)
+        self.get_identity_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_identity(self, did, chain_id, testnet=False):
+        if chain_id == self.missing_chain_id:
+            raise IdentityNotFoundException()
+        return create_identity(did, chain_id)
+
+
+class TestResolve(DriverTestCase):
+
+    def test_resolve(self):
+        status, _, body = call('GET', '/1.0/identifiers/did:factom:mainnet:' + self.chain_id)
+        self.assertEqual(200, status)
+        self.assertEqual('did:factom:mainnet:' + self.chain_id, body['didDocument']['id'])
+        self.assertEqual('factom', body['methodMetadata']['stage'])
+
+    def test_server_timing(self):
+        _, headers, _ = call('GET', '/1.0/identifiers/did:factom:' + self.chain_id)
+        phases = [phase.split(';')[0] for phase in headers['Server-Timing'].split(', ')]
+        # The mocked resolution only decodes the identity's first entry
+        self.assertEqual(['decode', 'serialize', 'total'], phases)
+        _, headers, _ = call('GET', '/1.0/identifiers/did:factom:' + self.missing_chain_id)
+        self.assertIn('total;dur=', headers['Server-Timing'])
+        self.assertNotIn('Server-Timing', call('GET', '/health')[1])
+
+    def test_not_found(self):
+        status, _, body = call('GET', '/1.0/identifiers/did:factom:' + self.missing_chain_id)
+        self.assertEqual(404, status)
+        self.assertEqual({'errors': {'detail': 'Page not found'}}, body)
+
+    def test_not_found_cached(self):
+        for _ in range(3):
+            self.assertEqual(404, call('GET', '/1.0/identifiers/did:factom:' + self.missing_chain_id)[0])
+        self.assertEqual(1, self.get_identity_mock.call_count)
+        self.assertEqual(2, did_factom_driver.resolver.negative_cache.stats()['hits'])
+
+
+class TestHistoricalResolution(DriverTestCase):
+
+    def test_version_height(self):
+        path = '/1.0/identifiers/did:factom:' + self.chain_id
+        status, headers, body = call('GET', path + '?versionHeight=123456')
+        self.assertEqual(200, status)
+        self.assertEqual(123456, body['methodMetadata']['versionHeight'])
+        self.assertNotEqual(call('GET', path)[1]['Etag'], headers['Etag'])
+        self.assertEqual(1, self.get_identity_mock.call_count)
+
+    def test_before_creation(self):
+        status, _, _ = call('GET', '/1.0/identifiers/did:factom:{}?versionHeight=123455'.format(self.chain_id))
+        self.assertEqual(404, status)
+
+    def test_bad_version_height(self):
+        status, _, body = call('GET', '/1.0/identifiers/did:factom:{}?versionHeight=-1'.format(self.chain_id))
+        self.assertEqual(400, status)
+        self.assertEqual({'errors': {'detail': 'Bad request'}}, body)
+
+
+class TestConditionalGet(DriverTestCase):
+
+    def test_not_modified(self):
+        path = '/1.0/identifiers/did:factom:' + self.chain_id
+        status, headers, _ = call('GET', path)
+        self.assertEqual(200, status)
+        etag = headers['Etag']
+
+        status, headers, body = call('GET', path, headers={'If-None-Match': etag})
+        self.assertEqual(304, status)
+        self.assertEqual(etag, headers['Etag'])
+        self.assertIsNone(body)
+        self.assertEqual(304, call('GET', path, headers={'If-None-Match': '"other", W/' + etag})[0])
+        self.assertEqual(1, self.get_identity_mock.call_count)
+
+    def test_etag_depends_on_did_and_state(self):
+        path = '/1.0/identifiers/did:factom:' + self.chain_id
+        etag = call('GET', path)[1]['Etag']
+
+        status, headers, _ = call('GET', '/1.0/identifiers/did:factom:mainnet:' + self.chain_id,
+                                  headers={'If-None-Match': etag})
+        self.assertEqual(200, status)
+        self.assertNotEqual(etag, headers['Etag'])
+
+        cache = did_factom_driver.resolver.resolved_document_cache
+        cache.get('mainnet:', self.chain_id, 'did:factom:' + self.chain_id).stage = 'anchored'
+        status, headers, body = call('GET', path, headers={'If-None-Match': etag})
+        self.assertEqual(200, status)
+        self.assertEqual('anchored', body['methodMetadata']['stage'])
+        self.assertNotEqual(etag, headers['Etag'])
+
+
+class TestResolveCoalescing(DriverTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Without a result cache, so that only coalescing can save backend calls
+        patcher = mock.patch.object(did_factom_driver.resolver, 'resolved_document_cache',
+                                    ResolvedDocumentCache(max_size=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.flights = SingleFlight()
+        patcher = mock.patch.object(did_factom_driver.resolver, 'resolution_flights', self.flights)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.release = threading.Event()
+
+    def get_identity(self, did, chain_id, testnet=False):
+        self.release.wait()
+        return super().get_identity(did, chain_id, testnet)
+
+    def call_concurrently(self, paths):
+        with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+            futures = [executor.submit(call, 'GET', path) for path in paths]
+            while self.flights.stats()['calls'] < len(paths):
+                threading.Event().wait(0.001)
+            self.release.set()
+            return [f.result() for f in futures]
+
+    def test_shared_resolution(self):
+        dids = ['did:factom:' + self.chain_id, 'did:factom:mainnet:' + self.chain_id] * 4
+        responses = self.call_concurrently(['/1.0/identifiers/' + did for did in dids])
+        self.assertEqual(1, self.get_identity_mock.call_count)
+        for did, (status, _, body) in zip(dids, responses):
+            self.assertEqual(200, status)
+            self.assertEqual(did, body['didDocument']['id'])
+
+    def test_shared_not_found(self):
+        responses = self.call_concurrently(['/1.0/identifiers/did:factom:' + self.missing_chain_id] * 4)
+        self.assertEqual(1, self.get_identity_mock.call_count)
+        self.assertEqual([404] * 4, [status for status, _, _ in responses])
+
+
+class TestResolveBatch(DriverTestCase):
+
+    def test_batch(self):
+        dids = [
+            'did:factom:' + self.chain_id,
+            'did:factom:testnet:' + self.chain_id,
+            'did:factom:' + self.chain_id,
+            'did:factom:' + self.missing_chain_id,
+            'did:example:123'
+        ]
+        status, _, body = call('POST', '/1.0/identifiers/batch', {'identifiers': dids})
+        self.assertEqual(200, status)
+
+        results = body['results']
+        self.assertEqual(4, len(results))
+        self.assertEqual(3, self.get_identity_mock.call_count)
+        self.assertEqual(200, results[dids[0]]['status'])
+        self.assertEqual(dids[0], results[dids[0]]['didDocument']['id'])
+        self.assertEqual(200, results[dids[1]]['status'])
+        self.assertEqual(404, results[dids[3]]['status'])
+        self.assertEqual(400, results[dids[4]]['status'])
+
+    def test_backend_error(self):
+        self.get_identity_mock.side_effect = ValueError('Backend error')
+        with self.assertLogs(level='ERROR') as logs:
+            status, _, body = call('POST', '/1.0/identifiers/batch', {'identifiers': ['did:factom:' + self.chain_id]})
+        self.assertEqual(200, status)
+        self.assertEqual(500, body['results']['did:factom:' + self.chain_id]['status'])
+        self.assertIn('Backend error', logs.output[0])
+
+    def test_bad_request(self):
+        self.assertEqual(400, call('POST', '/1.0/identifiers/batch', ['did:factom:' + self.chain_id])[0])
+        self.assertEqual(400, call('POST', '/1.0/identifiers/batch', {'identifiers': [1, 2]})[0])
+        self.assertEqual(400, call('POST', '/1.0/identifiers/batch')[0])
+
+    def test_too_many_identifiers(self):
+        dids = ['did:factom:{:064x}'.format(i) for i in range(did_factom_driver.driver_config.batch_max_size + 1)]
+        self.assertEqual(413, call('POST', '/1.0/identifiers/batch', {'identifiers': dids})[0])
+
+
+class TestMetrics(DriverTestCase):
+
+    def test_metrics(self):
+        not_found = metrics.HTTP_REQUESTS.get('resolve', 404)
+        resolutions = metrics.HTTP_REQUEST_DURATION.get_count('resolve')
+        call('GET', '/1.0/identifiers/did:factom:' + self.chain_id)
+        call('GET', '/1.0/identifiers/did:factom:' + self.missing_chain_id)
+        self.assertEqual(not_found + 1, metrics.HTTP_REQUESTS.get('resolve', 404))
+        self.assertEqual(resolutions + 2, metrics.HTTP_REQUEST_DURATION.get_count('resolve'))
+
+        status, headers, body = call('GET', '/metrics')
+        self.assertEqual(200, status)
+        self.assertEqual(metrics.CONTENT_TYPE, headers['Content-Type'])
+        self.assertIn('did_factom_http_requests_total{route="resolve",status="404"}', body)
+        self.assertIn('did_factom_cache_hit_ratio{cache="resolvedDocument"}', body)
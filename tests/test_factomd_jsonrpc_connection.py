@@ -0,0 +1,178 @@
+import unittest
+import hashlib
+import identitykeys
+import json
+from src import clients
+from src import consts
+from src import factomd_jsonrpc_connection
+from src.chain_state import ChainStateStore
+from src.config import DriverConfig
+from unittest import mock
+
+
+class FakeResponse:
+
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+
+    def json(self):
+        return self.body
+
+
+class FakeFactomd:
+    """An in-memory factomd that answers the JSON-RPC calls needed to read a chain"""
+
+    def __init__(self, chain_id):
+        self.chain_id = chain_id
+        self.entry_blocks = {}
+        self.entries = {}
+        self.chain_head = factomd_jsonrpc_connection.NULL_BLOCK
+        self.calls = []
+        self.http_requests = 0
+        self.headers = {}
+
+    def add_entry_block(self, height, entries):
+        entry_list = []
+        for external_ids, content in entries:
+            entry_hash = hashlib.sha256(b''.join(external_ids) + content + str(len(self.entries)).encode()).hexdigest()
+            self.entries[entry_hash] = {
+                'chainid': self.chain_id,
+                'extids': [x.hex() for x in external_ids],
+                'content': content.hex()
+            }
+            entry_list.append({'entryhash': entry_hash, 'timestamp': 0})
+        keymr = hashlib.sha256('{}{}'.format(self.chain_head, height).encode()).hexdigest()
+        self.entry_blocks[keymr] = {
+            'header': {'chainid': self.chain_id, 'dbheight': height, 'prevkeymr': self.chain_head},
+            'entrylist': entry_list
+        }
+        self.chain_head = keymr
+
+    def request(self, method, url, json=None, **kwargs):
+        self.http_requests += 1
+        if isinstance(json, list):
+            return FakeResponse([self.handle(call) for call in json])
+        response = self.handle(json)
+        return FakeResponse(response, status_code=404 if 'error' in response else 200)
+
+    def handle(self, call):
+        self.calls.append(call)
+        params = call.get('params', {})
+        if call['method'] == 'chain-head':
+            if params['chainid'] != self.chain_id:
+                error = {'code': -32009, 'message': 'Missing Chain Head'}
+                return {'jsonrpc': '2.0', 'id': call['id'], 'error': error}
+            result = {'chainhead': self.chain_head, 'chaininprocesslist': False}
+        elif call['method'] == 'entry-block':
+            result = self.entry_blocks[params['keymr']]
+        elif call['method'] == 'entry':
+            result = self.entries[params['hash']]
+        else:
+            raise NotImplementedError(call['method'])
+        return {'jsonrpc': '2.0', 'id': call['id'], 'result': result}
+
+
+class TestGetIdentity(unittest.TestCase):
+
+    did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+    chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+
+    def setUp(self):
+        self.key_pairs = [identitykeys.generate_key_pair() for _ in range(3)]
+        public_keys = [pub.to_string() for _, pub in self.key_pairs]
+        content = json.dumps({'version': 1, 'keys': public_keys}, separators=(',', ':')).encode()
+        self.factomd = FakeFactomd(self.chain_id)
+        self.factomd.add_entry_block(1000, [([consts.IDENTITY_CHAIN_TAG, b'Test', b'v1'], content)])
+        patcher = mock.patch('src.clients.PooledSession', return_value=self.factomd)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(clients.reset)
+
+    def replace_key(self, old_index, signer_index):
+        _, old_pub = self.key_pairs[old_index]
+        signer_priv, signer_pub = self.key_pairs[signer_index]
+        new_priv, new_pub = identitykeys.generate_key_pair()
+        self.key_pairs[old_index] = (new_priv, new_pub)
+        message = self.chain_id.encode() + old_pub.to_string().encode() + new_pub.to_string().encode()
+        external_ids = [
+            consts.KEY_REPLACEMENT_TAG,
+            old_pub.to_string().encode(),
+            new_pub.to_string().encode(),
+            signer_priv.sign(message),
+            signer_pub.to_string().encode()
+        ]
+        return external_ids, b''
+
+    def test_not_found(self):
+        with self.assertRaises(factomd_jsonrpc_connection.models.ChainNotFoundException):
+            factomd_jsonrpc_connection.get_identity(DriverConfig(), 'did:factom:' + '00' * 32, '00' * 32)
+
+    def test_key_replacements(self):
+        self.factomd.add_entry_block(1001, [self.replace_key(2, 1), ([b'spam'], b'spam')])
+        self.factomd.add_entry_block(1002, [self.replace_key(1, 0)])
+
+        identity = factomd_jsonrpc_connection.get_identity(DriverConfig(), self.did, self.chain_id)
+        active_keys = {pub.to_string() for _, pub in self.key_pairs}
+        self.assertEqual(active_keys, set(identity.active_keys))
+        self.assertEqual(5, len(identity.all_keys))
+
+    def test_invalid_key_replacement_encoding(self):
+        junk = [consts.KEY_REPLACEMENT_TAG, b'\xff', b'\xff', b'\xff', b'\xff']
+        self.factomd.add_entry_block(1001, [(junk, b''), self.replace_key(2, 1)])
+
+        identity = factomd_jsonrpc_connection.get_identity(DriverConfig(), self.did, self.chain_id)
+        active_keys = {pub.to_string() for _, pub in self.key_pairs}
+        self.assertEqual(active_keys, set(identity.active_keys))
+        self.assertEqual(4, len(identity.all_keys))
+
+    def test_batched_entries(self):
+        for height in range(1001, 1011):
+            self.factomd.add_entry_block(height, [([b'spam'], b'spam') for _ in range(9)] + [self.replace_key(2, 1)])
+
+        driver_config = DriverConfig()
+        driver_config.factomd_batch_size = 30
+        identity = factomd_jsonrpc_connection.get_identity(driver_config, self.did, self.chain_id)
+        active_keys = {pub.to_string() for _, pub in self.key_pairs}
+        self.assertEqual(active_keys, set(identity.active_keys))
+        self.assertEqual(13, len(identity.all_keys))
+
+        # 1 chain-head, 11 entry-block and ceil(101 / 30) batches of entries
+        self.assertEqual(1 + 11 + 4, self.factomd.http_requests)
+        self.assertEqual(1 + 11 + 101, len(self.factomd.calls))
+
+    def test_resume_from_cursor(self):
+        self.factomd.add_entry_block(1001, [self.replace_key(2, 1), ([b'spam'], b'spam')])
+        store = ChainStateStore()
+        factomd_jsonrpc_connection.get_identity(DriverConfig(), self.did, self.chain_id, state_store=store)
+
+        # Nothing new on the chain: only the chain head is fetched
+        self.factomd.calls.clear()
+        self.factomd.http_requests = 0
+        identity = factomd_jsonrpc_connection.get_identity(DriverConfig(), self.did, self.chain_id, state_store=store)
+        self.assertEqual(['chain-head'], [c['method'] for c in self.factomd.calls])
+        self.assertEqual(1, self.factomd.http_requests)
+        self.assertEqual(4, len(identity.all_keys))
+
+        # Only the new entry block and its entries are fetched
+        self.factomd.add_entry_block(1002, [self.replace_key(1, 0)])
+        self.factomd.calls.clear()
+        identity = factomd_jsonrpc_connection.get_identity(DriverConfig(), self.did, self.chain_id, state_store=store)
+        self.assertEqual(['chain-head', 'entry-block', 'entry'], [c['method'] for c in self.factomd.calls])
+        active_keys = {pub.to_string() for _, pub in self.key_pairs}
+        self.assertEqual(active_keys, set(identity.active_keys))
+        self.assertEqual(5, len(identity.all_keys))
+
+    def test_read_entries_drops_other_entries(self):
+        self.factomd.add_entry_block(1001, [([b'spam'], b'spam' * 1000), self.replace_key(2, 1)])
+        factomd = clients.get_factomd(DriverConfig())
+        entry_blocks = factomd_jsonrpc_connection._get_entry_blocks(factomd, self.factomd.chain_head)
+        entries = list(factomd_jsonrpc_connection._read_entries(factomd, entry_blocks, include_first=True))
+
+        self.assertEqual([1000, 1001, 1001], [e.height for e in entries])
+        self.assertEqual(consts.IDENTITY_CHAIN_TAG, entries[0].external_ids[0])
+        self.assertIsNotNone(entries[0].content)
+        self.assertIsNone(entries[1].external_ids)
+        self.assertIsNone(entries[1].content)
+        self.assertEqual(consts.KEY_REPLACEMENT_TAG, entries[2].external_ids[0])
+        self.assertIsNone(entries[2].content)
@@ -0,0 +1,187 @@
+import unittest
+import asyncio
+import threading
+import time
+from src import consts
+from src import failover
+from src import metrics
+from src.config import DriverConfig
+from src.health import BackendHealthRegistry
+from src.models import IdentityNotFoundException
+from tests.test_chain_state import create_identity
+from tests.test_health import FakeClock
+
+
+class FakeBackends:
+    """Backends that answer after a delay, with an identity or an exception"""
+
+    def __init__(self, **behaviors):
+        self.behaviors = behaviors
+        self.started = []
+        self.lock = threading.Lock()
+
+    def resolve_with(self, backend, deadline=None):
+        with self.lock:
+            self.started.append(backend)
+        delay, result = self.behaviors[backend]
+        time.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def resolve_with_async(self, backend, deadline=None):
+        self.started.append(backend)
+        delay, result = self.behaviors[backend]
+        await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def create_driver_config(hedge_delay, resolve_timeout=0):
+    driver_config = DriverConfig()
+    driver_config.hedge_delay = hedge_delay
+    driver_config.resolve_timeout = resolve_timeout
+    return driver_config
+
+
+class TestResolve(unittest.TestCase):
+
+    chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+    network = consts.NETWORK_MAINNET
+
+    def setUp(self):
+        self.identity = create_identity('did:factom:' + self.chain_id, self.chain_id)
+
+    def test_get_backends(self):
+        driver_config = DriverConfig()
+        driver_config.factom_connection = DriverConfig.HARMONY
+        self.assertEqual([DriverConfig.HARMONY], failover.get_backends(driver_config))
+        self.assertEqual([DriverConfig.FACTOMD], failover.get_backends(driver_config, testnet=True))
+        driver_config.factom_connections = [DriverConfig.HARMONY, DriverConfig.TFA_EXPLORER]
+        self.assertEqual([DriverConfig.TFA_EXPLORER], failover.get_backends(driver_config, testnet=True))
+
+    def test_hedged(self):
+        backends = FakeBackends(factomd=(1, ValueError()), tfa_explorer=(0, self.identity))
+        start = time.perf_counter()
+        identity = failover.resolve(create_driver_config(0.05), self.network, ['factomd', 'tfa_explorer'],
+                                    backends.resolve_with)
+        self.assertIs(self.identity, identity)
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_failover(self):
+        backends = FakeBackends(factomd=(0, ValueError()), tfa_explorer=(0, ValueError()), harmony=(0, self.identity))
+        identity = failover.resolve(create_driver_config(0), self.network, ['factomd', 'tfa_explorer', 'harmony'],
+                                    backends.resolve_with)
+        self.assertIs(self.identity, identity)
+        self.assertEqual(['factomd', 'tfa_explorer', 'harmony'], backends.started)
+
+    def test_not_found_is_final(self):
+        backends = FakeBackends(factomd=(0, IdentityNotFoundException()), tfa_explorer=(0, self.identity))
+        with self.assertRaises(IdentityNotFoundException):
+            failover.resolve(create_driver_config(1), self.network, ['factomd', 'tfa_explorer'], backends.resolve_with)
+        self.assertEqual(['factomd'], backends.started)
+
+    def test_all_failed(self):
+        backends = FakeBackends(factomd=(0, ValueError()), tfa_explorer=(0, KeyError()))
+        with self.assertRaises(KeyError):
+            failover.resolve(create_driver_config(1), self.network, ['factomd', 'tfa_explorer'], backends.resolve_with)
+
+    def test_deadline(self):
+        backends = FakeBackends(factomd=(1, self.identity))
+        start = time.perf_counter()
+        with self.assertRaises(failover.ResolutionTimeoutException):
+            failover.resolve(create_driver_config(0, resolve_timeout=0.05), self.network, ['factomd'],
+                             backends.resolve_with)
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_routes_to_healthiest(self):
+        driver_config = create_driver_config(0)
+        health = BackendHealthRegistry(driver_config)
+        for _ in range(10):
+            health.get('factomd', self.network).record(0.1, failed=True)
+        backends = FakeBackends(factomd=(0, self.identity), tfa_explorer=(0, self.identity))
+        failover.resolve(driver_config, self.network, ['factomd', 'tfa_explorer'], backends.resolve_with,
+                         health=health)
+        self.assertEqual(['tfa_explorer'], backends.started)
+
+        with self.assertRaises(failover.BackendUnavailableException):
+            failover.resolve(driver_config, self.network, ['factomd'], backends.resolve_with, health=health)
+
+    def test_trial(self):
+        driver_config = create_driver_config(0)
+        driver_config.circuit_breaker_open_duration = 0
+        health = BackendHealthRegistry(driver_config)
+        health.get('factomd', self.network).record(0.1, failed=False)
+        for _ in range(driver_config.circuit_breaker_window):
+            health.get('tfa_explorer', self.network).record(0.1, failed=True)
+        self.assertTrue(health.get('tfa_explorer', self.network).is_open())
+
+        # The trial goes to TFA even though factomd is healthier, and closes the circuit
+        backends = FakeBackends(factomd=(0, self.identity), tfa_explorer=(0, self.identity))
+        failover.resolve(driver_config, self.network, ['factomd', 'tfa_explorer'], backends.resolve_with,
+                         health=health)
+        self.assertEqual(['tfa_explorer'], backends.started)
+        self.assertFalse(health.get('tfa_explorer', self.network).is_open())
+
+    def test_trial_claimed(self):
+        class ConcurrentRegistry(BackendHealthRegistry):
+            def route(self, network, backends):
+                routed = super().route(network, backends)
+                # Another resolution claims the trial after this one was routed
+                self.get('tfa_explorer', network).allow()
+                return routed
+
+        driver_config = create_driver_config(0)
+        driver_config.circuit_breaker_open_duration = 30
+        health = ConcurrentRegistry(driver_config)
+        clock = FakeClock()
+        health.get('tfa_explorer', self.network).clock = clock
+        for _ in range(driver_config.circuit_breaker_window):
+            health.get('tfa_explorer', self.network).record(0.1, failed=True)
+        clock.now = 30
+
+        backends = FakeBackends(factomd=(0, self.identity), tfa_explorer=(0, self.identity))
+        failover.resolve(driver_config, self.network, ['factomd', 'tfa_explorer'], backends.resolve_with,
+                         health=health)
+        self.assertEqual(['factomd'], backends.started)
+
+    def test_cap_timeout(self):
+        self.assertEqual((5, 30), failover.cap_timeout((5, 30)))
+        with metrics.resolve_scope('factomd', self.chain_id, deadline=time.monotonic() + 10):
+            connect_timeout, read_timeout = failover.cap_timeout((5, 30))
+            self.assertEqual(5, connect_timeout)
+            self.assertLessEqual(read_timeout, 10)
+        with self.assertRaises(failover.ResolutionTimeoutException):
+            with metrics.resolve_scope('factomd', self.chain_id, deadline=time.monotonic() - 1):
+                failover.cap_timeout((5, 30))
+
+
+class TestResolveAsync(unittest.IsolatedAsyncioTestCase):
+
+    chain_id = TestResolve.chain_id
+    network = TestResolve.network
+
+    async def test_hedged(self):
+        identity = create_identity('did:factom:' + self.chain_id, self.chain_id)
+        backends = FakeBackends(factomd=(10, ValueError()), tfa_explorer=(0, identity))
+        result = await asyncio.wait_for(failover.resolve_async(create_driver_config(0.05), self.network,
+                                                               ['factomd', 'tfa_explorer'],
+                                                               backends.resolve_with_async), timeout=1)
+        self.assertIs(identity, result)
+
+    async def test_failover(self):
+        backends = FakeBackends(factomd=(0, ValueError()), tfa_explorer=(0, IdentityNotFoundException()))
+        with self.assertRaises(IdentityNotFoundException):
+            await failover.resolve_async(create_driver_config(0), self.network, ['factomd', 'tfa_explorer'],
+                                         backends.resolve_with_async)
+        self.assertEqual(['factomd', 'tfa_explorer'], backends.started)
+
+    async def test_deadline(self):
+        driver_config = create_driver_config(0, resolve_timeout=0.05)
+        health = BackendHealthRegistry(driver_config)
+        backends = FakeBackends(factomd=(10, ValueError()))
+        with self.assertRaises(failover.ResolutionTimeoutException):
+            await asyncio.wait_for(failover.resolve_async(driver_config, self.network, ['factomd'],
+                                                          backends.resolve_with_async, health=health), timeout=1)
+        self.assertEqual(1.0, health.get('factomd', self.network).error_rate())
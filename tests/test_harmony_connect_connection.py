@@ -0,0 +1,198 @@
+import unittest
+import base64
+import hashlib
+import identitykeys
+import json
+import threading
+import time
+from requests import HTTPError
+from src import clients
+from src import consts
+from src import harmony_connect_connection
+from src.chain_state import ChainStateStore
+from src.config import DriverConfig
+from types import SimpleNamespace
+from unittest import mock
+
+
+class FakeEntriesApi:
+    """An in-memory Harmony Connect entries API, whose entry lookups complete in a random order"""
+
+    def __init__(self, chain_id):
+        self.chain_id = chain_id
+        self.entries = []
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def add_entry(self, external_ids, content, stage='factom', height=1000):
+        entry_hash = hashlib.sha256(b''.join(external_ids) + content + str(len(self.entries)).encode()).hexdigest()
+        self.entries.append(SimpleNamespace(
+            entry_hash=entry_hash,
+            external_ids=[base64.b64encode(x).decode() for x in external_ids],
+            content=base64.b64encode(content).decode(),
+            stage=stage,
+            dblock=None if stage == 'replicated' else SimpleNamespace(height=height)
+        ))
+
+    def _record(self, call):
+        with self.lock:
+            self.calls.append(call)
+
+    def get_first_entry(self, chain_id, **kwargs):
+        self._record('get_first_entry')
+        return SimpleNamespace(data=self.entries[0])
+
+    def get_entries_by_chain_id(self, chain_id, limit=15, offset=0, **kwargs):
+        self._record('get_entries_by_chain_id')
+        data = [SimpleNamespace(entry_hash=e.entry_hash) for e in self.entries[offset:offset + limit]]
+        return SimpleNamespace(data=data, offset=offset, limit=limit, count=len(self.entries))
+
+    def get_entry_by_hash(self, chain_id, entry_hash, **kwargs):
+        self._record('get_entry_by_hash')
+        time.sleep(int(entry_hash[:2], 16) / 100000)
+        return SimpleNamespace(data=next(e for e in self.entries if e.entry_hash == entry_hash))
+
+
+class TestGetIdentityWithoutCache(unittest.TestCase):
+
+    did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+    chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+
+    def setUp(self):
+        self.key_pairs = [identitykeys.generate_key_pair() for _ in range(3)]
+        public_keys = [pub.to_string() for _, pub in self.key_pairs]
+        content = json.dumps({'version': 1, 'keys': public_keys}, separators=(',', ':')).encode()
+        self.entries_api = FakeEntriesApi(self.chain_id)
+        self.entries_api.add_entry([consts.IDENTITY_CHAIN_TAG, b'Test', b'v1'], content)
+        patcher = mock.patch('harmony_connect_client.EntriesApi', return_value=self.entries_api)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(clients.reset)
+
+    def replace_key(self, old_index, signer_index):
+        _, old_pub = self.key_pairs[old_index]
+        signer_priv, signer_pub = self.key_pairs[signer_index]
+        new_priv, new_pub = identitykeys.generate_key_pair()
+        self.key_pairs[old_index] = (new_priv, new_pub)
+        message = self.chain_id.encode() + old_pub.to_string().encode() + new_pub.to_string().encode()
+        return [
+            consts.KEY_REPLACEMENT_TAG,
+            old_pub.to_string().encode(),
+            new_pub.to_string().encode(),
+            signer_priv.sign(message),
+            signer_pub.to_string().encode()
+        ], b''
+
+    def test_replacements_applied_in_order(self):
+        # Each key replacement depends on the previous one, across several pages
+        for i in range(60):
+            if i % 3 == 0:
+                self.entries_api.add_entry([b'spam'], b'spam', height=1000 + i)
+            self.entries_api.add_entry(*self.replace_key(2, 2), height=1000 + i)
+
+        identity = harmony_connect_connection.get_identity(DriverConfig(), self.did, self.chain_id)
+        active_keys = {pub.to_string() for _, pub in self.key_pairs}
+        self.assertEqual(active_keys, set(identity.active_keys))
+        self.assertEqual(63, len(identity.all_keys))
+
+    def test_stops_at_replicated(self):
+        self.entries_api.add_entry(*self.replace_key(2, 1), height=1001)
+        active_keys = {pub.to_string() for _, pub in self.key_pairs}
+        self.entries_api.add_entry(*self.replace_key(1, 0), stage='replicated')
+        self.entries_api.add_entry(*self.replace_key(0, 0), height=1002)
+
+        store = ChainStateStore()
+        identity = harmony_connect_connection.get_identity(DriverConfig(), self.did, self.chain_id, state_store=store)
+        self.assertEqual(active_keys, set(identity.active_keys))
+        _, cursor = store.get(consts.NETWORK_MAINNET, self.chain_id, self.did)
+        self.assertEqual(2, cursor.offset)
+
+    def test_resume_from_cursor(self):
+        self.entries_api.add_entry(*self.replace_key(2, 1), height=1001)
+        store = ChainStateStore()
+        harmony_connect_connection.get_identity(DriverConfig(), self.did, self.chain_id, state_store=store)
+
+        self.entries_api.add_entry(*self.replace_key(1, 0), height=1002)
+        self.entries_api.calls.clear()
+        identity = harmony_connect_connection.get_identity(DriverConfig(), self.did, self.chain_id, state_store=store)
+        self.assertEqual(['get_first_entry', 'get_entries_by_chain_id', 'get_entry_by_hash'], self.entries_api.calls)
+        active_keys = {pub.to_string() for _, pub in self.key_pairs}
+        self.assertEqual(active_keys, set(identity.active_keys))
+
+
+class FakeIdentitiesApi:
+    """An in-memory Harmony Connect identities API (as wrapped by the Factom SDK), serving cached identities"""
+
+    def __init__(self):
+        self.identities = {}
+        self.keys = SimpleNamespace(list=self.list_keys)
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def get(self, chain_id):
+        with self.lock:
+            self.calls.append(('get', chain_id))
+        if chain_id not in self.identities:
+            raise HTTPError(response=SimpleNamespace(status_code=404))
+        return {'data': self.identities[chain_id]['identity']}
+
+    def list_keys(self, chain_id, limit=15, offset=0):
+        with self.lock:
+            self.calls.append(('list', offset))
+        if chain_id not in self.identities:
+            raise HTTPError(response=SimpleNamespace(status_code=404))
+        keys = self.identities[chain_id]['keys']
+        return {'data': keys[offset:offset + limit], 'offset': offset, 'limit': limit, 'count': len(keys)}
+
+
+class TestGetIdentityWithCache(unittest.TestCase):
+
+    did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+    chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+
+    def setUp(self):
+        self.driver_config = DriverConfig()
+        self.driver_config.harmony_caching_enabled = True
+        self.driver_config.harmony_key_page_size = 10
+
+        # Three priorities, each with a history of replaced keys, listed by Harmony in no particular order
+        keys = []
+        for i in range(30):
+            key = identitykeys.generate_key_pair()[1].to_string()
+            keys.append({'key': key, 'priority': i % 3, 'activated_height': 1000 + i,
+                         'retired_height': None if i >= 27 else 1003 + i, 'entry_hash': '{:064x}'.format(i)})
+        keys.append({'key': identitykeys.generate_key_pair()[1].to_string(), 'priority': 0, 'activated_height': None,
+                     'retired_height': None, 'entry_hash': 'ff' * 32})
+        keys.reverse()
+        self.identities_api = FakeIdentitiesApi()
+        self.identities_api.identities[self.chain_id] = {
+            'identity': {
+                'version': 1,
+                'names': ['Test', 'v1'],
+                'created_height': 1000,
+                'stage': 'factom',
+                'active_keys': [k for k in keys if k['activated_height'] is not None and k['retired_height'] is None]
+            },
+            'keys': keys
+        }
+        patcher = mock.patch('src.clients.get_harmony_sdk',
+                             return_value=SimpleNamespace(identities=self.identities_api))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_key_history(self):
+        identity = harmony_connect_connection.get_identity(self.driver_config, self.did, self.chain_id)
+        self.assertEqual(3, len(identity.active_keys))
+        self.assertEqual(30, len(identity.all_keys))
+        order = [(k.priority, k.activated_height) for k in identity.all_keys.values()]
+        self.assertEqual(sorted(order), order)
+        self.assertEqual(['{}#key-{}'.format(self.did, i) for i in range(3)],
+                         sorted(k['id'] for k in identity.get_did_document()['publicKey']))
+
+        self.assertEqual(5, len(self.identities_api.calls))
+        self.assertEqual({('get', self.chain_id), ('list', 0)}, set(self.identities_api.calls[:2]))
+        self.assertEqual([10, 20, 30], sorted(offset for call, offset in self.identities_api.calls[2:]))
+
+    def test_not_found(self):
+        with self.assertRaises(harmony_connect_connection.models.IdentityNotFoundException):
+            harmony_connect_connection.get_identity(self.driver_config, 'did:factom:' + '00' * 32, '00' * 32)
@@ -0,0 +1,107 @@
+import unittest
+from src import consts
+from src.config import DriverConfig
+from src.health import BackendHealth, BackendHealthRegistry
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestBackendHealth(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.health = BackendHealth(window=4, error_threshold=0.5, open_duration=30, clock=self.clock)
+
+    def test_opens_on_errors(self):
+        self.health.record(0.1, failed=True)
+        self.assertFalse(self.health.is_open())  # Too few resolutions to tell
+        self.health.record(0.1, failed=False)
+        self.assertTrue(self.health.is_open())
+        self.assertFalse(self.health.allow())
+
+    def test_trial(self):
+        self.health.record(0.1, failed=True)
+        self.health.record(0.1, failed=True)
+        self.clock.now = 30
+        self.assertTrue(self.health.allow())
+        self.assertFalse(self.health.allow())  # A single trial at a time
+
+        self.health.record(0.1, failed=True)
+        self.assertTrue(self.health.is_open())
+        self.clock.now = 60
+        self.assertTrue(self.health.allow())
+        self.health.record(0.1, failed=False)
+        self.assertFalse(self.health.is_open())
+        self.assertEqual(0, self.health.error_rate())
+
+    def test_available(self):
+        self.health.record(0.1, failed=True)
+        self.health.record(0.1, failed=True)
+        self.assertFalse(self.health.available())
+        self.clock.now = 30
+        self.assertTrue(self.health.available())
+        self.assertTrue(self.health.available())  # Doesn't claim the trial
+        self.assertTrue(self.health.trial_due())
+        self.assertTrue(self.health.allow())
+        self.assertFalse(self.health.available())
+
+    def test_disabled(self):
+        health = BackendHealth(window=4, error_threshold=0)
+        for _ in range(4):
+            health.record(0.1, failed=True)
+        self.assertFalse(health.is_open())
+
+    def test_latency(self):
+        self.health.record(1.0, failed=False)
+        self.health.record(2.0, failed=False)
+        self.assertAlmostEqual(1.2, self.health.latency)
+        self.assertAlmostEqual(1.2, self.health.score(10))
+        self.health.record(5.0, failed=True)  # Failures don't count towards the latency
+        self.assertAlmostEqual(1.2 + 10 / 3, self.health.score(10))
+
+
+class TestBackendHealthRegistry(unittest.TestCase):
+
+    network = consts.NETWORK_MAINNET
+
+    def setUp(self):
+        self.registry = BackendHealthRegistry(DriverConfig())
+
+    def test_route(self):
+        backends = [DriverConfig.HARMONY, DriverConfig.FACTOMD, DriverConfig.TFA_EXPLORER]
+        self.assertEqual(backends, self.registry.route(self.network, backends))
+
+        self.registry.get(DriverConfig.HARMONY, self.network).record(2.0, failed=False)
+        self.registry.get(DriverConfig.FACTOMD, self.network).record(0.5, failed=False)
+        self.registry.get(DriverConfig.TFA_EXPLORER, self.network).record(0.1, failed=False)
+        self.registry.get(DriverConfig.TFA_EXPLORER, self.network).record(0.1, failed=True)
+        self.assertEqual([DriverConfig.FACTOMD, DriverConfig.HARMONY, DriverConfig.TFA_EXPLORER],
+                         self.registry.route(self.network, backends))
+        # Networks are scored separately
+        self.assertEqual(backends, self.registry.route(consts.NETWORK_TESTNET, backends))
+
+    def test_route_trial_first(self):
+        driver_config = DriverConfig()
+        driver_config.circuit_breaker_open_duration = 0
+        registry = BackendHealthRegistry(driver_config)
+        backends = [DriverConfig.FACTOMD, DriverConfig.TFA_EXPLORER]
+        registry.get(DriverConfig.FACTOMD, self.network).record(0.5, failed=False)
+        for _ in range(driver_config.circuit_breaker_window):
+            registry.get(DriverConfig.TFA_EXPLORER, self.network).record(0.1, failed=True)
+
+        # The trial comes first although TFA's score is the worst, and routing doesn't claim it
+        for _ in range(2):
+            self.assertEqual([DriverConfig.TFA_EXPLORER, DriverConfig.FACTOMD], registry.route(self.network, backends))
+
+    def test_stats(self):
+        self.registry.get(DriverConfig.FACTOMD, self.network).record(0.5, failed=False)
+        self.assertEqual([{'backend': 'factomd', 'network': 'mainnet', 'latency': 0.5, 'errorRate': 0.0,
+                           'circuitOpen': False}], self.registry.stats())
+        self.assertEqual(3, len(self.registry.collect()))
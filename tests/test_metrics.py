@@ -0,0 +1,122 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from src import metrics
+from src.models import ChainNotFoundException, IdentityNotFoundException
+from src.single_flight import SingleFlight
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('test_total', 'A test counter', ('route', 'status'))
+        counter.inc('resolve', 200)
+        counter.inc('resolve', 200, amount=2)
+        counter.inc('say "hi"', 404)
+        self.assertEqual(3, counter.get('resolve', 200))
+        self.assertEqual([
+            '# HELP test_total A test counter',
+            '# TYPE test_total counter',
+            'test_total{route="resolve",status="200"} 3',
+            'test_total{route="say \\"hi\\"",status="404"} 1'
+        ], self.registry.render().splitlines())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('test_seconds', 'A test histogram', ('backend',), buckets=(0.1, 1))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, 'factomd')
+        self.assertEqual(3, histogram.get_count('factomd'))
+        self.assertEqual([
+            '# HELP test_seconds A test histogram',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{backend="factomd",le="0.1"} 1',
+            'test_seconds_bucket{backend="factomd",le="1"} 2',
+            'test_seconds_bucket{backend="factomd",le="+Inf"} 3',
+            'test_seconds_sum{backend="factomd"} 5.55',
+            'test_seconds_count{backend="factomd"} 3'
+        ], self.registry.render().splitlines())
+
+    def test_collector(self):
+        self.registry.set_collector('test', lambda: [('test_size', 'gauge', 'A test gauge', [(('a',), 1)], ('cache',))])
+        self.registry.set_collector('test', lambda: [('test_size', 'gauge', 'A test gauge', [(('b',), 2)], ('cache',))])
+        self.assertEqual('test_size{cache="b"} 2', self.registry.render().splitlines()[-1])
+
+    def test_resolutions(self):
+        flights = SingleFlight()
+        flights.calls, flights.coalesced = 8, 7
+        collectors = dict(metrics.REGISTRY.collectors)
+        self.addCleanup(metrics.REGISTRY.collectors.update, collectors)
+        metrics.set_cache_collector({}, flights)
+        lines = metrics.REGISTRY.render().splitlines()
+        # Coalesced resolutions don't count as resolutions made from the backends
+        self.assertIn('did_factom_resolutions_total 1', lines)
+        self.assertIn('did_factom_resolutions_coalesced_total 7', lines)
+
+
+class TestResolveScope(unittest.TestCase):
+
+    def test_work_attributed_across_threads(self):
+        def call_backend():
+            with metrics.backend_call('test'):
+                metrics.count_entries('test', 10)
+
+        with metrics.resolve_scope('test', '00' * 32) as scope:
+            call_backend()
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [executor.submit(metrics.propagate(call_backend)) for _ in range(4)]
+                [f.result() for f in futures]
+            # Work started without propagating the scope is not attributed to it
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(call_backend).result()
+        self.assertEqual(5, scope.backend_calls)
+        self.assertEqual(50, scope.entries_scanned)
+        self.assertIsNone(metrics.current_scope())
+
+    def test_outcome(self):
+        found = metrics.RESOLVE_DURATION.get_count('test', 'found')
+        not_found = metrics.RESOLVE_DURATION.get_count('test', 'not_found')
+        with metrics.resolve_scope('test', '00' * 32):
+            pass
+        with self.assertRaises(IdentityNotFoundException):
+            with metrics.resolve_scope('test', '00' * 32):
+                raise IdentityNotFoundException()
+        with self.assertRaises(ChainNotFoundException):
+            with metrics.resolve_scope('test', '00' * 32):
+                raise ChainNotFoundException()
+        self.assertEqual(found + 1, metrics.RESOLVE_DURATION.get_count('test', 'found'))
+        self.assertEqual(not_found + 2, metrics.RESOLVE_DURATION.get_count('test', 'not_found'))
+
+    def test_slow_resolutions_logged(self):
+        with self.assertLogs('src.metrics', level='WARNING') as logs:
+            with metrics.resolve_scope('test', 'ab' * 32, slow_threshold=0):
+                pass
+        self.assertIn('ab' * 32, logs.output[0])
+
+
+class TestRequestTiming(unittest.TestCase):
+
+    def test_phases(self):
+        def call_backend():
+            with metrics.backend_call('test'):
+                with metrics.timed('decode'):
+                    pass
+
+        with metrics.request_timing() as timing:
+            call_backend()
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                [f.result() for f in [executor.submit(metrics.propagate(call_backend)) for _ in range(2)]]
+            with metrics.timed('serialize'):
+                pass
+        self.assertEqual(3, timing.get('backend-test')[1])
+        self.assertEqual(3, timing.get('decode')[1])
+        phases = [phase.split(';')[0] for phase in timing.header().split(', ')]
+        self.assertEqual(['decode', 'backend-test', 'serialize', 'total'], phases)
+        self.assertIn('desc="3 calls"', timing.header())
+        self.assertIsNone(metrics.current_timing())
+
+    def test_untimed(self):
+        with metrics.timed('decode'):
+            pass
+        self.assertIsNone(metrics.current_timing())
@@ -29,7 +29,7 @@ class TestIdentityCreation(unittest.TestCase):
         for k in public_keys:
             self.assertIn(k, identity.active_keys)
             self.assertIn(k, identity.all_keys)
-        for k in identity.active_keys.values():
+        for k in identity.get_did_document()['publicKey']:
             self.assertIn('id', k)
             self.assertIn('controller', k)
             self.assertIn('type', k)
@@ -240,3 +240,94 @@ class TestIdentityKeyReplacement(unittest.TestCase):
         ]
         result = identity.process_key_replacement(entry_hash=b'\0' * 32, external_ids=external_ids, height=123457)
         self.assertFalse(result)
+
+
+class TestIdentityKeyReplacementBatch(unittest.TestCase):
+
+    def test_batch_applied_in_order(self):
+        did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        external_ids = [consts.IDENTITY_CHAIN_TAG, b'Test', b'v1']
+        key_pairs = [identitykeys.generate_key_pair() for _ in range(3)]
+        public_keys = [pub.to_string() for _, pub in key_pairs]
+        content = {'version': 1, 'keys': public_keys}
+
+        identity = Identity(did, chain_id)
+        identity.process_creation(
+            entry_hash=b'\0' * 32,
+            external_ids=external_ids,
+            content=json.dumps(content, separators=(',', ':')).encode(),
+            stage='factom',
+            height=123456
+        )
+
+        # Each replacement is signed by the key activated by the previous one, with spam and a replayed entry between
+        entries = []
+        signer_priv, signer_pub = key_pairs[-1]
+        for i in range(3):
+            new_priv, new_pub = identitykeys.generate_key_pair()
+            message = chain_id.encode() + signer_pub.to_string().encode() + new_pub.to_string().encode()
+            replacement = [
+                b'ReplaceKey',
+                signer_pub.to_string().encode(),
+                new_pub.to_string().encode(),
+                signer_priv.sign(message),
+                signer_pub.to_string().encode()
+            ]
+            entries.append((b'\1' * 32, replacement, 123457 + i))
+            entries.append((b'\2' * 32, replacement, 123457 + i))
+            entries.append((b'\3' * 32, [b'BAD', b'\xff', b'BAD', b'BAD', b'BAD'], 123457 + i))
+            signer_priv, signer_pub = new_priv, new_pub
+
+        etag = identity.get_etag()
+        applied = identity.process_key_replacements(entries)
+        self.assertEqual(3, applied)
+        self.assertEqual(b'\1' * 32, identity.last_entry_hash)
+        self.assertNotEqual(etag, identity.get_etag())
+        self.assertIn(signer_pub.to_string(), identity.active_keys)
+        self.assertEqual(123459, identity.active_keys[signer_pub.to_string()].activated_height)
+        self.assertEqual(6, len(identity.all_keys))
+
+    def test_at_height(self):
+        did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+        key_pairs = [identitykeys.generate_key_pair() for _ in range(3)]
+        content = {'version': 1, 'keys': [pub.to_string() for _, pub in key_pairs]}
+        identity = Identity(did, chain_id)
+        identity.process_creation(b'\0' * 32, [consts.IDENTITY_CHAIN_TAG, b'Test'],
+                                  json.dumps(content).encode(), stage='factom', height=100)
+
+        # The lowest priority key is replaced at heights 101, 102 and 103
+        entries = []
+        signer_priv, signer_pub = key_pairs[-1]
+        for i in range(3):
+            new_priv, new_pub = identitykeys.generate_key_pair()
+            message = chain_id.encode() + signer_pub.to_string().encode() + new_pub.to_string().encode()
+            entries.append((bytes([i + 1]) * 32, [b'ReplaceKey', signer_pub.to_string().encode(),
+                                                  new_pub.to_string().encode(), signer_priv.sign(message),
+                                                  signer_pub.to_string().encode()], 101 + i))
+            signer_priv, signer_pub = new_priv, new_pub
+        identity.process_key_replacements(entries)
+
+        with self.assertRaises(IdentityNotFoundException):
+            identity.at_height(99)
+
+        created = identity.at_height(100)
+        self.assertEqual(3, len(created.active_keys))
+        self.assertEqual(3, len(created.all_keys))
+        self.assertEqual(b'\0' * 32, created.last_entry_hash)
+        self.assertEqual(100, created.get_method_metadata()['versionHeight'])
+        self.assertIsNone(created.all_keys[key_pairs[-1][1].to_string()].retired_height)
+
+        replaced = identity.at_height(102)
+        self.assertEqual(bytes([2]) * 32, replaced.last_entry_hash)
+        self.assertEqual(5, len(replaced.all_keys))
+        self.assertEqual(101, replaced.all_keys[key_pairs[-1][1].to_string()].retired_height)
+        self.assertEqual(3, len(replaced.active_keys))
+
+        # Past the last replacement, the state is the current one
+        latest = identity.at_height(1000)
+        self.assertEqual(list(identity.active_keys.values()), list(latest.active_keys.values()))
+        self.assertEqual(list(identity.all_keys.values()), list(latest.all_keys.values()))
+        self.assertEqual(identity.get_did_document(), latest.get_did_document())
+        self.assertNotEqual(identity.get_etag(), latest.get_etag())
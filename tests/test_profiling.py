@@ -0,0 +1,45 @@
+import unittest
+import os
+import pstats
+import tempfile
+from src import metrics
+from src.profiling import RequestProfiler
+from concurrent.futures import ThreadPoolExecutor
+
+
+def work():
+    return sum(i * i for i in range(1000))
+
+
+class TestRequestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = os.path.join(directory.name, 'profiles')
+
+    def test_sampling(self):
+        self.assertIsNone(RequestProfiler(0, self.directory, random=lambda: 0).sample())
+        self.assertIsNone(RequestProfiler(0.5, self.directory, random=lambda: 0.5).sample())
+
+        profiler = RequestProfiler(0.5, self.directory, random=lambda: 0.25)
+        profile = profiler.sample()
+        self.assertIsNotNone(profile)
+        # One request at a time
+        self.assertIsNone(profiler.sample())
+        profile.finish('test')
+        self.assertIsNotNone(profiler.sample())
+
+    def test_profile_written(self):
+        profile = RequestProfiler(1, self.directory).sample()
+        with metrics.request_timing(profile):
+            profile.run(work)
+            # Threads working on the request are profiled along with it
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(metrics.propagate(work)).result()
+        path = profile.finish('resolve-' + '00' * 32)
+        self.assertEqual([os.path.basename(path)], os.listdir(self.directory))
+        calls = [function for (_, _, function), stat in pstats.Stats(path).stats.items() if function == 'work']
+        self.assertEqual(['work'], calls)
+        self.assertEqual(2, [stat for (_, _, function), stat in pstats.Stats(path).stats.items()
+                             if function == 'work'][0][1])
@@ -0,0 +1,31 @@
+import unittest
+import json
+from src import failover
+from src import resolver
+from src.models import IdentityNotFoundException
+
+
+class TestResolver(unittest.TestCase):
+
+    chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+
+    def test_parse_did(self):
+        self.assertEqual((self.chain_id, False), resolver.parse_did('did:factom:' + self.chain_id))
+        self.assertEqual((self.chain_id, False), resolver.parse_did('did:factom:mainnet:' + self.chain_id))
+        self.assertEqual((self.chain_id, True), resolver.parse_did('did:factom:testnet:' + self.chain_id))
+        for did in ('did:factom:foo', 'did:example:' + self.chain_id, 'did:factom:other:' + self.chain_id):
+            with self.assertRaises(resolver.InvalidDidException):
+                resolver.parse_did(did)
+
+    def test_error_status(self):
+        self.assertEqual(400, resolver.error_status(resolver.InvalidDidException())[0])
+        self.assertEqual(404, resolver.error_status(IdentityNotFoundException())[0])
+        self.assertEqual(503, resolver.error_status(failover.BackendUnavailableException())[0])
+        self.assertEqual(504, resolver.error_status(failover.ResolutionTimeoutException())[0])
+        # A backend's own ValueError isn't an invalid DID
+        self.assertEqual(500, resolver.error_status(ValueError())[0])
+
+    def test_batch_error(self):
+        self.assertEqual(404, json.loads(resolver.batch_error('did', IdentityNotFoundException()).decode())['status'])
+        with self.assertLogs('src.resolver', level='ERROR'):
+            self.assertEqual(500, json.loads(resolver.batch_error('did', KeyError()).decode())['status'])
@@ -0,0 +1,85 @@
+import unittest
+import os
+import tempfile
+from src import consts
+from src.chain_state import ChainCursor, ChainStateStore
+from src.models import Identity
+from src.shared_cache import SharedChainStateStore
+from tests.test_chain_state import create_identity
+
+
+class TestSharedChainStateStore(unittest.TestCase):
+
+    did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+    chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'shared.db')
+
+    def test_state_round_trip(self):
+        identity = create_identity(self.did, self.chain_id)
+        key = next(iter(identity.active_keys))
+        identity.all_keys[key] = identity.all_keys[key].retire(123460)
+        del identity.active_keys[key]
+
+        restored = Identity.from_state('did:factom:mainnet:' + self.chain_id, self.chain_id, identity.to_state())
+        self.assertEqual(identity.copy(restored.did).get_resolution_result(), restored.get_resolution_result())
+        self.assertEqual(identity.last_entry_hash, restored.last_entry_hash)
+
+    def test_shared_between_stores(self):
+        # Each worker has its own store, on the same database
+        worker_a = SharedChainStateStore(self.path)
+        worker_b = SharedChainStateStore(self.path)
+        identity = create_identity(self.did, self.chain_id)
+        cursor = ChainCursor('11' * 32, 123460, 5, None)
+
+        self.assertEqual((None, None), worker_b.get(consts.NETWORK_MAINNET, self.chain_id, self.did))
+        worker_a.put(consts.NETWORK_MAINNET, self.chain_id, identity, cursor)
+        stored, stored_cursor = worker_b.get(consts.NETWORK_MAINNET, self.chain_id, self.did)
+        self.assertEqual(cursor, stored_cursor)
+        self.assertEqual(identity.get_resolution_result(), stored.get_resolution_result())
+        self.assertEqual({'size': 1, 'maxSize': 100000, 'hits': 1, 'misses': 1, 'errors': 0}, worker_b.stats())
+
+    def test_never_moves_back(self):
+        store = SharedChainStateStore(self.path)
+        identity = create_identity(self.did, self.chain_id)
+        store.put(consts.NETWORK_MAINNET, self.chain_id, identity, ChainCursor('11' * 32, 123460, 5, None))
+        store.put(consts.NETWORK_MAINNET, self.chain_id, identity, ChainCursor('22' * 32, 123458, 3, None))
+        _, cursor = store.get(consts.NETWORK_MAINNET, self.chain_id, self.did)
+        self.assertEqual(5, cursor.offset)
+
+        store.put(consts.NETWORK_MAINNET, self.chain_id, create_identity(self.did, self.chain_id, stage='pending',
+                                                                         height=None), ChainCursor(None, None, 9, None))
+        _, cursor = store.get(consts.NETWORK_MAINNET, self.chain_id, self.did)
+        self.assertEqual(5, cursor.offset)
+
+    def test_eviction(self):
+        now = [0]
+        store = SharedChainStateStore(self.path, max_size=2, clock=lambda: now[0])
+        chain_ids = ['{:064x}'.format(i) for i in range(3)]
+        for chain_id in chain_ids:
+            now[0] += 1
+            store.put(consts.NETWORK_MAINNET, chain_id, create_identity(consts.DID_PREFIX + chain_id, chain_id),
+                      ChainCursor('11' * 32, 123460, 1, None))
+        store.evict()
+        self.assertEqual(2, store.stats()['size'])
+        self.assertEqual((None, None),
+                         store.get(consts.NETWORK_MAINNET, chain_ids[0], consts.DID_PREFIX + chain_ids[0]))
+
+    def test_chain_state_store_tier(self):
+        identity = create_identity(self.did, self.chain_id)
+        ChainStateStore(shared=SharedChainStateStore(self.path)).for_backend('factomd').put(
+            consts.NETWORK_MAINNET, self.chain_id, identity, ChainCursor('11' * 32, 123460, 5, None))
+
+        # Another worker's store finds the state in the shared store, then keeps it
+        shared = SharedChainStateStore(self.path)
+        store = ChainStateStore(shared=shared)
+        self.assertEqual((None, None), store.for_backend('tfa_explorer').get(consts.NETWORK_MAINNET, self.chain_id,
+                                                                            self.did))
+        for _ in range(2):
+            _, cursor = store.for_backend('factomd').get(consts.NETWORK_MAINNET, self.chain_id, self.did)
+            self.assertEqual(5, cursor.offset)
+        self.assertEqual(1, shared.hits)
+        self.assertEqual(1, len(store))
@@ -0,0 +1,82 @@
+import unittest
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.single_flight import AsyncSingleFlight, SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def run_concurrently(self, flights, function, count=8):
+        """Make count calls for the same key, releasing the first one only once all the others are waiting on it"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_function():
+            started.set()
+            release.wait()
+            return function()
+
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            futures = [executor.submit(flights.do, 'key', slow_function)]
+            started.wait()
+            futures += [executor.submit(flights.do, 'key', slow_function) for _ in range(count - 1)]
+            while flights.coalesced < count - 1:
+                threading.Event().wait(0.001)
+            release.set()
+        return futures
+
+    def test_result_shared(self):
+        calls = []
+        flights = SingleFlight()
+        futures = self.run_concurrently(flights, lambda: calls.append(1) or object())
+        self.assertEqual(1, len(calls))
+        self.assertEqual(1, len({id(f.result()) for f in futures}))
+        self.assertEqual({'inFlight': 0, 'calls': 8, 'coalesced': 7}, flights.stats())
+
+    def test_exception_shared(self):
+        def fail():
+            raise KeyError('missing')
+
+        futures = self.run_concurrently(SingleFlight(), fail)
+        for future in futures:
+            self.assertIsInstance(future.exception(), KeyError)
+
+    def test_sequential_calls_not_coalesced(self):
+        flights = SingleFlight()
+        self.assertEqual(1, flights.do('key', lambda: 1))
+        self.assertEqual(2, flights.do('key', lambda: 2))
+        self.assertEqual(0, flights.stats()['coalesced'])
+
+
+class TestAsyncSingleFlight(unittest.IsolatedAsyncioTestCase):
+
+    async def test_result_and_exception_shared(self):
+        flights = AsyncSingleFlight()
+        calls = []
+
+        async def resolve(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            if value is None:
+                raise KeyError('missing')
+            return value
+
+        results = await asyncio.gather(*[flights.do('a', resolve, i) for i in range(5)],
+                                       *[flights.do('b', resolve, None) for _ in range(3)], return_exceptions=True)
+        self.assertEqual([0, 0, 0, 0, 0], results[:5])
+        self.assertTrue(all(isinstance(r, KeyError) for r in results[5:]))
+        self.assertEqual([0, None], calls)
+
+    async def test_cancelled_waiter(self):
+        flights = AsyncSingleFlight()
+
+        async def resolve():
+            await asyncio.sleep(0.01)
+            return 'done'
+
+        first = asyncio.ensure_future(flights.do('key', resolve))
+        second = asyncio.ensure_future(flights.do('key', resolve))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertEqual('done', await second)
@@ -0,0 +1,134 @@
+import unittest
+import base64
+import hashlib
+import identitykeys
+import json
+import threading
+from src import clients
+from src import consts
+from src import tfa_explorer_connection
+from src.chain_state import ChainStateStore
+from src.config import DriverConfig
+from tests.test_factomd_jsonrpc_connection import FakeResponse
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeExplorer:
+    """An in-memory TFA Explorer API, serving the entries of a single chain"""
+
+    def __init__(self, chain_id):
+        self.chain_id = chain_id
+        self.entries = []
+        self.lock = threading.Lock()
+        self.pages = []
+        self.headers = {}
+        self.max_limit = None
+
+    def add_entry(self, external_ids, content, pending=False, height=1000):
+        entry_hash = hashlib.sha256(b''.join(external_ids) + content + str(len(self.entries)).encode()).hexdigest()
+        self.entries.append({
+            'entry_hash': entry_hash,
+            'extid_count': len(external_ids),
+            'extids': [base64.b64encode(x).decode() for x in external_ids],
+            'content': base64.b64encode(content).decode(),
+            'pending': pending,
+            'block_height': None if pending else height
+        })
+
+    def get(self, url, **kwargs):
+        url = urlparse(url)
+        query = parse_qs(url.query)
+        limit, offset = int(query['limit'][0]), int(query['offset'][0])
+        with self.lock:
+            self.pages.append((limit, offset))
+        if self.max_limit is not None:
+            limit = min(limit, self.max_limit)
+        if not url.path.endswith(self.chain_id):
+            return FakeResponse({'result': None})
+        return FakeResponse({'result': self.entries[offset:offset + limit] or None})
+
+
+class TestGetIdentity(unittest.TestCase):
+
+    did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+    chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+
+    def setUp(self):
+        self.key_pairs = [identitykeys.generate_key_pair() for _ in range(3)]
+        public_keys = [pub.to_string() for _, pub in self.key_pairs]
+        content = json.dumps({'version': 1, 'keys': public_keys}, separators=(',', ':')).encode()
+        self.explorer = FakeExplorer(self.chain_id)
+        self.explorer.add_entry([consts.IDENTITY_CHAIN_TAG, b'Test', b'v1'], content)
+        patcher = mock.patch('src.clients.PooledSession', return_value=self.explorer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(clients.reset)
+
+    def replace_key(self, old_index, signer_index):
+        _, old_pub = self.key_pairs[old_index]
+        signer_priv, signer_pub = self.key_pairs[signer_index]
+        new_priv, new_pub = identitykeys.generate_key_pair()
+        self.key_pairs[old_index] = (new_priv, new_pub)
+        message = self.chain_id.encode() + old_pub.to_string().encode() + new_pub.to_string().encode()
+        return [
+            consts.KEY_REPLACEMENT_TAG,
+            old_pub.to_string().encode(),
+            new_pub.to_string().encode(),
+            signer_priv.sign(message),
+            signer_pub.to_string().encode()
+        ], b''
+
+    def test_not_found(self):
+        with self.assertRaises(tfa_explorer_connection.models.ChainNotFoundException):
+            tfa_explorer_connection.get_identity(DriverConfig(), 'did:factom:' + '00' * 32, '00' * 32)
+
+    def test_small_chain(self):
+        self.explorer.add_entry(*self.replace_key(2, 1), height=1001)
+        identity = tfa_explorer_connection.get_identity(DriverConfig(), self.did, self.chain_id)
+        self.assertEqual({pub.to_string() for _, pub in self.key_pairs}, set(identity.active_keys))
+        self.assertEqual([(1, 0), (25, 1)], self.explorer.pages)
+
+    def test_large_chain(self):
+        # Each key replacement depends on the previous one, across several concurrently fetched pages
+        for i in range(400):
+            if i % 4 == 0:
+                self.explorer.add_entry([b'spam'], b'spam', height=1000 + i)
+            self.explorer.add_entry(*self.replace_key(2, 2), height=1000 + i)
+
+        store = ChainStateStore()
+        identity = tfa_explorer_connection.get_identity(DriverConfig(), self.did, self.chain_id, state_store=store)
+        self.assertEqual({pub.to_string() for _, pub in self.key_pairs}, set(identity.active_keys))
+        self.assertEqual(403, len(identity.all_keys))
+        _, cursor = store.get(consts.NETWORK_MAINNET, self.chain_id, self.did)
+        self.assertEqual(501, cursor.offset)
+
+        page_sizes = [limit for limit, offset in sorted(self.explorer.pages, key=lambda page: page[1])]
+        self.assertEqual([1, 25, 50, 100, 100, 100, 100], page_sizes[:7])
+
+    def test_capped_page_size(self):
+        # The API returns fewer entries per page than requested
+        self.explorer.max_limit = 40
+        for i in range(300):
+            self.explorer.add_entry(*self.replace_key(2, 2), height=1000 + i)
+
+        store = ChainStateStore()
+        identity = tfa_explorer_connection.get_identity(DriverConfig(), self.did, self.chain_id, state_store=store)
+        self.assertEqual({pub.to_string() for _, pub in self.key_pairs}, set(identity.active_keys))
+        self.assertEqual(303, len(identity.all_keys))
+        _, cursor = store.get(consts.NETWORK_MAINNET, self.chain_id, self.did)
+        self.assertEqual(301, cursor.offset)
+
+    def test_stops_at_pending(self):
+        for i in range(100):
+            self.explorer.add_entry(*self.replace_key(2, 2), height=1000 + i)
+        active_keys = {pub.to_string() for _, pub in self.key_pairs}
+        self.explorer.add_entry(*self.replace_key(1, 1), pending=True)
+        for i in range(100):
+            self.explorer.add_entry(*self.replace_key(0, 0), height=1100 + i)
+
+        store = ChainStateStore()
+        identity = tfa_explorer_connection.get_identity(DriverConfig(), self.did, self.chain_id, state_store=store)
+        self.assertEqual(active_keys, set(identity.active_keys))
+        _, cursor = store.get(consts.NETWORK_MAINNET, self.chain_id, self.did)
+        self.assertEqual(101, cursor.offset)
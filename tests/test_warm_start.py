@@ -0,0 +1,95 @@
+import unittest
+import os
+import tempfile
+from src import consts
+from src import warm_start
+from src.chain_state import ChainCursor, ChainStateStore
+from src.models import IdentityNotFoundException
+from tests.test_chain_state import create_identity
+
+
+class TestSnapshot(unittest.TestCase):
+
+    did = 'did:factom:f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+    chain_id = 'f26e1c422c657521861ced450442d0c664702f49480aec67805822edfcfee758'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'snapshot.json')
+
+    def test_round_trip(self):
+        identity = create_identity(self.did, self.chain_id)
+        store = ChainStateStore()
+        store.for_backend('factomd').put(consts.NETWORK_MAINNET, self.chain_id, identity,
+                                         ChainCursor('11' * 32, 123460, 5, None))
+        self.assertEqual(1, warm_start.save_snapshot(store, self.path))
+
+        restored = ChainStateStore()
+        self.assertEqual(1, warm_start.load_snapshot(restored, self.path))
+        stored, cursor = restored.for_backend('factomd').get(consts.NETWORK_MAINNET, self.chain_id, self.did)
+        self.assertEqual(ChainCursor('11' * 32, 123460, 5, None), cursor)
+        self.assertEqual(identity.get_resolution_result(), stored.get_resolution_result())
+
+    def test_workers_merge(self):
+        # Each worker saves its own store to the same snapshot
+        other_chain_id = '00' * 32
+        worker_a, worker_b = ChainStateStore(), ChainStateStore()
+        worker_a.put(consts.NETWORK_MAINNET, self.chain_id, create_identity(self.did, self.chain_id),
+                     ChainCursor('11' * 32, 123460, 5, None))
+        worker_b.put(consts.NETWORK_MAINNET, self.chain_id, create_identity(self.did, self.chain_id),
+                     ChainCursor('22' * 32, 123458, 3, None))
+        worker_b.put(consts.NETWORK_MAINNET, other_chain_id,
+                     create_identity(consts.DID_PREFIX + other_chain_id, other_chain_id),
+                     ChainCursor('33' * 32, 123460, 1, None))
+        self.assertEqual(1, warm_start.save_snapshot(worker_a, self.path))
+        self.assertEqual(2, warm_start.save_snapshot(worker_b, self.path))
+
+        restored = ChainStateStore()
+        self.assertEqual(2, warm_start.load_snapshot(restored, self.path))
+        _, cursor = restored.get(consts.NETWORK_MAINNET, self.chain_id, self.did)
+        self.assertEqual(5, cursor.offset)
+        _, cursor = restored.get(consts.NETWORK_MAINNET, other_chain_id, consts.DID_PREFIX + other_chain_id)
+        self.assertEqual(1, cursor.offset)
+
+    def test_starts_cold(self):
+        store = ChainStateStore()
+        self.assertEqual(0, warm_start.load_snapshot(store, self.path))
+        with open(self.path, 'w') as f:
+            f.write('{"version": 1, "states": [')
+        self.assertEqual(0, warm_start.load_snapshot(store, self.path))
+        self.assertEqual(0, len(store))
+
+    def test_writer_saves_on_stop(self):
+        store = ChainStateStore()
+        store.put(consts.NETWORK_MAINNET, self.chain_id, create_identity(self.did, self.chain_id),
+                  ChainCursor('11' * 32, 123460, 5, None))
+        writer = warm_start.SnapshotWriter(store, self.path, interval=0)
+        writer.start()
+        self.assertFalse(os.path.exists(self.path))
+        writer.stop()
+        self.assertEqual(1, warm_start.load_snapshot(ChainStateStore(), self.path))
+
+
+class TestPreload(unittest.IsolatedAsyncioTestCase):
+
+    dids = ['did:factom:' + '00' * 32, 'did:factom:' + '11' * 32, 'did:factom:' + '22' * 32]
+
+    def resolve(self, did):
+        self.resolved.append(did)
+        if did == self.dids[1]:
+            raise IdentityNotFoundException()
+
+    def setUp(self):
+        self.resolved = []
+
+    def test_preload(self):
+        self.assertEqual(2, warm_start.preload(self.resolve, self.dids, concurrency=2))
+        self.assertEqual(sorted(self.dids), sorted(self.resolved))
+
+    async def test_preload_async(self):
+        async def resolve(did):
+            self.resolve(did)
+
+        self.assertEqual(2, await warm_start.preload_async(resolve, self.dids, concurrency=2))
+        self.assertEqual(sorted(self.dids), sorted(self.resolved))